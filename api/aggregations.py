@@ -0,0 +1,154 @@
+import asyncio
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence
+
+from pypika.functions import Function as PypikaFunction
+from tortoise.expressions import Function, Q
+from tortoise.functions import Sum
+
+from api.archive import archived_rollups, archived_years
+from api.cache import expense_type_catalog
+from api.models import MonthlyExpenseRollup
+from api.money import to_rupees
+
+# Dimensions callers can group by, mapped to the rollup columns they group on
+GROUP_BY_COLUMNS = {
+    "month": ("year", "month"),
+    "expense_type": ("expense_type_id",),
+    "essential": ("really_needed",),
+}
+TOTAL_KEYS = ("actual_total_expenditure", "non_essential_expenditure", "essential_expenditure")
+
+
+class MonthBucket(Function):
+    """
+    'YYYY-MM' bucket of a datetime field, rendered for the connection's SQL dialect.
+    """
+
+    def resolve(self, model, table) -> dict:
+        function = self._resolve_field_for_model(model, table, self.field)
+        field = function["field"]
+        dialect = model._meta.db.capabilities.dialect
+        if dialect == "postgres":
+            function["field"] = PypikaFunction("to_char", field, "YYYY-MM")
+        elif dialect == "mysql":
+            function["field"] = PypikaFunction("DATE_FORMAT", field, "%Y-%m")
+        else:
+            # SQLite stores datetimes as text; keep the stored wall-clock month like the date range filters do
+            function["field"] = PypikaFunction("substr", field, 1, 7)
+        return function
+
+
+def rollup_period_filter(user_id: int, year: Optional[int] = None, month: Optional[int] = None) -> Q:
+    """
+    Same period semantics as api.filters.expense_period_filter, applied to MonthlyExpenseRollup.
+    """
+    query_filter = Q(user_id=user_id)
+    if year:
+        query_filter &= Q(year=year)
+        if month:
+            query_filter &= Q(month=month)
+    return query_filter
+
+
+def _with_essential_split(row: dict) -> dict:
+    # PostgreSQL sums bigints as numeric
+    total = int(row.pop("total") or 0)
+    non_essential = int(row.pop("non_essential") or 0)
+    row["count"] = int(row["count"] or 0)
+    if "year" in row:
+        row["month"] = f"{row.pop('year')}-{row['month']:02d}"
+    row["actual_total_expenditure"] = total
+    row["non_essential_expenditure"] = non_essential
+    row["essential_expenditure"] = total - non_essential
+    return row
+
+
+async def grouped_expense_totals(user_id: int, year: Optional[int] = None, month: Optional[int] = None,
+                                 group_by: Sequence[str] = ()) -> List[Dict]:
+    """
+    Sums the user's expenses for the period from the monthly rollups, one row per group,
+    in paise (see totals_in_rupees). group_by takes any of GROUP_BY_COLUMNS' keys; with no
+    dimensions a single row is returned.
+    """
+    unknown = set(group_by) - set(GROUP_BY_COLUMNS)
+    if unknown:
+        raise ValueError(f"Unsupported group_by dimension(s): {', '.join(sorted(unknown))}")
+
+    query = MonthlyExpenseRollup.filter(rollup_period_filter(user_id, year, month)).annotate(
+        total=Sum("total_paise"),
+        non_essential=Sum("total_paise", _filter=Q(really_needed=False)),
+        count=Sum("expense_count"),
+    )
+    columns = [column for dimension in group_by for column in GROUP_BY_COLUMNS[dimension]]
+    if columns:
+        query = query.group_by(*columns).order_by(*columns)
+
+    rows = await query.values(*columns, "total", "non_essential", "count")
+    return [_with_essential_split(row) for row in rows]
+
+
+def totals_in_rupees(row: dict) -> dict:
+    return {**row, **{key: to_rupees(row[key]) for key in TOTAL_KEYS}}
+
+
+async def expense_totals(user_id: int, year: Optional[int] = None, month: Optional[int] = None) -> Dict:
+    """
+    Returns the total, non-essential and essential expenditure for the period, in paise.
+    """
+    rows = await grouped_expense_totals(user_id, year, month)
+    return rows[0]
+
+
+async def archived_totals(user_id: int, year: Optional[int] = None, month: Optional[int] = None) -> Dict:
+    """
+    The share of expense_totals that comes from archived expenses (see api.archive), in paise.
+    Reads the archive only when the period covers an archived year.
+    """
+    totals = {key: 0 for key in TOTAL_KEYS}
+    totals["count"] = 0
+    archived = archived_years()
+    if not archived or (year and year not in archived):
+        return totals
+    for key, (total, count) in (await asyncio.to_thread(archived_rollups, user_id)).items():
+        _, archived_year, archived_month, _, really_needed = key
+        if year and (archived_year != year or (month and archived_month != month)):
+            continue
+        totals["actual_total_expenditure"] += total
+        if not really_needed:
+            totals["non_essential_expenditure"] += total
+        totals["count"] += count
+    totals["essential_expenditure"] = totals["actual_total_expenditure"] - totals["non_essential_expenditure"]
+    return totals
+
+
+async def live_expense_totals(user_id: int, year: Optional[int] = None, month: Optional[int] = None) -> Dict:
+    """
+    Like expense_totals, without the archived expenses: the totals of the rows still in the
+    database, which are all the expense list returns. archived_count is how many were left out.
+    """
+    totals = await expense_totals(user_id, year, month)
+    archived = await archived_totals(user_id, year, month)
+    live = {key: totals[key] - archived[key] for key in (*TOTAL_KEYS, "count")}
+    live["archived_count"] = archived["count"]
+    return live
+
+
+async def chart_series(user_id: int, year: Optional[int] = None, month: Optional[int] = None) -> Dict[str, List]:
+    """
+    Per-month, per-expense-type sums and counts as parallel arrays for the charts.
+    Array length is the number of (month, expense type) pairs, not the number of expenses.
+    """
+    groups = await grouped_expense_totals(user_id, year, month, ("month", "expense_type"))
+    type_names = await expense_type_catalog.names()
+
+    series = {"labels": [], "months": [], "expense_types": [], "amounts": [], "counts": []}
+    for group in groups:
+        month_label = datetime.strptime(group["month"], "%Y-%m").strftime("%B %Y")
+        type_name = type_names.get(group["expense_type_id"], "")
+        series["labels"].append(f"{type_name} - {month_label}")
+        series["months"].append(month_label)
+        series["expense_types"].append(type_name)
+        series["amounts"].append(to_rupees(group["actual_total_expenditure"]))
+        series["counts"].append(group["count"])
+    return series
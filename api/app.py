@@ -1,34 +1,64 @@
 from collections import defaultdict
 from datetime import datetime
-import io
 import json
 from fastapi import FastAPI, APIRouter, HTTPException, Query, Depends, Response, requests, status
 from starlette.middleware.sessions import SessionMiddleware
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.middleware.base import BaseHTTPMiddleware
-from fastapi.responses import JSONResponse, RedirectResponse
+from fastapi.responses import JSONResponse, RedirectResponse, StreamingResponse
 from starlette.staticfiles import StaticFiles
 from fastapi.encoders import jsonable_encoder
 from fastapi.templating import Jinja2Templates
 from tortoise.contrib.fastapi import register_tortoise
+from tortoise.transactions import in_transaction
 from api.models import (
     DailyExpenseUpdate,
     expensetpye_pydantic, expensetpye_pydantic_in, ExpenseType, ExpenseTypeUpdate,
-    daily_expense_pydantic, daily_expense_pydantic_in,
-    DailyExpense, DailyExpenseWithExpenseType
+    daily_expense_pydantic_in,
+    DailyExpense, ReportRequest, BatchExpenseDelete, BatchExpenseUpdate
 )
 from starlette.requests import Request
 
 from dotenv import dotenv_values
 from typing import List, Optional
 from authlib.integrations.starlette_client import OAuth, OAuthError
-from api.config import CLIENT_ID, CLIENT_SECRET, API_BASE_URL, DATABASE_URL, REACT_BASE_URL
+from api.aggregations import (
+    archived_totals, chart_series, expense_totals, grouped_expense_totals, live_expense_totals, totals_in_rupees,
+)
+from api.filters import MAX_YEAR, MIN_YEAR, expense_period_filter, to_utc
+from api.rollups import record_expense, unrecord_expense, user_data_version
+from api.cache import expense_type_catalog
+from api.search import ensure_search_index, search_expenses
+from api.reports import ReportFormatUnavailable, check_report_format, iter_csv_report, report_filename, report_pool
+from api.report_jobs import build_artifact, cached_report, find_artifact, report_file_response, report_status, submit_report
+from api.workers import PoolBusyError
+from api.conditional import cache_headers, not_modified, weak_etag
+from api.serialization import FastJSONResponse, dumps, expense_row, expense_rows, model_expense_dict
+from api.money import PAISE_PER_RUPEE, format_inr, paise_fields
+from api.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, fetch_expense_page, iter_expenses
+from api.batch import UnknownExpenseTypes, delete_expenses_batch, delete_period, expense_changes, owned_expense, update_expenses_batch
+from api.ingest import BulkImportError, import_expenses, read_upload
+from api.dependencies import ACCESS_TOKEN_COOKIE, create_access_token, get_current_user, require_metrics_token
+from api.oidc import provider_metadata
+from api.users import upsert_user
+from api.database import PRIMARY_CONNECTION, TORTOISE_ORM, generate_schemas
+from api.partitions import maintain_partitions
+from api.replica import ReplicaRoutingMiddleware, records_writes, use_replica
+from api.querystats import QueryBudgetExceeded, QueryBudgetMiddleware, install_query_timer, unbounded_budget
+from api.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, MetricsMiddleware, render_metrics
+from api.logging_config import configure_logging
+from api.config import ACCESS_TOKEN_TTL, BATCH_MAX_IDS, BULK_MAX_ROWS, CLIENT_ID, CLIENT_SECRET, API_BASE_URL, DATABASE_URL, OIDC_METADATA_URL, REACT_BASE_URL, REPORT_RETRY_AFTER, SECRET_KEY
 import os
-import openpyxl
 from tortoise.expressions import Q
 from fastapi.openapi.docs import get_swagger_ui_html
 from pathlib import Path
 
+configure_logging()
+
+# Period query parameters, validated so bad values are a 422 rather than a failing datetime
+MONTH_QUERY = Query(None, ge=1, le=12)
+YEAR_QUERY = Query(None, ge=MIN_YEAR, le=MAX_YEAR)
+
 static_dir = os.path.join(os.path.dirname(__file__), "static")
 # Initialize FastAPI app
 app = FastAPI()
@@ -39,7 +69,7 @@ app.mount("/static", StaticFiles(directory=static_dir), name="static")
 # ✅ Add SessionMiddleware FIRST
 app.add_middleware(
     SessionMiddleware,
-    secret_key=os.getenv("SECRET_KEY", CLIENT_SECRET),
+    secret_key=SECRET_KEY,
     session_cookie="session_id",  # ✅ Add a session cookie name
     same_site="lax",
     https_only=False  # Set to True in production
@@ -54,12 +84,19 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Per-route request metrics for /metrics; inside QueryBudgetMiddleware, whose query stats it reads
+app.add_middleware(MetricsMiddleware)
+# Counts each request's queries against QUERY_BUDGET and REQUEST_TIME_BUDGET
+app.add_middleware(QueryBudgetMiddleware)
+# Per-request state deciding whether reads go to the replica
+app.add_middleware(ReplicaRoutingMiddleware)
+
 ##app.mount("/static", StaticFiles(directory="static"), name="static")
 
 oauth = OAuth()
 oauth.register(
     name='google',
-    server_metadata_url='https://accounts.google.com/.well-known/openid-configuration',
+    server_metadata_url=OIDC_METADATA_URL,
     client_id=CLIENT_ID,
     client_secret=CLIENT_SECRET,
     client_kwargs={
@@ -82,12 +119,6 @@ templates = templates = Jinja2Templates(directory=Path(__file__).parent / "templ
 
 #     return user
 
-async def get_current_user(request: Request):
-    user = request.session.get("user")
-    if not user:
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    return user
-
 @app.get("/")
 def index(request: Request):
     user = request.session.get('user')
@@ -111,11 +142,13 @@ def welcome(request: Request):
 
 @app.get("/login")
 async def login(request: Request):
+    await provider_metadata.apply(oauth.google)
     url = request.url_for('auth')
     return await oauth.google.authorize_redirect(request, url)
 
 @app.get('/auth')
 async def auth(request: Request):
+    await provider_metadata.apply(oauth.google)
     try:
         token = await oauth.google.authorize_access_token(request)
     except OAuthError as e:
@@ -125,243 +158,426 @@ async def auth(request: Request):
         )
     
     user = token.get('userinfo')
+    response = RedirectResponse(REACT_BASE_URL+"/")
     if user:
-        request.session['user'] = dict(user)
+        # Expenses are keyed by the user's integer id, carried in the session and the token
+        user = {**user, "id": await upsert_user(user)}
+        request.session['user'] = user
+        response.set_cookie(ACCESS_TOKEN_COOKIE, create_access_token(user), max_age=ACCESS_TOKEN_TTL,
+                            httponly=True, samesite="lax")
 
-    return RedirectResponse(REACT_BASE_URL+"/")
+    return response
 
 @app.get("/user")
 def get_user(request: Request, user: dict = Depends(get_current_user)):
-    user = request.session.get("user")
-    if not user:
-        raise HTTPException(status_code=401, detail="Not authenticated")
     return JSONResponse(content={"user": user})
 
 @app.get('/logout')
 def logout(request: Request, user: dict = Depends(get_current_user)):
-    request.session.pop('user')
+    request.session.pop('user', None)
     request.session.clear()
-    return RedirectResponse('/')
+    response = RedirectResponse('/')
+    response.delete_cookie(ACCESS_TOKEN_COOKIE)
+    return response
 
 # Health Check
 @app.get("/api/health")
 def health_check():
     return {"status": "API is working!"}
 
+@app.get("/api/health/cache")
+def cache_health():
+    return {"status": "OK", "expensetype": expense_type_catalog.cache.stats()}
+
+@app.get("/api/health/reports")
+def report_pool_health():
+    return {"status": "OK", "in_flight": report_pool.in_flight, "capacity": report_pool.capacity, **report_pool.metrics}
+
 # Expense Type Endpoints
 @app.get("/expensetype")
-async def get_expensetype(user: dict = Depends(get_current_user)):
-    query = ExpenseType.all().order_by("name")  # Don't await here
-    response = await expensetpye_pydantic.from_queryset(query)  # Await here instead
-    return response
+async def get_expensetype(request: Request, user: dict = Depends(get_current_user)):
+    etag = weak_etag("expensetype", await expense_type_catalog.fingerprint())
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    return JSONResponse(content=await expense_type_catalog.all(), headers=cache_headers(etag))
 
 @app.get("/expensetype/{expensetype_id}")
 async def get_expensetype_by_id(expensetype_id: int, user: dict = Depends(get_current_user)):
-    response = await ExpenseType.get_or_none(id=expensetype_id)
+    response = await expense_type_catalog.get(expensetype_id)
     if not response:
         raise HTTPException(status_code=404, detail="Expense type not found")
-    return JSONResponse(content=jsonable_encoder(await expensetpye_pydantic.from_tortoise_orm(response)))
+    return JSONResponse(content=response)
 
-@app.post('/expensetype')
+@app.post('/expensetype', dependencies=[Depends(records_writes)])
 async def add_expensetype(expensetype_info: expensetpye_pydantic_in, 
                           user: dict = Depends(get_current_user)):
     expensetype_obj = await ExpenseType.create(**expensetype_info.dict(exclude_unset=True))
+    expense_type_catalog.invalidate()
     return JSONResponse(content=jsonable_encoder(await expensetpye_pydantic.from_tortoise_orm(expensetype_obj)))
 
-@app.put("/expensetype/{expensetype_id}")
+@app.put("/expensetype/{expensetype_id}", dependencies=[Depends(records_writes)])
 async def update_expensetype(expensetype_id: int, update_data: ExpenseTypeUpdate, user: dict = Depends(get_current_user)):
     update_count = await ExpenseType.filter(id=expensetype_id).update(name=update_data.name)
-    
+    expense_type_catalog.invalidate()
+
     if update_count == 0:
         raise HTTPException(status_code=404, detail="Expense type not found")
 
     updated_expense_type = await ExpenseType.get(id=expensetype_id)  # Fetch updated data
     return {"status": "OK", "data": jsonable_encoder(updated_expense_type)}
 
-@app.delete("/expensetype/{expensetype_id}")
+@app.delete("/expensetype/{expensetype_id}", dependencies=[Depends(records_writes)])
 async def delete_expensetype(expensetype_id: int, user: dict = Depends(get_current_user)):
     deleted_count = await ExpenseType.filter(id=expensetype_id).delete()
+    expense_type_catalog.invalidate()
     if deleted_count == 0:
         raise HTTPException(status_code=404, detail="Expense type not found")
     return {"status": "OK"}
 
 # Daily Expense Endpoints
-@app.get('/dailyexpense')
-async def all_expenses(month: Optional[int] = None, year: Optional[int] = None, 
+@app.get('/dailyexpense', dependencies=[Depends(use_replica)])
+async def all_expenses(request: Request, month: Optional[int] = MONTH_QUERY, year: Optional[int] = YEAR_QUERY, 
+                       limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+                       after: Optional[str] = None,
                        user: dict = Depends(get_current_user)):
-    user_email = user.get("email")
-    if not user_email:
+    """
+    Returns the user's expenses with the period totals.
+    - If limit or after is provided, one page ordered by (date, id) is returned
+      along with the next_cursor to pass as after, or null on the last page.
+    - Archived years (see api.archive) are left out of the rows and the totals alike,
+      and archived_count says how many of the period's expenses that is;
+      /dailyexpense/summary, /chart-data and reports include them.
+    - Answers 304 when If-None-Match carries the ETag of unchanged data.
+    """
+    user_id = user.get("id")
+    if not user_id:
         raise HTTPException(status_code=401, detail="User authentication failed")
 
-    query = DailyExpense.filter(user_email=user_email).prefetch_related('expense_type')  
-    response = await DailyExpenseWithExpenseType.from_queryset(query)
-    response_list = jsonable_encoder(response)
-
-    if month and year:
-        filtered_expenses = [
-            expense for expense in response_list
-            if expense.get("date") and
-               datetime.fromisoformat(expense["date"].replace("Z", "")).month == month and
-               datetime.fromisoformat(expense["date"].replace("Z", "")).year == year
-        ]
-    else:
-        filtered_expenses = response_list
+    if not (month and year):
+        # Month and year only filter together
+        month = year = None
+    query_filter = expense_period_filter(user_id, year, month)
+
+    etag = weak_etag(user_id, "dailyexpense", await user_data_version(user_id, year, month),
+                     await expense_type_catalog.fingerprint())
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+
+    totals = await live_expense_totals(user_id, year, month)
+
+    if limit or after:
+        try:
+            page, next_cursor = await fetch_expense_page(query_filter, limit or DEFAULT_PAGE_SIZE, after)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return FastJSONResponse(content={
+            "status": "OK",
+            **format_totals(totals),
+            "archived_count": totals["archived_count"],
+            "data": page,
+            "next_cursor": next_cursor
+        }, headers=cache_headers(etag))
+
+    filtered_expenses = await expense_rows(DailyExpense.filter(query_filter))
+
+    return FastJSONResponse(content={
+        "status": "OK",
+        **format_totals(totals),
+        "archived_count": totals["archived_count"],
+        "data": filtered_expenses
+    }, headers=cache_headers(etag))
 
-    # Ensure amount is always a float
-    total_expenditure = sum(float(expense.get("amount") or 0) for expense in filtered_expenses)
+@app.get('/dailyexpense/stream', dependencies=[Depends(unbounded_budget), Depends(use_replica)])
+async def stream_expenses(month: Optional[int] = MONTH_QUERY, year: Optional[int] = YEAR_QUERY,
+                          user: dict = Depends(get_current_user)):
+    """
+    Streams the user's expenses as NDJSON, one expense per line in (date, id) order.
+    Rows are fetched in keyset batches so memory stays bounded for any history size.
+    """
+    user_id = user.get("id")
+    if not user_id:
+        raise HTTPException(status_code=401, detail="User authentication failed")
 
-    # Filter and sum non-essential expenses
-    non_essential_expenditure = sum(
-        float(expense.get("amount") or 0) for expense in filtered_expenses if not expense.get("really_needed", False)
-    )
+    if not (month and year):
+        # Month and year only filter together
+        month = year = None
+    query_filter = expense_period_filter(user_id, year, month)
 
-    # Essential expenditure = total - non-essential
-    essential_expenditure = total_expenditure - non_essential_expenditure
+    async def ndjson_lines():
+        async for expense in iter_expenses(query_filter):
+            yield dumps(expense) + b"\n"
 
-    return JSONResponse(content={
-        "status": "OK",
-        "actual_total_expenditure": format_indian_currency(total_expenditure),  # Ensure this function handles numbers
-        "non_essential_expenditure": format_indian_currency(non_essential_expenditure),
-        "essential_expenditure": format_indian_currency(essential_expenditure),
-        "data": filtered_expenses
-    })
+    return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson")
+
+@app.get('/dailyexpense/summary', dependencies=[Depends(use_replica)])
+async def expenses_summary(month: Optional[int] = MONTH_QUERY, year: Optional[int] = YEAR_QUERY,
+                           group_by: List[str] = Query([]),
+                           user: dict = Depends(get_current_user)):
+    """
+    Returns only the expenditure totals for the given period, computed in the database.
+    - group_by may be repeated with "month", "expense_type" and/or "essential".
+    - Archived expenses are included; archived_count says how many of count they are,
+      which /dailyexpense leaves out.
+    """
+    user_id = user.get("id")
+    if not user_id:
+        raise HTTPException(status_code=401, detail="User authentication failed")
+
+    totals = await expense_totals(user_id, year, month)
+    archived = await archived_totals(user_id, year, month)
+    content = {"status": "OK", **format_totals(totals), "count": totals["count"], "archived_count": archived["count"]}
+
+    if group_by:
+        try:
+            groups = await grouped_expense_totals(user_id, year, month, group_by)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        content["groups"] = [totals_in_rupees(group) for group in groups]
+
+    return JSONResponse(content=content)
 
 @app.get('/dailyexpense/{id}')
 async def specific_expense(id: int, user: dict = Depends(get_current_user)):
-    user_email = user.get("email")
-    if not user_email:
+    user_id = user.get("id")
+    if not user_id:
         raise HTTPException(status_code=401, detail="User authentication failed")
 
-    expense = await DailyExpense.get_or_none(Q(id=id) & Q(user_email=user_email)).select_related('expense_type')
-    if not expense:
+    expense_data = await expense_row(DailyExpense.filter(Q(id=id) & Q(user_id=user_id)))
+    if not expense_data:
         raise HTTPException(status_code=404, detail="Expense not found")
 
-    expense_data = await DailyExpenseWithExpenseType.from_tortoise_orm(expense)
+    return FastJSONResponse(content={"status": "OK", "data": expense_data})
 
-    # ✅ Convert Pydantic model to JSON-safe format
-    return JSONResponse(content={"status": "OK", "data": jsonable_encoder(expense_data)})
-
-@app.get("/search-expense/{name}")
-async def search_expense_by_product(name: str, user: dict = Depends(get_current_user)):
-    user_email = user.get("email")
-    if not user_email:
+@app.get("/search-expense/{name}", dependencies=[Depends(use_replica)])
+async def search_expense_by_product(name: str, limit: int = Query(50, ge=1, le=200),
+                                    user: dict = Depends(get_current_user)):
+    user_id = user.get("id")
+    if not user_id:
         raise HTTPException(status_code=401, detail="User authentication failed")
 
     if len(name) < 3:
         raise HTTPException(status_code=400, detail="Product name must be at least 4 characters long")
 
-    expenses = await DailyExpense.filter(Q(name__icontains=name) & Q(user_email=user_email)).select_related("expense_type")
+    expense_data = await search_expenses(user_id, name, limit)
 
-    if not expenses:
+    if not expense_data:
         raise HTTPException(status_code=404, detail="No matching expenses found")
 
-    expense_data = [await DailyExpenseWithExpenseType.from_tortoise_orm(expense) for expense in expenses]
+    return FastJSONResponse(content={"status": "OK", "data": expense_data})
 
-    return JSONResponse(content={"status": "OK", "data": jsonable_encoder(expense_data)})
+@app.post('/dailyexpense/bulk', dependencies=[Depends(unbounded_budget), Depends(records_writes)])
+async def bulk_add_expenses(request: Request, skip_invalid: bool = False,
+                            user: dict = Depends(get_current_user)):
+    """
+    Imports many expenses from a JSON array body, or from a CSV/XLSX upload in the "file" form field
+    whose header row names the expense fields. Each row carries its own expense_type_id.
+    - Invalid rows are reported by row number; unless skip_invalid is set nothing is written then.
+    """
+    user_id = user.get("id")
+    if not user_id:
+        raise HTTPException(status_code=401, detail="User authentication failed")
 
-@app.post('/dailyexpense/{expensetype_id}')
+    try:
+        if request.headers.get("content-type", "").startswith("multipart/form-data"):
+            upload = (await request.form()).get("file")
+            if upload is None or isinstance(upload, str):
+                raise HTTPException(status_code=400, detail="Upload a CSV or XLSX file in the 'file' field")
+            raw_rows = await read_upload(upload)
+        else:
+            raw_rows = await request.json()
+    except (BulkImportError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if not isinstance(raw_rows, list):
+        raise HTTPException(status_code=400, detail="Expected a JSON array of expenses")
+    if len(raw_rows) > BULK_MAX_ROWS:
+        raise HTTPException(status_code=413, detail=f"At most {BULK_MAX_ROWS} rows can be imported at once")
+
+    result = await import_expenses(user_id, raw_rows, skip_invalid)
+    if result["errors"] and not result["inserted"]:
+        return JSONResponse(content={"status": "ERROR", **result}, status_code=422)
+    return JSONResponse(content={"status": "OK", **result})
+
+@app.post('/dailyexpense/{expensetype_id}', dependencies=[Depends(records_writes)])
 async def add_expense(
     expensetype_id: int, 
     expense_details: daily_expense_pydantic_in, 
     user: dict = Depends(get_current_user)
 ):
-    user_email = user.get("email")
-    if not user_email:
+    user_id = user.get("id")
+    if not user_id:
         raise HTTPException(status_code=401, detail="User authentication failed")
 
-    expense_type = await ExpenseType.get(id=expensetype_id)
+    # Validated against the cached catalog instead of a database lookup
+    expense_type = await expense_type_catalog.get(expensetype_id)
+    if not expense_type:
+        raise HTTPException(status_code=404, detail="Expense type not found")
 
-    # ✅ Convert Pydantic model to dictionary and add user_email
-    expense_data = expense_details.dict(exclude_unset=True)
-    expense_data["user_email"] = user_email  # ✅ Ensure user_email is set
+    # ✅ Convert Pydantic model to dictionary and add user_id
+    expense_data = paise_fields(expense_details.dict(exclude_unset=True, exclude={"user_email"}))
+    expense_data["user_id"] = user_id  # ✅ Ensure user_id is set
+    expense_data["date"] = to_utc(expense_data["date"])
 
     # ✅ Business logic for amount calculation
-    if expense_data.get("unit_price", 0) > 0 and expense_data.get("amount", 0) == 0: 
-        expense_data["amount"] = expense_data["quantity_purchased"] * expense_data["unit_price"]
+    if expense_data.get("unit_price_paise", 0) > 0 and expense_data.get("amount_paise", 0) == 0: 
+        expense_data["amount_paise"] = expense_details.quantity_purchased * expense_data["unit_price_paise"]
+
+    # ✅ Create expense (Make sure user_id is NOT passed separately)
+    async with in_transaction(PRIMARY_CONNECTION) as conn:
+        expense_obj = await DailyExpense.create(**expense_data, expense_type_id=expensetype_id, using_db=conn)
+        await record_expense(expense_obj, conn)
+
+    data = model_expense_dict(expense_obj, expense_type, user.get("email"))
+    return FastJSONResponse(content={"status": "OK", "data": data})
+
+@app.patch("/dailyexpense/batch", dependencies=[Depends(records_writes)])
+async def batch_update_expenses(batch: BatchExpenseUpdate, user: dict = Depends(get_current_user)):
+    """
+    Updates many expenses in one transaction, either applying "changes" to every id in "ids"
+    or applying each entry of "updates" (an id plus the fields to change) to its expense.
+    - Ids that are not the user's are reported in not_found and left untouched.
+    """
+    user_id = user.get("id")
+    if not user_id:
+        raise HTTPException(status_code=401, detail="User authentication failed")
 
-    # ✅ Create expense (Make sure user_email is NOT passed separately)
-    expense_obj = await DailyExpense.create(**expense_data, expense_type=expense_type)
+    if bool(batch.ids or batch.changes) == bool(batch.updates):
+        raise HTTPException(status_code=400, detail="Send either ids with changes, or updates")
+    if len(batch.ids) + len(batch.updates) > BATCH_MAX_IDS:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_IDS} expenses can be updated at once")
+
+    if batch.updates:
+        patches = {}
+        for patch in batch.updates:
+            patches.setdefault(patch.id, {}).update(expense_changes(patch))
+        if not all(patches.values()):
+            raise HTTPException(status_code=400, detail="Every update needs at least one field to change")
+        ids, changes = list(patches), None
+    else:
+        ids, changes, patches = batch.ids, expense_changes(batch.changes) if batch.changes else {}, None
+        if not ids or not changes:
+            raise HTTPException(status_code=400, detail="No valid fields provided for update")
 
-    response = await daily_expense_pydantic.from_tortoise_orm(expense_obj)
-    return {"status": "OK", "data": response}
+    try:
+        result = await update_expenses_batch(user_id, ids, changes, patches)
+    except UnknownExpenseTypes as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return {"status": "OK", **result}
 
-@app.delete("/dailyexpense/{dailyexpense_id}")
+@app.delete("/dailyexpense/batch", dependencies=[Depends(records_writes)])
+async def batch_delete_expenses(batch: BatchExpenseDelete, user: dict = Depends(get_current_user)):
+    """
+    Deletes the listed expenses in one transaction; ids that are not the user's are reported in not_found.
+    """
+    user_id = user.get("id")
+    if not user_id:
+        raise HTTPException(status_code=401, detail="User authentication failed")
+
+    if not batch.ids:
+        raise HTTPException(status_code=400, detail="No expense ids provided")
+    if len(batch.ids) > BATCH_MAX_IDS:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_IDS} expenses can be deleted at once")
+
+    return {"status": "OK", **await delete_expenses_batch(user_id, batch.ids)}
+
+@app.delete("/dailyexpense/{dailyexpense_id}", dependencies=[Depends(records_writes)])
 async def delete_expense(dailyexpense_id: int, user: dict = Depends(get_current_user)):
-    user_email = user.get("email")
-    if not user_email:
+    user_id = user.get("id")
+    if not user_id:
         raise HTTPException(status_code=401, detail="User authentication failed")
-    expense = await DailyExpense.get_or_none(id=dailyexpense_id, user_email=user_email)
-    if not expense:
+    async with in_transaction(PRIMARY_CONNECTION) as conn:
+        expense = await owned_expense(dailyexpense_id, user_id, conn)
+        deleted = 0
+        if expense:
+            deleted = await DailyExpense.filter(id=expense.id).using_db(conn).delete()
+        # Only the request that removed the row takes it out of the rollup
+        if deleted:
+            await unrecord_expense(expense, conn)
+    if not deleted:
         raise HTTPException(status_code=403, detail="Unauthorized or Expense not found")
-    await expense.delete()
     return {"status": "OK", "message": "Expense deleted", "data": None}
 
-@app.put("/dailyexpense/{expense_id}")
+@app.put("/dailyexpense/{expense_id}", dependencies=[Depends(records_writes)])
 async def update_daily_expense(
     expense_id: int, 
     expense: DailyExpenseUpdate, 
     user: dict = Depends(get_current_user)
 ):
-    user_email = user.get("email")
-    if not user_email:
+    user_id = user.get("id")
+    if not user_id:
         raise HTTPException(status_code=401, detail="User authentication failed")
 
-    db_expense = await DailyExpense.get_or_none(id=expense_id, user_email=user_email)
-    if not db_expense:
-        raise HTTPException(status_code=404, detail="Expense not found")
-
-    update_data = expense.dict(exclude_unset=True)
+    update_data = paise_fields(expense.dict(exclude_unset=True))
     if not update_data:
         raise HTTPException(status_code=400, detail="No valid fields provided for update")
+    if "date" in update_data:
+        update_data["date"] = to_utc(update_data["date"])
+
+    async with in_transaction(PRIMARY_CONNECTION) as conn:
+        # Read locked in the transaction, so concurrent updates unrecord the values they replace
+        db_expense = await owned_expense(expense_id, user_id, conn)
+        if not db_expense:
+            raise HTTPException(status_code=404, detail="Expense not found")
+        await unrecord_expense(db_expense, conn)
+        for key, value in update_data.items():
+            setattr(db_expense, key, value)
+        await db_expense.save(using_db=conn)
+        await record_expense(db_expense, conn)
+    expense_type = await expense_type_catalog.get(db_expense.expense_type_id)
+    data = model_expense_dict(db_expense, expense_type, user.get("email"))
+    return FastJSONResponse(content={"status": "OK", "data": data})
 
-    for key, value in update_data.items():
-        setattr(db_expense, key, value)
+## charts
+@app.get("/chart-data", dependencies=[Depends(use_replica)])
+async def get_chart_data(request: Request, month: Optional[int] = MONTH_QUERY, year: Optional[int] = YEAR_QUERY,
+                         mode: str = Query("aggregate", pattern="^(aggregate|rows)$"),
+                         user: dict = Depends(get_current_user)):
+    """
+    Returns chart data for the given month and year.
+    - mode=aggregate (default) returns per-month, per-expense-type sums and counts as columnar arrays.
+    - mode=rows returns every expense grouped by month and expense type name.
+    """
+    user_id = user.get("id")
+    if not user_id:
+        raise HTTPException(status_code=401, detail="User authentication failed")
 
-    await db_expense.save()
-    updated_expense = await daily_expense_pydantic.from_tortoise_orm(db_expense)
+    if not (month and year):
+        # Month and year only filter together
+        month = year = None
+    query_filter = expense_period_filter(user_id, year, month)
 
-    return JSONResponse(content={"status": "OK", "data": jsonable_encoder(updated_expense)})
+    etag = weak_etag(user_id, "chart-data", mode, await user_data_version(user_id, year, month),
+                     await expense_type_catalog.fingerprint())
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+
+    if mode == "aggregate":
+        return FastJSONResponse(content={"data": await chart_series(user_id, year, month)},
+                                headers=cache_headers(etag))
+
+    filtered_expenses = await DailyExpense.filter(query_filter).values(
+        "date", "name", "amount_paise", "really_needed", expense_type_name="expense_type__name"
+    )
 
-## charts
-@app.get("/chart-data")
-async def get_chart_data(month: Optional[int] = None, year: Optional[int] = None, user: dict = Depends(get_current_user)):
-    user_email = user.get("email")
-    if not user_email:
-        raise HTTPException(status_code=401, detail="User authentication failed")
-    query = DailyExpense.filter(user_email=user_email).prefetch_related('expense_type')  
-    response = await DailyExpenseWithExpenseType.from_queryset(query)
-    response_list = jsonable_encoder(response)
-
-    if month and year:
-        filtered_expenses = [
-            expense for expense in response_list
-            if expense.get("date") and
-               datetime.fromisoformat(expense["date"].replace("Z", "")).month == month and
-               datetime.fromisoformat(expense["date"].replace("Z", "")).year == year
-        ]
      # Group data
     grouped_data = defaultdict(lambda: defaultdict(list))
     for expense in filtered_expenses:
-        # Convert object to dictionary
-        expense_dict = dict(expense)
-
-        # Convert date to ISO format string if needed
-        raw_date = expense_dict['date']
-        if isinstance(raw_date, datetime):
-            raw_date = raw_date.isoformat()
-        expense_dict['date'] = raw_date
+        expense_dict = expense
 
         # Extract Year/Month and Expense Type
-        date = datetime.fromisoformat(raw_date).date()
+        date = expense_dict['date']
         year_month = date.strftime("%B %Y")  # Format as "Month Year" #f"{date.year}-{date.month:02d}"
-        expense_type = expense_dict['expense_type']['name']
+        expense_type = expense_dict['expense_type_name']
 
         ## Append expense to grouped structure
         #grouped_data[year_month][expense_type].append(expense_dict)
 
         filtered_expense = {
             "name": expense_dict['name'],
-            "amount": expense_dict['amount'],
+            "amount": expense_dict['amount_paise'] / PAISE_PER_RUPEE,
             "really_needed": expense_dict['really_needed'],
         }
         grouped_data[year_month][expense_type].append(filtered_expense)
@@ -376,7 +592,7 @@ async def get_chart_data(month: Optional[int] = None, year: Optional[int] = None
           for year_month, types in grouped_data.items()
      }
 
-    return JSONResponse(content={"data": grouped_dict}) 
+    return FastJSONResponse(content={"data": grouped_dict}, headers=cache_headers(etag))
 
     # Example data
 #     data = {
@@ -386,134 +602,150 @@ async def get_chart_data(month: Optional[int] = None, year: Optional[int] = None
 #         "lineValues": [400, 500, 450, 600],
 #     }
 
-@app.get('/download-report', response_class=Response)
+def report_pool_busy():
+    return HTTPException(
+        status_code=429,
+        detail="Too many reports are being generated, please retry shortly",
+        headers={"Retry-After": str(REPORT_RETRY_AFTER)},
+    )
+
+@app.get('/download-report', response_class=Response, dependencies=[Depends(unbounded_budget), Depends(use_replica)])
 async def download_expense_report(
-    month: Optional[int] = Query(None), 
-    year: Optional[int] = Query(...),
+    request: Request,
+    month: Optional[int] = MONTH_QUERY,
+    year: int = Query(..., ge=MIN_YEAR, le=MAX_YEAR),
+    report_format: str = Query("xlsx", alias="format", pattern="^(xlsx|csv|parquet|arrow)$"),
     user: dict = Depends(get_current_user)
 ):
     """
-    Generates an Excel (XLSX) report of expenses for the given month and year.
+    Generates a report of expenses for the given month and year.
     - If month is provided, it generates a **monthly report**.
     - If month is omitted, it generates a **yearly report**.
+    - format is xlsx (default), csv, parquet or arrow; the totals follow the rows
+      in xlsx/csv and are stored as schema metadata in parquet/arrow.
+    CSV is streamed as it is read; the other formats are cached on disk until the period's expenses change.
     """
 
-    # Fetch all expenses
-    user_email = user.get("email")
-    if not user_email:
+    user_id = user.get("id")
+    if not user_id:
         raise HTTPException(status_code=401, detail="User authentication failed")
-    query = DailyExpense.filter(user_email=user_email).prefetch_related("expense_type")
-    response = await DailyExpenseWithExpenseType.from_queryset(query)
-    response_list = jsonable_encoder(response)
-
-    # Filter based on month & year 
-    filtered_expenses = [
-        expense for expense in response_list
-        if expense.get("date") and
-           datetime.fromisoformat(expense["date"].replace("Z", "")).year == year and
-           (month is None or datetime.fromisoformat(expense["date"].replace("Z", "")).month == month)
-    ]
-
-    if not filtered_expenses:
-        return JSONResponse(content={"status": "ERROR", "message": "No expenses found for the given period"})
-
-    # Create an Excel workbook and worksheet
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = f"Expenses_{year}_{month if month else 'FullYear'}"
-
-    # Add headers
-    headers = ["Date", "Category", "Amount"]
-    ws.append(headers)
-
-    # Ensure that amount is never None, defaulting to 0
-    total_expenditure = sum(expense.get("amount") or 0 for expense in filtered_expenses)
-
-    # Ensure that expenses without "really_needed" default to False
-    non_essential_expenditure = sum(
-        (expense.get("amount") or 0) for expense in filtered_expenses if not expense.get("really_needed", False)
-    )
+    try:
+        check_report_format(report_format, year)
+    except ReportFormatUnavailable as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    report_id, path = (None, None)
+    if report_format != "csv":
+        report_id, path = await cached_report(user_id, year, month, report_format)
+
+    if path is None:
+        totals = await expense_totals(user_id, year, month)
+        if not totals["count"]:
+            return JSONResponse(content={"status": "ERROR", "message": "No expenses found for the given period"})
+
+        if report_format == "csv":
+            filename = report_filename(year, month, "csv")
+            response = StreamingResponse(iter_csv_report(user_id, year, month, totals), media_type="text/csv")
+            response.headers["Content-Disposition"] = f"attachment; filename={filename}"
+            return response
+
+        try:
+            async with report_pool.job():
+                path = await build_artifact(user_id, year, month, report_format, report_id, totals)
+        except PoolBusyError:
+            raise report_pool_busy()
+
+    return report_file_response(request, report_id, path)
+
+@app.post('/reports', status_code=202, dependencies=[Depends(use_replica)])
+async def create_report(report: ReportRequest, user: dict = Depends(get_current_user)):
+    """
+    Starts generating the report for a month or year in the background.
+    Poll GET /reports/{id} until its status is "done", then fetch its download_url.
+    """
+    user_id = user.get("id")
+    if not user_id:
+        raise HTTPException(status_code=401, detail="User authentication failed")
+    try:
+        check_report_format(report.format, report.year)
+    except ReportFormatUnavailable as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-    # Essential expenditure (all expenses - non-essential expenses)
-    essential_expenditure = total_expenditure - non_essential_expenditure
+    totals = await expense_totals(user_id, report.year, report.month)
+    if not totals["count"]:
+        return JSONResponse(content={"status": "ERROR", "message": "No expenses found for the given period"}, status_code=404)
 
-    # Add data to worksheet
-    for expense in filtered_expenses:
-        ws.append([
-            expense["date"].replace("T00:00:00Z",""),
-            expense["expense_type"]["name"],  # Assuming expense_type has a "name" field
-            expense["amount"]
-        ])
+    try:
+        job = await submit_report(user_id, report.year, report.month, report.format, totals)
+    except PoolBusyError:
+        raise report_pool_busy()
 
-    # Insert empty row before totals
-    ws.append([])
+    return JSONResponse(content=job, status_code=200 if job["status"] == "done" else 202)
 
-    # Add totals
-    ws.append(["", "Actual Total Expenditure", total_expenditure])
-    ws.append(["", "Non-Essential Expenditure", non_essential_expenditure])
-    ws.append(["", "Desired Essential Expenditure", essential_expenditure])
+@app.get('/reports/{report_id}')
+async def get_report(report_id: str, user: dict = Depends(get_current_user)):
+    user_id = user.get("id")
+    if not user_id:
+        raise HTTPException(status_code=401, detail="User authentication failed")
 
-    output = io.BytesIO()
-    wb.save(output)
-    output.seek(0)
+    job = report_status(user_id, report_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Report not found")
+    return job
 
-    # Prepare response with Excel data
-    filename = f"expenses_{year}_{month if month else 'full_year'}.xlsx"
-    response = Response(content=output.getvalue(), media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
-    response.headers["Content-Disposition"] = f"attachment; filename={filename}"
+@app.get('/reports/{report_id}/download', response_class=Response)
+async def download_report(report_id: str, request: Request, user: dict = Depends(get_current_user)):
+    user_id = user.get("id")
+    if not user_id:
+        raise HTTPException(status_code=401, detail="User authentication failed")
 
-    return response
+    path = find_artifact(user_id, report_id)
+    if not path:
+        raise HTTPException(status_code=404, detail="Report not found")
+    return report_file_response(request, report_id, path)
 
-@app.delete('/delete-expenses')
+@app.delete('/delete-expenses', dependencies=[Depends(unbounded_budget), Depends(records_writes)])
 async def delete_expenses(
-    month: Optional[int] = Query(None), 
-    year: Optional[int] = Query(...),
+    month: Optional[int] = MONTH_QUERY,
+    year: int = Query(..., ge=MIN_YEAR, le=MAX_YEAR),
     user: dict = Depends(get_current_user)
 ):
     """
     Deletes expenses for the given month and year.
     - If month is provided, it deletes the **monthly records**.
     - If month is omitted, it deletes the **entire year's records**.
+    - Rows are deleted in chunks of DELETE_CHUNK_SIZE, each in its own short transaction.
+    - Periods with archived expenses answer 409: the archive is read-only.
     """
-    
-    if year is None:
-        return JSONResponse(content={"status": "ERROR", "message": "Year is required"}, status_code=400)
-    user_email = user.get("email")
-    if not user_email:
+    user_id = user.get("id")
+    if not user_id:
         raise HTTPException(status_code=401, detail="User authentication failed")
-    # Create a filter condition for the year (and optionally for the month)
-    query_filter = Q(user_email=user_email) & Q(date__startswith=f"{year}")
-    if month:
-        # ✅ Ensure proper formatting for month filtering (YYYY-MM)
-        month_str = f"{year}-{str(month).zfill(2)}"
-        query_filter &= Q(date__startswith=month_str)
-
-    # Count the number of records before deletion
-    count = await DailyExpense.filter(query_filter).count()
+    if (await archived_totals(user_id, year, month))["count"]:
+        raise HTTPException(status_code=409, detail=f"Expenses of {year} are archived and cannot be deleted")
+    count = await delete_period(user_id, year, month)
 
     if count == 0:
         return JSONResponse(content={"status": "ERROR", "message": "No records found to delete"}, status_code=404)
 
-    # Perform deletion
-    await DailyExpense.filter(query_filter).delete()
-
     return JSONResponse(content={"status": "OK", "message": f"Deleted {count} records successfully"})
 
-def format_indian_currency(amount):
-    amount_str = f"{amount:,}"  # Default formatting with commas
-    parts = amount_str.split(",")
-
-    # Apply Indian number formatting
-    if len(parts) > 1:
-        return parts[0] + "," + ",".join(parts[1:]).replace(",", "")
-
-    return amount_str
+def format_totals(totals: dict):
+    return {
+        "actual_total_expenditure": format_inr(totals["actual_total_expenditure"]),
+        "non_essential_expenditure": format_inr(totals["non_essential_expenditure"]),
+        "essential_expenditure": format_inr(totals["essential_expenditure"]),
+    }
 
 @app.get("/docs", include_in_schema=False)
 async def custom_swagger_ui(user: dict = Depends(get_current_user)):
     """Restrict access to Swagger UI"""
     return get_swagger_ui_html(openapi_url="/openapi.json", title="API Docs")
 
+@app.get("/metrics", include_in_schema=False, dependencies=[Depends(require_metrics_token)])
+def metrics():
+    """Request metrics of this worker in the Prometheus text format; aggregates only, no user data."""
+    return Response(content=render_metrics(), media_type=METRICS_CONTENT_TYPE)
+
 @app.get("/protected-route")
 async def protected(user: dict = Depends(get_current_user)):
     return {"message": f"Hello, {user['given_name']}!"}
@@ -527,11 +759,41 @@ async def protected(user: dict = Depends(get_current_user)):
 #     add_exception_handlers=True
 # )
 
-#db_url = os.getenv("DATABASE_URL")
+# Connections and pool settings live in api.database, shared with migrate.py and aerich
 register_tortoise(
     app,
-    db_url=os.getenv("DATABASE_URL"),  # Update with your DB credentials
-    modules={"models": ["api.models"]},  # Replace "models" with your actual model module
-    generate_schemas=True,  # Automatically generate tables
+    config=TORTOISE_ORM,
+    generate_schemas=False,  # Tables are created on the primary only, by create_schema below
     add_exception_handlers=True,
 )
+
+@app.exception_handler(QueryBudgetExceeded)
+async def query_budget_exceeded(request: Request, exc: QueryBudgetExceeded):
+    return JSONResponse(status_code=500, content={"detail": str(exc)})
+
+@app.on_event("startup")
+async def create_schema():
+    await generate_schemas()
+    # Before the search index, which a new partitioned table must carry
+    await maintain_partitions()
+
+@app.on_event("startup")
+async def count_queries():
+    # Once Tortoise has imported the backends in use
+    install_query_timer()
+
+@app.on_event("startup")
+async def create_search_index():
+    # Registered after register_tortoise so the connection is ready
+    await ensure_search_index()
+
+@app.on_event("startup")
+async def load_provider_metadata():
+    # Warm from the disk cache so the first login of a fresh worker makes no discovery calls;
+    # anything missing or expired is fetched by the background refresh, not during startup
+    await provider_metadata.apply(oauth.google, refresh=False)
+    provider_metadata.start_background_refresh(oauth.google)
+
+@app.on_event("shutdown")
+async def stop_provider_metadata_refresh():
+    await provider_metadata.stop_background_refresh()
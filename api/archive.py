@@ -0,0 +1,370 @@
+"""
+Archival of closed years: their expenses move out of the database into a read-only,
+zstd-compressed Parquet dataset per year.
+
+    python -m api.archive close YEAR [--batch-size 50000]
+    python -m api.archive list
+
+close writes every expense of the year, sorted by (user_id, date, id) so a user's rows
+share few row groups, into ARCHIVE_DIR/<year>/part-<n>.parquet, then deletes them from
+the database (on PostgreSQL by dropping the year's partition when nothing else is in
+it). If any expense of the year is written meanwhile, the new part is discarded and
+nothing is deleted. Running it again for the same year adds a part with whatever was
+written to the year since.
+
+The monthly rollups keep counting archived expenses, so summaries and charts are
+unchanged; rollups.rebuild and rollups.check read the archive too. Reports merge the
+archived rows of the period with any still in the database. The expense list, stream and
+search endpoints only see rows in the database, and the list's totals leave the archive
+out to match (aggregations.live_expense_totals).
+"""
+import argparse
+import asyncio
+import heapq
+import itertools
+import os
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+try:
+    import pyarrow
+    import pyarrow.compute
+    import pyarrow.dataset
+    import pyarrow.parquet
+except ImportError:  # optional, like the Parquet and Arrow reports
+    pyarrow = None
+
+from tortoise import Tortoise
+from tortoise.backends.base.client import BaseDBAsyncClient
+from tortoise.expressions import F, Q
+from tortoise.functions import Sum
+from tortoise.transactions import in_transaction
+
+from api.config import ARCHIVE_DIR, DELETE_CHUNK_SIZE
+from api.database import PRIMARY_CONNECTION, TORTOISE_ORM, is_postgres
+from api.filters import period_bounds, to_utc
+from api.models import DailyExpense, ExpensePeriodVersion
+from api.partitions import is_partitioned, partition_name, partition_years
+
+DEFAULT_BATCH_SIZE = 50000
+
+# DailyExpense fields exported, in the order of the archive schema's columns
+FIELDS = (
+    "id", "user_id", "date", "name", "quantity_purchased", "unit_price_paise", "amount_paise",
+    "really_needed", "expense_type_id", "expense_type__name",
+)
+
+
+class ArchiveUnavailable(Exception):
+    """Raised when archived data is needed but pyarrow is not installed."""
+
+
+class ArchiveConflict(Exception):
+    """Raised when a year's expenses were written while it was being archived."""
+
+
+def _schema():
+    return pyarrow.schema([
+        ("id", pyarrow.int64()),
+        ("user_id", pyarrow.int64()),
+        ("date", pyarrow.timestamp("us", tz="UTC")),
+        ("name", pyarrow.string()),
+        ("quantity_purchased", pyarrow.int32()),
+        ("unit_price_paise", pyarrow.int64()),
+        ("amount_paise", pyarrow.int64()),
+        ("really_needed", pyarrow.bool_()),
+        ("expense_type_id", pyarrow.int64()),
+        ("expense_type_name", pyarrow.string()),
+    ])
+
+
+def _require_pyarrow():
+    if pyarrow is None:
+        raise ArchiveUnavailable("Archived years require pyarrow to be installed")
+
+
+def year_dir(year: int) -> Path:
+    return Path(ARCHIVE_DIR) / str(year)
+
+
+def _parts(year: int) -> List[Path]:
+    return sorted(year_dir(year).glob("part-*.parquet"))
+
+
+def is_archived(year: Optional[int]) -> bool:
+    return bool(year) and bool(_parts(year))
+
+
+def archived_years() -> List[int]:
+    root = Path(ARCHIVE_DIR)
+    if not root.is_dir():
+        return []
+    return sorted(int(path.name) for path in root.iterdir() if path.name.isdigit() and _parts(int(path.name)))
+
+
+def _dataset(year: int):
+    return pyarrow.dataset.dataset([str(path) for path in _parts(year)], format="parquet", schema=_schema())
+
+
+def _order(row: dict) -> tuple:
+    return to_utc(row["date"]), row["id"]
+
+
+def _scanned_rows(path: Path, columns: Dict, row_filter) -> Iterator[dict]:
+    # A part is sorted by (user_id, date, id) and scanned in order, one row group at a time
+    scanner = pyarrow.dataset.dataset(str(path), format="parquet", schema=_schema()).scanner(
+        columns=columns, filter=row_filter, use_threads=False,
+    )
+    for batch in scanner.to_batches():
+        yield from batch.to_pylist()
+
+
+def read_archived(user_id: int, year: int, month: Optional[int] = None) -> Iterator[dict]:
+    """
+    Lazily, the user's archived expenses of the period in (date, id) order, as dicts with
+    the keys api.reports reads. Row groups of other users are skipped by their statistics.
+    """
+    _require_pyarrow()
+    start, end = (to_utc(bound) for bound in period_bounds(year, month))
+    field = pyarrow.dataset.field
+    row_filter = (field("user_id") == user_id) & (field("date") >= start) & (field("date") < end)
+    columns = {"id": field("id"), "date": field("date"), "amount_paise": field("amount_paise"),
+               "expense_type__name": field("expense_type_name")}
+    return heapq.merge(*(_scanned_rows(path, columns, row_filter) for path in _parts(year)), key=_order)
+
+
+async def _archived_batches(user_id: int, year: int, month: Optional[int],
+                            batch_size: int) -> AsyncIterator[List[dict]]:
+    rows = read_archived(user_id, year, month)
+    while True:
+        # Parquet reads block, so each batch is read in a thread
+        batch = await asyncio.to_thread(lambda: list(itertools.islice(rows, batch_size)))
+        if not batch:
+            return
+        yield batch
+
+
+async def _rows(batches: AsyncIterator[List[dict]]) -> AsyncIterator[dict]:
+    async for batch in batches:
+        for row in batch:
+            yield row
+
+
+async def _merged(first: AsyncIterator[dict], second: AsyncIterator[dict]) -> AsyncIterator[dict]:
+    # Two-way merge of rows in (date, id) order; ties keep first's row first, like heapq.merge
+    a, b = await anext(first, None), await anext(second, None)
+    while a is not None and b is not None:
+        if _order(b) < _order(a):
+            yield b
+            b = await anext(second, None)
+        else:
+            yield a
+            a = await anext(first, None)
+    rest, row = (first, a) if a is not None else (second, b)
+    while row is not None:
+        yield row
+        row = await anext(rest, None)
+
+
+async def with_archived_rows(live_batches: AsyncIterator[List[dict]], user_id: int, year: int,
+                             month: Optional[int] = None, batch_size: int = 1000) -> AsyncIterator[List[dict]]:
+    """
+    Merges the period's archived expenses into live_batches (the rows still in the
+    database, in (date, id) order), yielding batches of batch_size in the same order.
+    Both sides are read a batch at a time, so memory stays bounded.
+    """
+    archived = _rows(_archived_batches(user_id, year, month, batch_size))
+    batch = []
+    async for row in _merged(archived, _rows(live_batches)):
+        batch.append(row)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def archived_rollups(user_id: Optional[int] = None) -> Dict[Tuple, Tuple[int, int]]:
+    """Rollup totals and counts of the archived expenses, keyed like api.rollups' RollupKey."""
+    years = archived_years()
+    if not years:
+        return {}
+    _require_pyarrow()
+    compute = pyarrow.compute
+    rollups = {}
+    for year in years:
+        table = _dataset(year).to_table(
+            columns=["user_id", "date", "expense_type_id", "really_needed", "amount_paise", "id"],
+            filter=(pyarrow.dataset.field("user_id") == user_id) if user_id else None,
+        )
+        table = table.append_column("year", compute.year(table["date"]))
+        table = table.append_column("month", compute.month(table["date"]))
+        grouped = table.group_by(["user_id", "year", "month", "expense_type_id", "really_needed"]).aggregate(
+            [("amount_paise", "sum"), ("id", "count")]
+        )
+        for row in grouped.to_pylist():
+            key = (row["user_id"], row["year"], row["month"], row["expense_type_id"], row["really_needed"])
+            total, count = rollups.get(key, (0, 0))
+            rollups[key] = (total + row["amount_paise_sum"], count + row["id_count"])
+    return rollups
+
+
+async def _year_version(year: int, conn: Optional[BaseDBAsyncClient] = None) -> int:
+    # Every expense write bumps its month's version, so an unchanged sum means no writes
+    totals = await (
+        ExpensePeriodVersion.filter(year=year).using_db(conn).annotate(total=Sum("version"))
+        .values_list("total", flat=True)
+    )
+    return int(totals[0] or 0)
+
+
+async def _lock_expenses(conn: BaseDBAsyncClient):
+    """Holds off expense writes until conn's transaction ends, after waiting for those in progress."""
+    if is_postgres(conn):
+        await conn.execute_script('LOCK TABLE "dailyexpense" IN SHARE ROW EXCLUSIVE MODE')
+    else:
+        # SQLite has a single writer, and the first write of a transaction takes its lock
+        await conn.execute_script('UPDATE "dailyexpense" SET "id" = "id" WHERE 0')
+
+
+def _after(user_id: int, date: datetime, expense_id: int) -> Q:
+    # Keyset condition for rows after (user_id, date, id)
+    date = to_utc(date)
+    return Q(user_id__gt=user_id) | (Q(user_id=user_id) & (Q(date__gt=date) | (Q(date=date) & Q(id__gt=expense_id))))
+
+
+def _record_batch(rows: List[tuple]):
+    columns = [list(column) for column in zip(*rows)]
+    columns[7] = [bool(value) for value in columns[7]]
+    return pyarrow.record_batch(columns, schema=_schema())
+
+
+async def export_year(year: int, path: Path, batch_size: int = DEFAULT_BATCH_SIZE) -> int:
+    """Writes the year's expenses still in the database to a new Parquet file. Returns the row count."""
+    start, end = period_bounds(year)
+    year_filter = Q(date__gte=start) & Q(date__lt=end)
+    writer = pyarrow.parquet.ParquetWriter(str(path), _schema(), compression="zstd")
+    exported, current_filter = 0, year_filter
+    try:
+        while True:
+            rows = await (
+                DailyExpense.filter(current_filter)
+                .order_by("user_id", "date", "id")
+                .limit(batch_size)
+                .values_list(*FIELDS)
+            )
+            if rows:
+                # One row group per batch
+                writer.write_batch(_record_batch(rows))
+                exported += len(rows)
+                print(f"  {year}: {exported} rows exported")
+            if len(rows) < batch_size:
+                return exported
+            last = rows[-1]
+            current_filter = year_filter & _after(last[1], last[2], last[0])
+    finally:
+        writer.close()
+
+
+async def _delete_archived(year: int, path: Path, exported: int, version: int):
+    """
+    Deletes the archived rows and bumps the year's versions in one transaction, after
+    checking under a write lock that nothing was written since the export.
+    """
+    async with in_transaction(PRIMARY_CONNECTION) as tx:
+        await _lock_expenses(tx)
+        if await _year_version(year, tx) != version:
+            raise ArchiveConflict(f"Expenses of {year} were written while it was being archived")
+
+        remaining = exported
+        if is_postgres(tx) and await is_partitioned(tx) and year in await partition_years(tx):
+            # Dropping the year's partition replaces deleting its rows one by one
+            name = partition_name(year)
+            await tx.execute_script(f'ALTER TABLE "dailyexpense" DETACH PARTITION "{name}"')
+            count = await tx.execute_query_dict(f'SELECT COUNT(*) AS "count" FROM "{name}"')
+            if count[0]["count"] > exported:
+                # Rolls the detach back
+                raise ArchiveConflict(f"Partition {name} has rows the archive lacks")
+            await tx.execute_script(f'DROP TABLE "{name}"')
+            remaining -= count[0]["count"]
+
+        if remaining:
+            # Rows of the year stored outside its partition, or everything without partitions
+            ids = pyarrow.parquet.read_table(str(path), columns=["id"])["id"].to_pylist()
+            for offset in range(0, len(ids), DELETE_CHUNK_SIZE):
+                await DailyExpense.filter(id__in=ids[offset:offset + DELETE_CHUNK_SIZE]).using_db(tx).delete()
+        # Invalidates ETags and cached reports of the year, whose rows now come from the archive
+        await ExpensePeriodVersion.filter(year=year).using_db(tx).update(version=F("version") + 1)
+
+
+async def archive_year(year: int, batch_size: int = DEFAULT_BATCH_SIZE) -> int:
+    """
+    Moves a closed year's expenses from the database to a new part of its archive.
+    Returns the number of archived rows.
+    Raises ArchiveConflict, leaving the database as it was, if the year was written meanwhile.
+    """
+    _require_pyarrow()
+    if year >= datetime.now(timezone.utc).year:
+        raise ValueError(f"{year} is not closed yet")
+
+    directory = year_dir(year)
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / f"part-{len(_parts(year)):04d}.parquet"
+    tmp = directory / f".{path.name}.tmp"
+
+    version = await _year_version(year)
+    try:
+        exported = await export_year(year, tmp, batch_size)
+        if not exported or await _year_version(year) != version:
+            tmp.unlink()
+            if exported:
+                raise ArchiveConflict(f"Expenses of {year} were written while it was being archived")
+            return 0
+        with open(tmp, "rb") as f:
+            os.fsync(f.fileno())
+        os.chmod(tmp, 0o444)
+        os.replace(tmp, path)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+    try:
+        await _delete_archived(year, path, exported, version)
+    except Exception:
+        # Nothing was deleted: the rows are still live and must not be counted twice
+        path.unlink()
+        raise
+    return exported
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["close", "list"])
+    parser.add_argument("year", type=int, nargs="?")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    if args.command == "list":
+        for year in archived_years():
+            rows = sum(pyarrow.parquet.ParquetFile(str(part)).metadata.num_rows for part in _parts(year))
+            size = sum(part.stat().st_size for part in _parts(year))
+            print(f"{year}: {rows} rows in {len(_parts(year))} part(s), {size / 1024 / 1024:.1f} MB")
+        return 0
+    if args.year is None:
+        parser.error("close needs the year to archive")
+
+    await Tortoise.init(config=TORTOISE_ORM)
+    try:
+        count = await archive_year(args.year, args.batch_size)
+        print(f"✅ {args.year}: {count} expenses archived to {year_dir(args.year)}")
+        return 0
+    except (ArchiveConflict, ValueError) as e:
+        print(f"❌ {e}")
+        return 1
+    finally:
+        await Tortoise.close_connections()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,93 @@
+"""
+Converts a database whose expenses store unit_price and amount as floating point rupees
+to integer paise.
+
+    python -m api.backfill_paise [--batch-size 5000]
+
+Stop the app first and start this release once it is done: the previous release writes
+only the float columns and this one only the paise columns. Rows are converted
+batch_size per transaction, rounding half up like the API does, then the float columns
+are dropped; on PostgreSQL the paise columns are widened to BIGINT. The monthly rollups,
+which are derived data, are recreated with paise totals and rebuilt from the converted
+rows. It is idempotent and can be rerun.
+"""
+import argparse
+import asyncio
+import sys
+
+from tortoise import Tortoise, connections
+from tortoise.backends.base.client import BaseDBAsyncClient
+from tortoise.transactions import in_transaction
+from tortoise.utils import generate_schema_for_client
+
+from api.database import PRIMARY_CONNECTION, TORTOISE_ORM, is_postgres, table_columns
+from api.money import MONEY_FIELDS, to_paise
+from api.rollups import rebuild
+
+DEFAULT_BATCH_SIZE = 5000
+
+
+async def convert_expenses(conn: BaseDBAsyncClient, batch_size: int) -> int:
+    """Fills the paise columns of dailyexpense from the float ones, in id order."""
+    first, second, third = ("$1", "$2", "$3") if is_postgres(conn) else ("?", "?", "?")
+    last_id, converted = 0, 0
+    while True:
+        async with in_transaction(PRIMARY_CONNECTION) as tx:
+            rows = await tx.execute_query_dict(
+                f'SELECT "id", "unit_price", "amount" FROM "dailyexpense" WHERE "id" > {first} '
+                f'ORDER BY "id" LIMIT {int(batch_size)}',
+                [last_id],
+            )
+            if not rows:
+                return converted
+            await tx.execute_many(
+                f'UPDATE "dailyexpense" SET "unit_price_paise" = {first}, "amount_paise" = {second} WHERE "id" = {third}',
+                [[to_paise(row["unit_price"] or 0), to_paise(row["amount"] or 0), row["id"]] for row in rows],
+            )
+        last_id = rows[-1]["id"]
+        converted += len(rows)
+        print(f"  dailyexpense: {converted} rows")
+
+
+async def migrate(batch_size: int):
+    conn = connections.get(PRIMARY_CONNECTION)
+    columns = await table_columns(conn, "dailyexpense")
+    if "amount" in columns:
+        for paise_column in MONEY_FIELDS.values():
+            if paise_column not in columns:
+                await conn.execute_script(
+                    f'ALTER TABLE "dailyexpense" ADD COLUMN "{paise_column}" BIGINT NOT NULL DEFAULT 0'
+                )
+        print(f"✅ dailyexpense: {await convert_expenses(conn, batch_size)} rows converted")
+        async with in_transaction(PRIMARY_CONNECTION) as tx:
+            for float_column in MONEY_FIELDS:
+                await tx.execute_script(f'ALTER TABLE "dailyexpense" DROP COLUMN "{float_column}"')
+    else:
+        print("✅ dailyexpense: already in paise")
+    if is_postgres(conn):
+        # Columns added as INT by earlier runs overflow above about 2.1 crore rupees; no-op once BIGINT
+        for paise_column in MONEY_FIELDS.values():
+            await conn.execute_script(f'ALTER TABLE "dailyexpense" ALTER COLUMN "{paise_column}" TYPE BIGINT')
+
+    if "total_amount" in await table_columns(conn, "monthlyexpenserollup"):
+        await conn.execute_script('DROP TABLE "monthlyexpenserollup"')
+    await generate_schema_for_client(conn, safe=True)
+    # Always rebuilt, so a rerun also repairs an interrupted rebuild
+    print(f"✅ monthlyexpenserollup: {await rebuild()} rows rebuilt")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    await Tortoise.init(config=TORTOISE_ORM)
+    try:
+        await migrate(args.batch_size)
+        return 0
+    finally:
+        await Tortoise.close_connections()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,154 @@
+"""
+Online migration of a database created before the users table, whose expenses, rollups
+and period versions identify their user by a user_email column.
+
+    python -m api.backfill_users prepare [--batch-size 5000]
+    python -m api.backfill_users finalize [--batch-size 5000]
+
+prepare runs while the previous release is still serving. It adds a nullable user_id
+column to the three tables, creates the users table and the (user_id, date) index
+(concurrently on PostgreSQL), creates a user for every email and fills user_id
+batch_size rows per transaction, so no lock is held for long. On PostgreSQL it also drops
+NOT NULL from user_email, so this release, which no longer writes it, can insert next
+to the old one. It is idempotent and can be rerun.
+
+finalize runs once this release is deployed. It backfills rows the previous release
+wrote in the meantime, then drops user_email: its index and column on dailyexpense, and
+by rebuilding the two small tables, which carry it in their unique constraints.
+
+SQLite cannot relax NOT NULL in place, so there run finalize right after deploying.
+"""
+import argparse
+import asyncio
+import sys
+
+from tortoise import Tortoise, connections
+from tortoise.backends.base.client import BaseDBAsyncClient
+from tortoise.transactions import in_transaction
+from tortoise.utils import generate_schema_for_client
+
+from api.database import PRIMARY_CONNECTION, TORTOISE_ORM, is_postgres, table_columns
+from api.models import DailyExpense
+
+USER_TABLES = ("dailyexpense", "monthlyexpenserollup", "expenseperiodversion")
+DEFAULT_BATCH_SIZE = 5000
+
+
+def _index_name(conn: BaseDBAsyncClient, *field_names: str) -> str:
+    """The name Tortoise gives an index of dailyexpense on field_names."""
+    return conn.schema_generator(conn)._generate_index_name("idx", DailyExpense, list(field_names))
+
+
+async def _create_users(conn: BaseDBAsyncClient, table: str):
+    await conn.execute_script(
+        f'INSERT INTO "users" ("email", "created_at") '
+        f'SELECT DISTINCT t."user_email", CURRENT_TIMESTAMP FROM "{table}" t '
+        f'WHERE t."user_id" IS NULL AND t."user_email" IS NOT NULL '
+        f'ON CONFLICT ("email") DO NOTHING'
+    )
+
+
+async def backfill(conn: BaseDBAsyncClient, table: str, batch_size: int) -> int:
+    """Sets user_id from user_email on every row missing it, batch_size rows per transaction."""
+    await _create_users(conn, table)
+    placeholder = "$1" if is_postgres(conn) else "?"
+    last_id, filled = 0, 0
+    while True:
+        async with in_transaction(PRIMARY_CONNECTION) as tx:
+            rows = await tx.execute_query_dict(
+                f'SELECT "id" FROM "{table}" WHERE "user_id" IS NULL AND "id" > {placeholder} '
+                f'ORDER BY "id" LIMIT {int(batch_size)}',
+                [last_id],
+            )
+            if not rows:
+                return filled
+            ids = ", ".join(str(int(row["id"])) for row in rows)
+            await tx.execute_script(
+                f'UPDATE "{table}" SET "user_id" = '
+                f'(SELECT u."id" FROM "users" u WHERE u."email" = "{table}"."user_email") '
+                f'WHERE "id" IN ({ids})'
+            )
+        last_id = rows[-1]["id"]
+        filled += len(rows)
+        print(f"  {table}: {filled} rows")
+
+
+async def prepare(batch_size: int):
+    conn = connections.get(PRIMARY_CONNECTION)
+    postgres = is_postgres(conn)
+    for table in USER_TABLES:
+        if "user_id" not in await table_columns(conn, table):
+            await conn.execute_script(f'ALTER TABLE "{table}" ADD COLUMN "user_id" INT')
+    if postgres:
+        # Built without blocking writes; generate_schemas then finds it by name
+        await conn.execute_script(
+            f'CREATE INDEX CONCURRENTLY IF NOT EXISTS "{_index_name(conn, "user_id", "date")}" '
+            f'ON "dailyexpense" ("user_id", "date")'
+        )
+    # Creates the users table and whatever else this release adds
+    await generate_schema_for_client(conn, safe=True)
+
+    for table in USER_TABLES:
+        if postgres:
+            await conn.execute_script(f'ALTER TABLE "{table}" ALTER COLUMN "user_email" DROP NOT NULL')
+            await conn.execute_script(
+                f'DO $$ BEGIN ALTER TABLE "{table}" ADD CONSTRAINT "fk_{table}_user" FOREIGN KEY ("user_id") '
+                f'REFERENCES "users" ("id") ON DELETE CASCADE NOT VALID; '
+                f'EXCEPTION WHEN duplicate_object THEN NULL; END $$'
+            )
+        print(f"✅ {table}: {await backfill(conn, table, batch_size)} rows backfilled")
+
+
+async def finalize(batch_size: int):
+    conn = connections.get(PRIMARY_CONNECTION)
+    postgres = is_postgres(conn)
+    for table in USER_TABLES:
+        if "user_email" not in await table_columns(conn, table):
+            print(f"✅ {table}: already migrated")
+            continue
+        await backfill(conn, table, batch_size)
+        missing = await conn.execute_query_dict(f'SELECT COUNT(*) AS "count" FROM "{table}" WHERE "user_id" IS NULL')
+        if missing[0]["count"]:
+            raise RuntimeError(f"{table} still has {missing[0]['count']} rows without a user")
+
+        if table == "dailyexpense":
+            old_index = _index_name(conn, "user_email", "date")
+            if postgres:
+                await conn.execute_script(f'DROP INDEX CONCURRENTLY IF EXISTS "{old_index}"')
+                await conn.execute_script(f'ALTER TABLE "{table}" VALIDATE CONSTRAINT "fk_{table}_user"')
+                await conn.execute_script(f'ALTER TABLE "{table}" ALTER COLUMN "user_id" SET NOT NULL')
+            else:
+                await conn.execute_script(f'DROP INDEX IF EXISTS "{old_index}"')
+            await conn.execute_script(f'ALTER TABLE "{table}" DROP COLUMN "user_email"')
+        else:
+            async with in_transaction(PRIMARY_CONNECTION) as tx:
+                await tx.execute_script(f'ALTER TABLE "{table}" RENAME TO "{table}_old"')
+                await generate_schema_for_client(tx, safe=True)
+                # Ids are not referenced anywhere, so the new table numbers the rows afresh.
+                # Rollup totals still in rupees are not copied; api.backfill_paise rebuilds them.
+                old_columns = set(await table_columns(tx, f"{table}_old"))
+                columns = ", ".join(
+                    f'"{column}"' for column in await table_columns(tx, table)
+                    if column != "id" and column in old_columns
+                )
+                await tx.execute_script(f'INSERT INTO "{table}" ({columns}) SELECT {columns} FROM "{table}_old"')
+                await tx.execute_script(f'DROP TABLE "{table}_old"')
+        print(f"✅ {table}: user_email dropped")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["prepare", "finalize"])
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    await Tortoise.init(config=TORTOISE_ORM)
+    try:
+        await (prepare if args.command == "prepare" else finalize)(args.batch_size)
+        return 0
+    finally:
+        await Tortoise.close_connections()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,131 @@
+"""
+Set-based batch edits of a user's expenses.
+
+Each batch is one transaction whose statement count does not grow with the number of ids:
+a SELECT ... FOR UPDATE of the user's matching rows (the ownership check, which also provides
+the rollup deltas), one UPDATE or DELETE for the whole set, and one rollup update per affected
+month, type and essential flag.
+"""
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from tortoise.backends.base.client import BaseDBAsyncClient
+from tortoise.transactions import in_transaction
+
+from api.config import DELETE_CHUNK_SIZE
+from api.database import PRIMARY_CONNECTION
+from api.filters import expense_period_filter, to_utc
+from api.models import DailyExpense, ExpenseChanges, ExpenseType
+from api.money import paise_fields
+from api.rollups import record_expenses, unrecord_expenses
+
+UPDATE_BATCH_SIZE = 500
+
+
+class UnknownExpenseTypes(ValueError):
+    def __init__(self, type_ids: Sequence[int]):
+        super().__init__(f"Expense type(s) not found: {', '.join(str(type_id) for type_id in type_ids)}")
+        self.type_ids = list(type_ids)
+
+
+def expense_changes(changes: ExpenseChanges) -> Dict:
+    """The fields set in changes, ready to write; None means "leave unchanged"."""
+    data = paise_fields(changes.model_dump(exclude_none=True, exclude={"id"}))
+    if "date" in data:
+        data["date"] = to_utc(data["date"])
+    return data
+
+
+async def _owned_expenses(user_id: int, ids: Iterable[int], conn: BaseDBAsyncClient) -> List[DailyExpense]:
+    return await (
+        DailyExpense.filter(id__in=list(ids), user_id=user_id)
+        .using_db(conn)
+        .select_for_update()
+    )
+
+
+async def owned_expense(expense_id: int, user_id: int, conn: BaseDBAsyncClient) -> Optional[DailyExpense]:
+    """The user's expense, locked until the end of conn's transaction; None if it is not theirs."""
+    expenses = await _owned_expenses(user_id, [expense_id], conn)
+    return expenses[0] if expenses else None
+
+
+async def _check_expense_types(changes: Iterable[Dict], conn: BaseDBAsyncClient):
+    type_ids = {data["expense_type_id"] for data in changes if "expense_type_id" in data}
+    if not type_ids:
+        return
+    known = set(await ExpenseType.filter(id__in=type_ids).using_db(conn).values_list("id", flat=True))
+    if type_ids - known:
+        raise UnknownExpenseTypes(sorted(type_ids - known))
+
+
+def _not_found(ids: Iterable[int], expenses: List[DailyExpense]) -> List[int]:
+    return sorted(set(ids) - {expense.id for expense in expenses})
+
+
+async def delete_expenses_batch(user_id: int, ids: Sequence[int]) -> Dict:
+    """
+    Deletes the user's expenses among ids.
+    Returns the deleted count and the ids that do not exist or belong to someone else.
+    """
+    async with in_transaction(PRIMARY_CONNECTION) as conn:
+        expenses = await _owned_expenses(user_id, ids, conn)
+        if expenses:
+            await DailyExpense.filter(id__in=[expense.id for expense in expenses]).using_db(conn).delete()
+            await unrecord_expenses(expenses, conn)
+    # The rows are locked, so the selected set is exactly what was deleted
+    return {"deleted": len(expenses), "not_found": _not_found(ids, expenses)}
+
+
+async def update_expenses_batch(user_id: int, ids: Sequence[int], changes: Optional[Dict] = None,
+                                patches: Optional[Dict[int, Dict]] = None) -> Dict:
+    """
+    Applies changes to every one of the user's expenses among ids with a single UPDATE,
+    or patches (expense id -> changes) with CASE-based bulk updates of UPDATE_BATCH_SIZE rows.
+    Returns the updated count and the ids that do not exist or belong to someone else.
+    Raises UnknownExpenseTypes if a change references a missing expense type.
+    """
+    async with in_transaction(PRIMARY_CONNECTION) as conn:
+        await _check_expense_types([changes] if changes else patches.values(), conn)
+        expenses = await _owned_expenses(user_id, ids, conn)
+        if expenses:
+            await unrecord_expenses(expenses, conn)
+            if changes:
+                await DailyExpense.filter(id__in=[expense.id for expense in expenses]).using_db(conn).update(**changes)
+                for expense in expenses:
+                    expense.update_from_dict(changes)
+            else:
+                fields = set()
+                for expense in expenses:
+                    expense.update_from_dict(patches[expense.id])
+                    fields.update(patches[expense.id])
+                await DailyExpense.bulk_update(expenses, fields=sorted(fields), batch_size=UPDATE_BATCH_SIZE,
+                                               using_db=conn)
+            await record_expenses(expenses, conn)
+    return {"updated": len(expenses), "not_found": _not_found(ids, expenses)}
+
+
+async def delete_period(user_id: int, year: int, month: Optional[int] = None,
+                        chunk_size: int = DELETE_CHUNK_SIZE) -> int:
+    """
+    Deletes the user's expenses of a month or whole year, chunk_size rows per transaction,
+    so locks are held briefly however large the period is and rollups stay exact after
+    every chunk. Chunks are walked in (date, id) order over the (user_id, date) index.
+    Returns the number of deleted rows.
+    """
+    query_filter = expense_period_filter(user_id, year, month)
+    deleted = 0
+    while True:
+        async with in_transaction(PRIMARY_CONNECTION) as conn:
+            expenses = await (
+                DailyExpense.filter(query_filter)
+                .using_db(conn)
+                .order_by("date", "id")
+                .limit(chunk_size)
+                .select_for_update()
+            )
+            if expenses:
+                await DailyExpense.filter(id__in=[expense.id for expense in expenses]).using_db(conn).delete()
+                await unrecord_expenses(expenses, conn)
+        deleted += len(expenses)
+        if len(expenses) < chunk_size:
+            return deleted
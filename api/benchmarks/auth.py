@@ -0,0 +1,100 @@
+"""
+Per-request overhead of get_current_user under concurrency.
+
+Drives a minimal app (SessionMiddleware plus one endpoint) in-process over ASGI and
+compares an unauthenticated endpoint with the same endpoint behind get_current_user,
+authenticated by the legacy session cookie, by a bearer token with the verification
+cache, and by a bearer token with the cache disabled. TokenVerifier.verify() is also
+timed on its own.
+
+Usage:
+    python -m api.benchmarks.auth --requests 5000 --concurrency 1 50
+"""
+import argparse
+import asyncio
+import base64
+import json
+import time
+
+import httpx
+import itsdangerous
+from fastapi import Depends, FastAPI
+from starlette.middleware.sessions import SessionMiddleware
+
+from api import dependencies
+from api.dependencies import TokenVerifier, create_access_token, get_current_user
+
+SECRET = "benchmark-secret-key-with-enough-entropy"
+USER = {"id": 1, "email": "bench@example.com", "name": "Bench", "given_name": "Bench", "picture": "https://example.com/p.png"}
+
+
+def build_app() -> FastAPI:
+    app = FastAPI()
+    app.add_middleware(SessionMiddleware, secret_key=SECRET, session_cookie="session_id")
+
+    @app.get("/open")
+    async def open_endpoint():
+        return {"status": "OK"}
+
+    @app.get("/private")
+    async def private_endpoint(user: dict = Depends(get_current_user)):
+        return {"status": "OK"}
+
+    return app
+
+
+def session_cookie() -> str:
+    data = base64.b64encode(json.dumps({"user": USER}).encode())
+    return itsdangerous.TimestampSigner(SECRET).sign(data).decode()
+
+
+async def run(client: httpx.AsyncClient, path: str, headers: dict, cookies: dict, requests: int, concurrency: int) -> float:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            response = await client.get(path, headers=headers, cookies=cookies)
+            assert response.status_code == 200, response.text
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    return (time.perf_counter() - start) / requests * 1e6
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 50])
+    args = parser.parse_args()
+
+    token = create_access_token(USER, secret=SECRET)
+    cached = TokenVerifier(SECRET)
+    uncached = TokenVerifier(SECRET, maxsize=0)
+    scenarios = [
+        ("no auth", "/open", {}, {}, cached),
+        ("session cookie", "/private", {}, {"session_id": session_cookie()}, cached),
+        ("token, cached", "/private", {"Authorization": f"Bearer {token}"}, {}, cached),
+        ("token, uncached", "/private", {"Authorization": f"Bearer {token}"}, {}, uncached),
+    ]
+
+    for label, verifier in (("cached", cached), ("uncached", uncached)):
+        start = time.perf_counter()
+        for _ in range(args.requests):
+            verifier.verify(token)
+        print(f"verify() {label:<9} {(time.perf_counter() - start) / args.requests * 1e6:8.2f} us/token")
+
+    transport = httpx.ASGITransport(app=build_app())
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for concurrency in args.concurrency:
+            print(f"concurrency {concurrency}")
+            baseline = None
+            for label, path, headers, cookies, verifier in scenarios:
+                dependencies.token_verifier = verifier
+                await run(client, path, headers, cookies, 100, concurrency)  # warm-up
+                per_request = await run(client, path, headers, cookies, args.requests, concurrency)
+                baseline = per_request if baseline is None else baseline
+                print(f"  {label:<16} {per_request:8.1f} us/request | overhead {per_request - baseline:7.1f} us")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,113 @@
+"""
+Throughput benchmark of bulk expense imports.
+
+For each size, times parsing the rows from CSV, then import_expenses (validation,
+the expense type check, bulk_create and the rollup update) on a fresh SQLite database.
+For comparison it also inserts --single-rows rows the way add_expense does,
+one transaction per row.
+
+Usage:
+    python -m api.benchmarks.bulk_ingest --sizes 1000 10000 100000
+"""
+import argparse
+import asyncio
+import csv
+import io
+import random
+import time
+from datetime import datetime, timedelta
+
+from tortoise.transactions import in_transaction
+
+from api.benchmarks.common import BENCH_USER_ID, temporary_database
+from api.filters import to_utc
+from api.ingest import apply_amount_rule, import_expenses, parse_csv, validate_rows
+from api.models import DailyExpense, ExpenseType
+from api.rollups import check, record_expense
+
+FIELDS = ("date", "name", "quantity_purchased", "unit_price", "amount", "really_needed", "expense_type_id")
+
+
+def synthetic_rows(count: int, expense_type_ids) -> list:
+    rng = random.Random(42)
+    start = datetime(2023, 1, 1)
+    rows = []
+    for i in range(count):
+        unit_price = round(rng.uniform(5, 200), 2)
+        rows.append({
+            "date": (start + timedelta(minutes=rng.randrange(2 * 365 * 24 * 60))).isoformat(),
+            "name": f"item {i}",
+            "quantity_purchased": rng.randint(1, 5),
+            "unit_price": unit_price,
+            "amount": 0 if rng.random() < 0.5 else unit_price,
+            "really_needed": rng.random() < 0.5,
+            "expense_type_id": rng.choice(expense_type_ids),
+        })
+    return rows
+
+
+def to_csv(rows: list) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=FIELDS)
+    writer.writeheader()
+    writer.writerows(rows)
+    return buffer.getvalue().encode()
+
+
+async def insert_one_by_one(rows: list):
+    valid, _ = validate_rows(rows)
+    for (_, row), (unit_price, amount) in zip(valid, apply_amount_rule([row for _, row in valid])):
+        async with in_transaction() as conn:
+            expense = await DailyExpense.create(
+                date=to_utc(row.date), name=row.name, quantity_purchased=row.quantity_purchased,
+                unit_price_paise=unit_price, amount_paise=amount, really_needed=row.really_needed,
+                expense_type_id=row.expense_type_id, user_id=BENCH_USER_ID, using_db=conn,
+            )
+            await record_expense(expense, conn)
+
+
+def rate(rows: int, seconds: float) -> str:
+    return f"{seconds * 1000:9.1f} ms ({rows / seconds:9.0f} rows/s)"
+
+
+async def run_size(size: int):
+    async with temporary_database():
+        expense_type_ids = [(await ExpenseType.create(name=name)).id for name in ("Groceries", "Fuel", "Rent")]
+        data = to_csv(synthetic_rows(size, expense_type_ids))
+
+        start = time.perf_counter()
+        parsed = parse_csv(data)
+        parsed_at = time.perf_counter()
+        result = await import_expenses(BENCH_USER_ID, parsed)
+        imported_at = time.perf_counter()
+        assert result["inserted"] == size and not result["errors"], result["errors"][:3]
+        assert not await check(BENCH_USER_ID)
+
+    print(f"{size:>8} rows | parse csv {rate(size, parsed_at - start)} | "
+          f"import {rate(size, imported_at - parsed_at)}")
+
+
+async def run_single_rows(count: int):
+    async with temporary_database():
+        expense_type_ids = [(await ExpenseType.create(name=name)).id for name in ("Groceries", "Fuel", "Rent")]
+        rows = synthetic_rows(count, expense_type_ids)
+        start = time.perf_counter()
+        await insert_one_by_one(rows)
+        elapsed = time.perf_counter() - start
+    print(f"{count:>8} rows | one transaction per row {rate(count, elapsed)}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--single-rows", type=int, default=1000)
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        await run_size(size)
+    if args.single_rows:
+        await run_single_rows(args.single_rows)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,64 @@
+import os
+import tempfile
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from random import Random
+from typing import Iterable, Sequence
+
+from tortoise import Tortoise
+
+from api.models import User
+
+INSERT_EXPENSE_SQL = (
+    'INSERT INTO "dailyexpense" ("date", "name", "quantity_purchased", "unit_price_paise", '
+    '"amount_paise", "really_needed", "user_id", "expense_type_id") VALUES (?, ?, ?, ?, ?, ?, ?, ?)'
+)
+BATCH_SIZE = 10000
+# Created in every temporary database
+BENCH_USER_ID = 1
+BENCH_USER_EMAIL = "bench@example.com"
+
+
+@asynccontextmanager
+async def temporary_database():
+    """
+    Initialises Tortoise against a throwaway SQLite file with the app's schema
+    and the benchmark user.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        await Tortoise.init(
+            db_url=f"sqlite://{os.path.join(tmp, 'bench.sqlite3')}",
+            modules={"models": ["api.models"]},
+        )
+        await Tortoise.generate_schemas()
+        await User.create(id=BENCH_USER_ID, email=BENCH_USER_EMAIL)
+        try:
+            yield Tortoise.get_connection("default")
+        finally:
+            await Tortoise.close_connections()
+
+
+def random_dates(rng: Random, count: int, start: datetime, end: datetime) -> Iterable[datetime]:
+    days = (end - start).days
+    for _ in range(count):
+        yield start + timedelta(days=rng.randrange(days))
+
+
+async def insert_expenses(rng: Random, dates: Iterable[datetime], user_id: int, expense_type_ids: Sequence[int]):
+    """
+    Inserts one expense per date with raw batched SQL, bypassing the ORM (and the rollups)
+    so seeding millions of rows stays fast. Dates are written as UTC like the app writes them.
+    """
+    conn = Tortoise.get_connection("default")
+    batch = []
+    for date in dates:
+        amount = rng.randrange(1000, 50000)  # paise
+        batch.append([
+            date.replace(tzinfo=timezone.utc).isoformat(" "), "item", 1, amount, amount, rng.random() < 0.5,
+            user_id, rng.choice(expense_type_ids),
+        ])
+        if len(batch) >= BATCH_SIZE:
+            await conn.execute_many(INSERT_EXPENSE_SQL, batch)
+            batch = []
+    if batch:
+        await conn.execute_many(INSERT_EXPENSE_SQL, batch)
@@ -0,0 +1,322 @@
+"""
+In-process load test of the app.
+
+Seeds a database with api.benchmarks.synthetic, starts the real app (startup hooks
+included) and drives it over ASGI, without a server or network, with signed session
+cookies of the synthetic users in place of a Google login. Each scenario sends
+--requests requests, --concurrency at a time, from randomly picked users, and reports
+latency percentiles, throughput and the process's peak RSS as JSON, which compare
+turns into a table between two runs, e.g. before and after a commit:
+
+    python -m api.benchmarks.load run --users 20 --expenses 2000 --output before.json
+    python -m api.benchmarks.load run --database-url postgres://localhost/bench --output after.json
+    python -m api.benchmarks.load compare before.json after.json
+
+Without --database-url a temporary SQLite file is used. A PostgreSQL database must be
+empty, or already seeded by an earlier run and passed with --skip-seed. The write
+scenarios add rows, the ones of add_expense being updated and deleted again, so reruns
+on a kept database see slightly more data. Peak RSS is the process's high-water mark so
+far, so it only grows from one scenario to the next.
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from random import Random
+from typing import Callable, Dict, List, Optional
+
+import httpx
+import itsdangerous
+
+try:
+    import resource
+except ImportError:  # not on Windows
+    resource = None
+
+# Fixed, so runs on different days load the same periods
+YEARS = (2023, 2024)
+BULK_ROWS = 100
+PERCENTILES = (50, 95, 99)
+
+
+class LoadContext:
+    """State shared by the scenarios of a run: the users' cookies and the expenses added."""
+
+    def __init__(self, users: List[Dict], expense_type_ids: List[int], terms: List[str], seed: int):
+        self.users = users
+        self.expense_type_ids = expense_type_ids
+        self.terms = terms
+        self.rng = Random(seed)
+        # (cookie header, expense id) of the expenses created by add_expense
+        self.created: List[tuple] = []
+
+    def user(self) -> Dict:
+        return self.rng.choice(self.users)
+
+    def period(self) -> Dict:
+        return {"year": self.rng.choice(YEARS), "month": self.rng.randint(1, 12)}
+
+    def expense(self) -> Dict:
+        return {
+            "date": datetime(self.rng.choice(YEARS), self.rng.randint(1, 12), self.rng.randint(1, 28), 12).isoformat(),
+            "name": self.rng.choice(self.terms),
+            "quantity_purchased": 1,
+            "unit_price": 0,
+            "amount": self.rng.randint(100, 500000) / 100,
+            "really_needed": self.rng.random() < 0.5,
+        }
+
+
+async def list_month(client: httpx.AsyncClient, ctx: LoadContext) -> httpx.Response:
+    return await client.get("/dailyexpense", params=ctx.period(), headers=ctx.user()["headers"])
+
+
+async def chart_data(client: httpx.AsyncClient, ctx: LoadContext) -> httpx.Response:
+    return await client.get("/chart-data", params={"year": ctx.rng.choice(YEARS)}, headers=ctx.user()["headers"])
+
+
+async def search_expense(client: httpx.AsyncClient, ctx: LoadContext) -> httpx.Response:
+    term = ctx.rng.choice(ctx.terms)[:4]
+    return await client.get(f"/search-expense/{term}", headers=ctx.user()["headers"])
+
+
+async def report_csv(client: httpx.AsyncClient, ctx: LoadContext) -> httpx.Response:
+    params = {**ctx.period(), "format": "csv"}
+    return await client.get("/download-report", params=params, headers=ctx.user()["headers"])
+
+
+async def report_xlsx(client: httpx.AsyncClient, ctx: LoadContext) -> httpx.Response:
+    # Cached on disk after the first request for a user and period
+    params = {**ctx.period(), "format": "xlsx"}
+    return await client.get("/download-report", params=params, headers=ctx.user()["headers"])
+
+
+async def add_expense(client: httpx.AsyncClient, ctx: LoadContext) -> httpx.Response:
+    headers = ctx.user()["headers"]
+    type_id = ctx.rng.choice(ctx.expense_type_ids)
+    response = await client.post(f"/dailyexpense/{type_id}", json=ctx.expense(), headers=headers)
+    if response.status_code == 200:
+        ctx.created.append((headers, response.json()["data"]["id"]))
+    return response
+
+
+async def update_expense(client: httpx.AsyncClient, ctx: LoadContext) -> httpx.Response:
+    headers, expense_id = ctx.rng.choice(ctx.created)
+    body = {**ctx.expense(), "expense_type_id": ctx.rng.choice(ctx.expense_type_ids)}
+    return await client.put(f"/dailyexpense/{expense_id}", json=body, headers=headers)
+
+
+async def delete_expense(client: httpx.AsyncClient, ctx: LoadContext) -> httpx.Response:
+    headers, expense_id = ctx.created.pop()
+    return await client.delete(f"/dailyexpense/{expense_id}", headers=headers)
+
+
+async def bulk_add(client: httpx.AsyncClient, ctx: LoadContext) -> httpx.Response:
+    rows = [{**ctx.expense(), "expense_type_id": ctx.rng.choice(ctx.expense_type_ids)} for _ in range(BULK_ROWS)]
+    return await client.post("/dailyexpense/bulk", json=rows, headers=ctx.user()["headers"])
+
+
+# In the order they run: the writes to created expenses need add_expense first
+SCENARIOS: Dict[str, Callable] = {
+    "list_month": list_month,
+    "chart_data": chart_data,
+    "search_expense": search_expense,
+    "report_csv": report_csv,
+    "report_xlsx": report_xlsx,
+    "add_expense": add_expense,
+    "update_expense": update_expense,
+    "delete_expense": delete_expense,
+    "bulk_add": bulk_add,
+}
+
+
+def peak_rss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def summarize(latencies: List[float], statuses: Dict[int, int], elapsed: float) -> Dict:
+    cuts = statistics.quantiles(latencies, n=100, method="inclusive") if len(latencies) > 1 else latencies * 99
+    return {
+        "requests": len(latencies),
+        "errors": sum(count for status, count in statuses.items() if status >= 400),
+        "statuses": {str(status): count for status, count in sorted(statuses.items())},
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 3),
+        **{f"p{p}_ms": round(cuts[p - 1] * 1000, 3) for p in PERCENTILES},
+        "max_ms": round(max(latencies) * 1000, 3),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+async def run_scenario(client: httpx.AsyncClient, ctx: LoadContext, scenario: Callable,
+                       requests: int, concurrency: int) -> Dict:
+    latencies, statuses = [], {}
+    pending = iter(range(requests))
+
+    async def worker():
+        for _ in pending:
+            start = time.perf_counter()
+            response = await scenario(client, ctx)
+            latencies.append(time.perf_counter() - start)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, statuses, time.perf_counter() - start)
+
+
+def session_headers(user: Dict, secret: str) -> Dict:
+    # The cookie SessionMiddleware would have set after /auth
+    data = base64.b64encode(json.dumps({"user": user}).encode())
+    cookie = itsdangerous.TimestampSigner(secret).sign(data).decode()
+    return {"Cookie": f"session_id={cookie}"}
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(__file__)).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def configure_environment(args, tmp: str):
+    # api.config reads these on import, so they are set before the app is imported
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite://{os.path.join(tmp, 'load.sqlite3')}"
+    os.environ.pop("DATABASE_REPLICA_URL", None)
+    os.environ.setdefault("SECRET_KEY", "load-test-secret")
+    os.environ["REPORTS_DIR"] = os.path.join(tmp, "reports")
+    os.environ["ARCHIVE_DIR"] = os.path.join(tmp, "archive")
+    os.environ["OIDC_CACHE_FILE"] = os.path.join(tmp, "oidc_cache.json")
+    # No identity provider is contacted: logins are replaced by session cookies
+    stub = os.path.join(tmp, "oidc_stub.json")
+    with open(stub, "w") as f:
+        json.dump({"metadata": {}, "jwks": {"keys": []}}, f)
+    os.environ["OIDC_STUB_FILE"] = stub
+
+
+async def run(args) -> Dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        configure_environment(args, tmp)
+        from api.app import app
+        from api.benchmarks.synthetic import generate, search_terms, user_email
+        from api.config import SECRET_KEY
+        from api.models import DailyExpense, ExpenseType, User
+
+        async with app.router.lifespan_context(app):
+            dialect = DailyExpense._meta.db.capabilities.dialect
+            if not args.skip_seed:
+                if await DailyExpense.exists():
+                    raise SystemExit("The database already has expenses; use an empty one or pass --skip-seed")
+                start = time.perf_counter()
+                await generate(args.users, args.expenses, args.seed)
+                print(f"Seeded {args.users} users x {args.expenses} expenses in {time.perf_counter() - start:.1f} s",
+                      file=sys.stderr)
+
+            emails = [user_email(index) for index in range(args.users)]
+            users = await User.filter(email__in=emails).order_by("id").values("id", "email", "name")
+            if not users:
+                raise SystemExit("No synthetic users in the database; run without --skip-seed first")
+            users = [
+                {"id": user["id"], "headers": session_headers(
+                    {"id": user["id"], "email": user["email"], "name": user["name"], "given_name": user["name"]},
+                    SECRET_KEY,
+                )}
+                for user in users
+            ]
+            type_ids = list(await ExpenseType.all().order_by("id").values_list("id", flat=True))
+            ctx = LoadContext(users, type_ids, list(search_terms()), args.seed)
+
+            results = {}
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://load") as client:
+                for name, scenario in SCENARIOS.items():
+                    if args.scenarios and name not in args.scenarios:
+                        continue
+                    if name in ("update_expense", "delete_expense") and not ctx.created:
+                        print(f"Skipping {name}: it needs the expenses of add_expense", file=sys.stderr)
+                        continue
+                    requests = min(args.requests, len(ctx.created)) if name == "delete_expense" else args.requests
+                    results[name] = await run_scenario(client, ctx, scenario, requests, args.concurrency)
+                    print(f"{name:<16} p50 {results[name]['p50_ms']:9.2f} ms | p99 {results[name]['p99_ms']:9.2f} ms"
+                          f" | {results[name]['throughput_rps']:8.1f} req/s | errors {results[name]['errors']}",
+                          file=sys.stderr)
+
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "database": dialect,
+            "users": args.users,
+            "expenses_per_user": args.expenses,
+            "seed": args.seed,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+        },
+        "scenarios": results,
+    }
+
+
+def compare(base_path: str, new_path: str):
+    with open(base_path) as f:
+        base = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f"{base['meta']['commit'] or base_path} -> {new['meta']['commit'] or new_path}")
+    print(f"{'scenario':<16} {'p50 ms':>20} {'p95 ms':>20} {'p99 ms':>20} {'req/s':>20}")
+    for name, result in new["scenarios"].items():
+        before = base["scenarios"].get(name)
+        cells = []
+        for key in ("p50_ms", "p95_ms", "p99_ms", "throughput_rps"):
+            if before is None or not before[key]:
+                cells.append(f"{result[key]:>20.2f}")
+            else:
+                cells.append(f"{result[key]:>11.2f} ({(result[key] - before[key]) / before[key]:+6.1%})")
+        print(f"{name:<16} {' '.join(cells)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run")
+    run_parser.add_argument("--database-url", help="defaults to a temporary SQLite file")
+    run_parser.add_argument("--users", type=int, default=20)
+    run_parser.add_argument("--expenses", type=int, default=2000, help="per user")
+    run_parser.add_argument("--seed", type=int, default=42)
+    run_parser.add_argument("--skip-seed", action="store_true", help="reuse the synthetic data of an earlier run")
+    run_parser.add_argument("--requests", type=int, default=500, help="per scenario")
+    run_parser.add_argument("--concurrency", type=int, default=8)
+    run_parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS))
+    run_parser.add_argument("--output", help="JSON results file; printed to stdout if omitted")
+    compare_parser = commands.add_parser("compare")
+    compare_parser.add_argument("base")
+    compare_parser.add_argument("new")
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        compare(args.base, args.new)
+        return
+    results = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""
+Overhead of the request instrumentation.
+
+Times a query on a temporary SQLite database with and without the wrapper that
+install_query_timer() installs, then drives a minimal app in-process over ASGI, with
+QueryBudgetMiddleware as in the app, with and without MetricsMiddleware. Both alternate
+rounds and keep the best of each so background noise cancels out. Endpoints are a trivial one and one listing expenses.
+The cost of a log call is also compared between a plain FileHandler, the standard
+QueueHandler and the FastQueueHandler of api.logging_config.
+
+Usage:
+    python -m api.benchmarks.metrics --requests 300 --rows 100
+"""
+import argparse
+import asyncio
+import logging
+import os
+import queue
+import random
+import tempfile
+import time
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
+
+import httpx
+from fastapi import FastAPI
+
+from api.benchmarks.common import BENCH_USER_ID, insert_expenses, random_dates, temporary_database
+from api.logging_config import FastQueueHandler
+from api.metrics import MetricsMiddleware
+from api.models import DailyExpense, ExpenseType
+from api.querystats import QueryBudgetMiddleware, QueryStats, _current_stats, install_query_timer
+from api.serialization import FastJSONResponse, expense_rows
+
+# Many short rounds: the best of each is steadier on a busy machine than a few long ones
+ROUNDS = 30
+
+
+def build_app(instrumented: bool) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/ping")
+    async def ping():
+        return FastJSONResponse({"status": "OK"})
+
+    @app.get("/expenses")
+    async def expenses(limit: int):
+        data = await expense_rows(DailyExpense.filter(user_id=BENCH_USER_ID).order_by("date").limit(limit))
+        return FastJSONResponse({"status": "OK", "data": data})
+
+    if instrumented:
+        app.add_middleware(MetricsMiddleware)
+    app.add_middleware(QueryBudgetMiddleware)
+    return app
+
+
+async def run(client: httpx.AsyncClient, path: str, requests: int) -> float:
+    start = time.perf_counter()
+    for _ in range(requests):
+        response = await client.get(path)
+        assert response.status_code == 200, response.text
+    return (time.perf_counter() - start) / requests * 1e6
+
+
+async def time_queries(conn, queries: int) -> list:
+    untimed = type(conn).execute_query_dict
+    install_query_timer()
+    timed = type(conn).execute_query_dict
+    variants = [("untimed", untimed), ("timed", timed)]
+    best = [float("inf")] * len(variants)
+    token = _current_stats.set(QueryStats())
+    try:
+        for _ in range(ROUNDS):
+            for i, (_, execute) in enumerate(variants):
+                start = time.perf_counter()
+                for _ in range(queries):
+                    await execute(conn, "SELECT 1")
+                best[i] = min(best[i], (time.perf_counter() - start) / queries * 1e6)
+    finally:
+        _current_stats.reset(token)
+    return [(label, per_query) for (label, _), per_query in zip(variants, best)]
+
+
+async def time_requests(path: str, requests: int) -> list:
+    apps = [("bare", build_app(False)), ("metrics", build_app(True))]
+    clients = [httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") for _, app in apps]
+    best = [float("inf")] * len(apps)
+    for client in clients:
+        await run(client, path, 100)  # warm-up
+    for _ in range(ROUNDS):
+        for i, client in enumerate(clients):
+            best[i] = min(best[i], await run(client, path, requests))
+    for client in clients:
+        await client.aclose()
+    return [(label, per_request) for (label, _), per_request in zip(apps, best)]
+
+
+def print_overhead(label: str, per_request: float, baseline: float):
+    overhead = per_request - baseline
+    print(f"  {label:<10} {per_request:8.1f} us | overhead {overhead:6.1f} us ({overhead / baseline:+.1%})")
+
+
+def time_logging(records: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        logger = logging.getLogger("api.benchmarks.metrics.log")
+        logger.propagate = False
+        file_handler = logging.FileHandler(os.path.join(tmp, "bench.log"))
+        log_queue = queue.SimpleQueue()
+        listener = QueueListener(log_queue, file_handler)
+        listener.start()
+        handlers = (("FileHandler", file_handler), ("QueueHandler", QueueHandler(log_queue)),
+                    ("FastQueueHandler", FastQueueHandler(log_queue)))
+        for label, handler in handlers:
+            logger.handlers = [handler]
+            start = time.perf_counter()
+            for i in range(records):
+                logger.warning("request %s ran %s queries", i, 3)
+            print(f"log call {label:<16} {(time.perf_counter() - start) / records * 1e6:6.2f} us/record")
+        listener.stop()
+        file_handler.close()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=300, help="Requests (and queries) per round")
+    parser.add_argument("--rows", type=int, default=100)
+    args = parser.parse_args()
+
+    time_logging(args.requests * 10)
+
+    async with temporary_database() as conn:
+        expense_types = [await ExpenseType.create(name=name) for name in ("Groceries", "Fuel", "Rent")]
+        rng = random.Random(42)
+        dates = random_dates(rng, args.rows * 10, datetime(2020, 1, 1), datetime(2025, 1, 1))
+        await insert_expenses(rng, dates, BENCH_USER_ID, [expense_type.id for expense_type in expense_types])
+
+        print("SELECT 1")
+        timings = await time_queries(conn, args.requests)
+        for label, per_query in timings:
+            print_overhead(label, per_query, timings[0][1])
+
+        for path in ("/ping", f"/expenses?limit={args.rows}"):
+            print(path)
+            timings = await time_requests(path, args.requests)
+            for label, per_request in timings:
+                print_overhead(label, per_request, timings[0][1])
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
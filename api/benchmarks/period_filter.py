@@ -0,0 +1,86 @@
+"""
+Benchmark for the month/year query path of /dailyexpense.
+
+Seeds a SQLite database with a growing history for one user and measures how long
+the endpoint's code takes to load a single month: the whole month through
+expense_rows, and the month page by page through fetch_expense_page. The month always
+holds the same number of rows, so with the (user_id, date) index the latency should
+stay flat as history grows.
+
+Usage:
+    python -m api.benchmarks.period_filter --sizes 1000 10000 100000 1000000
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from datetime import datetime
+
+from api.benchmarks.common import BENCH_USER_ID, insert_expenses, random_dates, temporary_database
+from api.filters import expense_period_filter
+from api.models import DailyExpense, ExpenseType
+from api.pagination import DEFAULT_PAGE_SIZE, fetch_expense_page
+from api.serialization import expense_rows
+
+TARGET_YEAR = 2024
+TARGET_MONTH = 6
+ROWS_IN_TARGET_MONTH = 200
+
+
+async def seed(history_rows: int):
+    expense_type = await ExpenseType.create(name="Groceries")
+    rng = random.Random(42)
+    history = random_dates(rng, history_rows, datetime(1900, 1, 1), datetime(TARGET_YEAR, 1, 1))
+    await insert_expenses(rng, history, BENCH_USER_ID, [expense_type.id])
+    month = random_dates(rng, ROWS_IN_TARGET_MONTH, datetime(TARGET_YEAR, TARGET_MONTH, 1),
+                         datetime(TARGET_YEAR, TARGET_MONTH + 1, 1))
+    await insert_expenses(rng, month, BENCH_USER_ID, [expense_type.id])
+
+
+async def load_month():
+    return await expense_rows(DailyExpense.filter(expense_period_filter(BENCH_USER_ID, TARGET_YEAR, TARGET_MONTH)))
+
+
+async def page_month():
+    query_filter = expense_period_filter(BENCH_USER_ID, TARGET_YEAR, TARGET_MONTH)
+    rows, cursor = await fetch_expense_page(query_filter, DEFAULT_PAGE_SIZE)
+    while cursor:
+        page, cursor = await fetch_expense_page(query_filter, DEFAULT_PAGE_SIZE, cursor)
+        rows += page
+    return rows
+
+
+async def time_ms(load, repeat: int):
+    rows = await load()  # warm-up
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await load()
+        timings.append((time.perf_counter() - start) * 1000)
+    return rows, timings
+
+
+async def run_size(history_rows: int, repeat: int):
+    async with temporary_database():
+        await seed(history_rows)
+        results = [(label, *await time_ms(load, repeat))
+                   for label, load in (("whole", load_month), ("paged", page_month))]
+
+    for label, rows, timings in results:
+        print(f"{history_rows:>10} rows | {label} | {len(rows)} in month | "
+              f"median {statistics.median(timings):7.2f} ms | max {max(timings):7.2f} ms")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000, 1000000])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        await run_size(size, args.repeat)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
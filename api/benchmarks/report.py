@@ -0,0 +1,70 @@
+"""
+Benchmark for XLSX report generation.
+
+Seeds a year of expenses for one user and builds the /download-report workbook,
+reporting wall time, peak Python heap (tracemalloc) and file size. The workbook is built
+twice: once untraced for the wall time, since tracemalloc slows allocation-heavy code
+several times over, and once traced for the peak heap. The streaming write-only path
+should keep peak heap roughly flat as the report grows.
+Wall time is dominated by openpyxl's XML writer; installing lxml speeds it up considerably.
+
+Usage:
+    python -m api.benchmarks.report --sizes 10000 100000 1000000
+"""
+import argparse
+import asyncio
+import random
+import time
+import tracemalloc
+from datetime import datetime
+
+from api.aggregations import expense_totals
+from api.benchmarks.common import BENCH_USER_ID, insert_expenses, random_dates, temporary_database
+from api.models import ExpenseType
+from api.reports import write_xlsx_report
+from api.rollups import rebuild
+
+YEAR = 2024
+
+
+async def build_report():
+    totals = await expense_totals(BENCH_USER_ID, YEAR)
+    return await write_xlsx_report(BENCH_USER_ID, YEAR, None, totals)
+
+
+async def run_size(rows: int):
+    async with temporary_database():
+        expense_types = [await ExpenseType.create(name=f"Type {i}") for i in range(10)]
+        rng = random.Random(42)
+        dates = random_dates(rng, rows, datetime(YEAR, 1, 1), datetime(YEAR + 1, 1, 1))
+        await insert_expenses(rng, dates, BENCH_USER_ID, [expense_type.id for expense_type in expense_types])
+        await rebuild(BENCH_USER_ID)
+
+        start = time.perf_counter()
+        output = await build_report()
+        elapsed = time.perf_counter() - start
+        output.seek(0, 2)
+        size = output.tell()
+        output.close()
+
+        tracemalloc.start()
+        try:
+            (await build_report()).close()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+    print(f"{rows:>10} rows | {elapsed:8.2f} s | peak heap {peak / 2**20:8.1f} MiB | file {size / 2**20:8.1f} MiB")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        await run_size(size)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,80 @@
+"""
+Micro-benchmark of the /dailyexpense response serialization.
+
+Compares the former path (model instances -> DailyExpenseWithExpenseType ->
+jsonable_encoder -> stdlib json in JSONResponse) with expense_rows() and
+FastJSONResponse (.values_list() tuples -> dicts -> orjson bytes), timing the
+database fetch, the conversion to plain data and the encoding separately.
+
+Usage:
+    python -m api.benchmarks.serialization --sizes 100 1000 10000
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from datetime import datetime
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from api.benchmarks.common import BENCH_USER_ID, insert_expenses, random_dates, temporary_database
+from api.models import DailyExpense, DailyExpenseWithExpenseType, ExpenseType
+from api.serialization import FastJSONResponse, expense_rows
+
+
+async def pydantic_path():
+    query = DailyExpense.filter(user_id=BENCH_USER_ID).prefetch_related("expense_type")
+    start = time.perf_counter()
+    models = await DailyExpenseWithExpenseType.from_queryset(query)
+    fetched = time.perf_counter()
+    data = jsonable_encoder(models)
+    converted = time.perf_counter()
+    body = JSONResponse(content={"status": "OK", "data": data}).body
+    encoded = time.perf_counter()
+    return body, (fetched - start, converted - fetched, encoded - converted)
+
+
+async def fast_path():
+    start = time.perf_counter()
+    data = await expense_rows(DailyExpense.filter(user_id=BENCH_USER_ID))
+    fetched = time.perf_counter()
+    body = FastJSONResponse(content={"status": "OK", "data": data}).body
+    encoded = time.perf_counter()
+    return body, (fetched - start, 0.0, encoded - fetched)
+
+
+def report(label: str, timings: list):
+    fetch, convert, encode = (statistics.median(stage) * 1000 for stage in zip(*timings))
+    total = statistics.median(sum(run) for run in timings) * 1000
+    print(f"  {label:<9} total {total:8.2f} ms | fetch {fetch:8.2f} | convert {convert:8.2f} | encode {encode:8.2f}")
+
+
+async def run_size(rows: int, repeat: int):
+    async with temporary_database():
+        expense_types = [await ExpenseType.create(name=name) for name in ("Groceries", "Fuel", "Rent")]
+        rng = random.Random(42)
+        dates = random_dates(rng, rows, datetime(2020, 1, 1), datetime(2025, 1, 1))
+        await insert_expenses(rng, dates, BENCH_USER_ID, [expense_type.id for expense_type in expense_types])
+
+        print(f"{rows:>8} rows")
+        for label, path in (("pydantic", pydantic_path), ("orjson", fast_path)):
+            body, _ = await path()  # warm-up
+            timings = [(await path())[1] for _ in range(repeat)]
+            report(label, timings)
+        print(f"  body {len(body) / 1024:.1f} KiB")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        await run_size(size, args.repeat)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
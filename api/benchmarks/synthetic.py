@@ -0,0 +1,93 @@
+"""
+Deterministic synthetic data: users with a history of expenses spread over expense types
+the way a household's spending is, many small grocery and transport entries and a
+monthly rent.
+
+The same seed, user count and expense count always give the same rows, and each user's
+rows depend only on the seed and the user's index, so growing --users keeps the
+existing users' histories. Everything is written through the ORM, so it works on SQLite
+and PostgreSQL alike; the monthly rollups are rebuilt afterwards.
+"""
+import math
+from datetime import datetime, timedelta, timezone
+from random import Random
+from typing import Dict, List, Sequence
+
+from api.models import DailyExpense, ExpenseType, User
+from api.rollups import rebuild
+
+# Name, share of expenses, amount range in rupees, share that is essential, item names
+EXPENSE_TYPES = (
+    ("Groceries", 30, (40, 3000), 0.9, ("Milk", "Rice", "Vegetables", "Atta", "Fruit", "Eggs", "Dal")),
+    ("Transport", 12, (20, 800), 0.7, ("Metro card", "Auto", "Cab", "Bus pass", "Parking")),
+    ("Dining Out", 12, (120, 2500), 0.2, ("Dinner", "Lunch", "Coffee", "Pizza", "Biryani")),
+    ("Fuel", 8, (200, 4000), 0.8, ("Petrol", "Diesel", "CNG")),
+    ("Shopping", 9, (300, 12000), 0.3, ("Shoes", "Shirt", "Headphones", "Books", "Kurta")),
+    ("Entertainment", 7, (100, 2000), 0.1, ("Movie tickets", "Streaming", "Concert")),
+    ("Utilities", 6, (250, 6000), 1.0, ("Electricity bill", "Water bill", "Broadband", "Mobile recharge")),
+    ("Health", 5, (100, 8000), 0.95, ("Pharmacy", "Doctor visit", "Lab test")),
+    ("Travel", 3, (1500, 40000), 0.3, ("Flight", "Hotel", "Train ticket")),
+    ("Education", 2, (500, 20000), 0.9, ("Course fee", "Stationery")),
+    ("Gifts", 2, (200, 5000), 0.2, ("Birthday gift", "Wedding gift")),
+    ("Rent", 1, (8000, 45000), 1.0, ("Rent",)),
+)
+DEFAULT_START = datetime(2023, 1, 1, tzinfo=timezone.utc)
+DEFAULT_YEARS = 2
+BATCH_SIZE = 5000
+
+
+def user_email(index: int) -> str:
+    return f"bench-user-{index}@example.com"
+
+
+def random_amount(rng: Random, low: int, high: int) -> int:
+    """Log-uniform in [low, high] rupees, in paise: small amounts are the most frequent."""
+    return int(math.exp(rng.uniform(math.log(low), math.log(high))) * 100)
+
+
+def user_expenses(seed: int, index: int, user_id: int, count: int, type_ids: Dict[str, int],
+                  start: datetime = DEFAULT_START, years: int = DEFAULT_YEARS) -> List[DailyExpense]:
+    rng = Random(f"{seed}-{index}")
+    seconds = int((start.replace(year=start.year + years) - start).total_seconds())
+    weights = [weight for _, weight, _, _, _ in EXPENSE_TYPES]
+    expenses = []
+    for expense_type in rng.choices(EXPENSE_TYPES, weights, k=count):
+        name, _, (low, high), essential, items = expense_type
+        quantity = 1 if rng.random() < 0.8 else rng.randint(2, 5)
+        unit_price = random_amount(rng, low, high) // quantity
+        expenses.append(DailyExpense(
+            date=start + timedelta(seconds=rng.randrange(seconds)),
+            name=rng.choice(items),
+            quantity_purchased=quantity,
+            unit_price_paise=unit_price,
+            amount_paise=unit_price * quantity,
+            really_needed=rng.random() < essential,
+            user_id=user_id,
+            expense_type_id=type_ids[name],
+        ))
+    return expenses
+
+
+async def generate(users: int, expenses_per_user: int, seed: int = 42,
+                   start: datetime = DEFAULT_START, years: int = DEFAULT_YEARS) -> List[int]:
+    """
+    Creates the expense types, then users bench-user-<i>@example.com with expenses_per_user
+    expenses each. Returns the user ids, in index order.
+    """
+    type_ids = {}
+    for name, *_ in EXPENSE_TYPES:
+        expense_type, _ = await ExpenseType.get_or_create(name=name)
+        type_ids[name] = expense_type.id
+
+    user_ids = []
+    for index in range(users):
+        user = await User.create(email=user_email(index), name=f"Bench User {index}")
+        user_ids.append(user.id)
+        expenses = user_expenses(seed, index, user.id, expenses_per_user, type_ids, start, years)
+        await DailyExpense.bulk_create(expenses, batch_size=BATCH_SIZE)
+    await rebuild()
+    return user_ids
+
+
+def search_terms() -> Sequence[str]:
+    return sorted({item for *_, items in EXPENSE_TYPES for item in items})
@@ -0,0 +1,88 @@
+"""
+Benchmark of how expenses reference their user: the old user_email text column against
+the user_id integer foreign key, each with its (user, date) index.
+
+Builds both layouts in a throwaway SQLite file with the same rows, then reports table and
+index sizes (from dbstat) and the latency of loading one user's month through the index.
+
+Usage:
+    python -m api.benchmarks.user_key --rows 1000000 --users 1000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+from datetime import datetime
+
+from api.benchmarks.common import random_dates
+
+LAYOUTS = {
+    "user_email": ("TEXT", lambda user: f"user{user:06d}@example.com"),
+    "user_id": ("INT", lambda user: user),
+}
+TARGET_YEAR = 2024
+TARGET_MONTH = 6
+
+
+def build(conn: sqlite3.Connection, column: str, rows):
+    column_type, key = LAYOUTS[column]
+    table = f"expense_by_{column}"
+    conn.execute(
+        f'CREATE TABLE "{table}" ("id" INTEGER PRIMARY KEY, "date" TIMESTAMP NOT NULL, '
+        f'"name" VARCHAR(255) NOT NULL, "amount" REAL NOT NULL, "{column}" {column_type} NOT NULL)'
+    )
+    conn.executemany(
+        f'INSERT INTO "{table}" ("date", "name", "amount", "{column}") VALUES (?, ?, ?, ?)',
+        ((date, "item", amount, key(user)) for date, amount, user in rows),
+    )
+    conn.execute(f'CREATE INDEX "idx_{table}" ON "{table}" ("{column}", "date")')
+    conn.commit()
+
+
+def size_mb(conn: sqlite3.Connection, name: str) -> float:
+    (size,) = conn.execute("SELECT SUM(pgsize) FROM dbstat WHERE name = ?", [name]).fetchone()
+    return size / 1024 / 1024
+
+
+def month_latency(conn: sqlite3.Connection, column: str, users: int, repeat: int) -> float:
+    _, key = LAYOUTS[column]
+    rng = random.Random(7)
+    start, end = datetime(TARGET_YEAR, TARGET_MONTH, 1), datetime(TARGET_YEAR, TARGET_MONTH + 1, 1)
+    query = (f'SELECT * FROM "expense_by_{column}" WHERE "{column}" = ? AND "date" >= ? AND "date" < ? '
+             f'ORDER BY "date"')
+    timings = []
+    for _ in range(repeat):
+        user = key(rng.randrange(users))
+        began = time.perf_counter()
+        conn.execute(query, [user, start.isoformat(" "), end.isoformat(" ")]).fetchall()
+        timings.append((time.perf_counter() - began) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    dates = random_dates(rng, args.rows, datetime(TARGET_YEAR - 5, 1, 1), datetime(TARGET_YEAR + 1, 1, 1))
+    rows = [(date.isoformat(" "), round(rng.uniform(10, 500), 2), rng.randrange(args.users)) for date in dates]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = sqlite3.connect(os.path.join(tmp, "bench.sqlite3"))
+        for column in LAYOUTS:
+            build(conn, column, rows)
+        for column in LAYOUTS:
+            table = f"expense_by_{column}"
+            print(f"{column:>10} | table {size_mb(conn, table):7.1f} MB | index {size_mb(conn, 'idx_' + table):7.1f} MB | "
+                  f"month median {month_latency(conn, column, args.users, args.repeat):6.3f} ms")
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""
+In-process caching with cross-worker invalidation.
+
+TTLCache is a small LRU cache whose entries also expire after a TTL. Invalidation
+across uvicorn workers goes through a version backend: writers bump a named version
+and readers drop cached entries built under an older one. LocalVersionBackend keeps
+versions in memory (single process, tests); FileVersionBackend shares them between
+the processes on one host through a directory, set with CACHE_SHARED_DIR.
+"""
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Hashable, List, Optional
+
+from tortoise import connections
+
+from api.config import CACHE_SHARED_DIR, EXPENSE_TYPE_CACHE_TTL
+from api.database import PRIMARY_CONNECTION
+from api.models import ExpenseType
+
+_MISSING = object()
+
+
+class TTLCache:
+    """LRU cache with a per-entry time to live and hit/miss counters."""
+
+    def __init__(self, maxsize: int = 128, ttl: float = 300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._entries.get(key, _MISSING)
+        if entry is _MISSING or entry[0] < time.monotonic():
+            if entry is not _MISSING:
+                del self._entries[key]
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key: Hashable):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+
+class LocalVersionBackend:
+    """Version counters held in this process only."""
+
+    def __init__(self):
+        self._versions: Dict[str, int] = {}
+
+    def get_version(self, name: str) -> int:
+        return self._versions.get(name, 0)
+
+    def bump_version(self, name: str):
+        self._versions[name] = self.get_version(name) + 1
+
+
+class FileVersionBackend:
+    """
+    Version counters shared by every process that points at the same directory.
+    A version is the modification time of a marker file, so reading it is a single stat().
+    """
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def get_version(self, name: str) -> int:
+        try:
+            return os.stat(self.directory / name).st_mtime_ns
+        except FileNotFoundError:
+            return 0
+
+    def bump_version(self, name: str):
+        marker = self.directory / name
+        marker.touch()
+        # Guarantee a change even when the filesystem clock has a coarse resolution
+        stat = marker.stat()
+        os.utime(marker, ns=(stat.st_atime_ns, max(stat.st_mtime_ns, self.get_version(name) + 1)))
+
+
+def version_backend():
+    return FileVersionBackend(CACHE_SHARED_DIR) if CACHE_SHARED_DIR else LocalVersionBackend()
+
+
+class ExpenseTypeCatalog:
+    """
+    Cached view of the ExpenseType table, which is small and rarely written.
+    Writers must call invalidate() after changing ExpenseType rows.
+    """
+
+    VERSION_NAME = "expensetype"
+
+    def __init__(self, backend=None, ttl: float = EXPENSE_TYPE_CACHE_TTL):
+        self.backend = backend or version_backend()
+        self.cache = TTLCache(maxsize=1, ttl=ttl)
+
+    async def _catalog(self) -> Dict:
+        version = self.backend.get_version(self.VERSION_NAME)
+        catalog = self.cache.get("catalog")
+        if catalog is None or catalog["version"] != version:
+            # Always from the primary: a lagging replica would be cached under the new version
+            primary = connections.get(PRIMARY_CONNECTION)
+            types = await ExpenseType.all().using_db(primary).order_by("name").values("id", "name")
+            fingerprint = hashlib.sha256(repr(types).encode()).hexdigest()[:16]
+            catalog = {"version": version, "fingerprint": fingerprint, "all": types,
+                       "by_id": {t["id"]: t for t in types}}
+            self.cache.set("catalog", catalog)
+        return catalog
+
+    async def all(self) -> List[Dict]:
+        """All expense types ordered by name."""
+        return (await self._catalog())["all"]
+
+    async def get(self, expensetype_id: int) -> Optional[Dict]:
+        return (await self._catalog())["by_id"].get(expensetype_id)
+
+    async def fingerprint(self) -> str:
+        """Hash of the cached catalog's contents, for ETags of responses that embed type names."""
+        return (await self._catalog())["fingerprint"]
+
+    async def names(self) -> Dict[int, str]:
+        return {expense_type["id"]: expense_type["name"] for expense_type in await self.all()}
+
+    def invalidate(self):
+        self.cache.clear()
+        self.backend.bump_version(self.VERSION_NAME)
+
+
+expense_type_catalog = ExpenseTypeCatalog()
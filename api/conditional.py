@@ -0,0 +1,51 @@
+"""
+Conditional GET support for the read endpoints.
+
+Responses carry a weak ETag built from the version counters that the write
+endpoints bump, so a request whose If-None-Match still matches is answered with
+an empty 304 before any expense query or serialization runs.
+"""
+import hashlib
+from typing import Optional
+
+from fastapi import Request, Response
+
+# Browsers keep the body but must revalidate it on every use
+REVALIDATE_CACHE_CONTROL = "private, no-cache"
+
+
+def weak_etag(*parts) -> str:
+    digest = hashlib.sha256("|".join(str(part) for part in parts).encode()).hexdigest()[:32]
+    return f'W/"{digest}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """
+    Weak comparison of etag against the request's If-None-Match list.
+    """
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
+
+
+def cache_headers(etag: str, cache_control: str = REVALIDATE_CACHE_CONTROL) -> dict:
+    return {"ETag": etag, "Cache-Control": cache_control}
+
+
+def not_modified(request: Request, etag: str, cache_control: str = REVALIDATE_CACHE_CONTROL) -> Optional[Response]:
+    """
+    Returns the 304 response to send when the client's copy is current, otherwise None.
+    """
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=cache_headers(etag, cache_control))
+    return None
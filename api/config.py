@@ -9,4 +9,65 @@ CLIENT_SECRET = os.environ.get('GOOGLE_CLIENT_SECRET', None)
 GOOGLE_REDIRECT_URI = os.environ.get('GOOGLE_REDIRECT_URI', None)
 API_BASE_URL = os.environ.get('API_BASE_URL', None)
 REACT_BASE_URL = os.environ.get('REACT_BASE_URL', None)
-DATABASE_URL = os.getenv("DATABASE_URL")
\ No newline at end of file
+DATABASE_URL = os.getenv("DATABASE_URL")
+# Optional read replica for read-only endpoints; unset means everything reads from DATABASE_URL
+DATABASE_REPLICA_URL = os.environ.get('DATABASE_REPLICA_URL')
+SECRET_KEY = os.environ.get('SECRET_KEY', CLIENT_SECRET)
+
+# Seconds after a user's write during which their reads skip the replica; above the replication lag
+READ_YOUR_WRITES_WINDOW = float(os.environ.get('READ_YOUR_WRITES_WINDOW', 5))
+
+# Connection pools (PostgreSQL); parameters given in the database URL take precedence
+DB_POOL_MIN = int(os.environ.get('DB_POOL_MIN', 1))
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', 10))
+# Seconds to wait for a free pooled connection (for SQLite, for a write lock) before failing
+DB_ACQUIRE_TIMEOUT = float(os.environ.get('DB_ACQUIRE_TIMEOUT', 10))
+# Prepared statements cached per connection; set 0 behind PgBouncer in transaction mode
+DB_STATEMENT_CACHE_SIZE = int(os.environ.get('DB_STATEMENT_CACHE_SIZE', 100))
+
+# Per-request query budgets; over budget requests are logged, or rejected when enforced
+QUERY_BUDGET = int(os.environ.get('QUERY_BUDGET', 50))
+REQUEST_TIME_BUDGET = float(os.environ.get('REQUEST_TIME_BUDGET', 2.0))
+QUERY_BUDGET_ENFORCE = os.environ.get('QUERY_BUDGET_ENFORCE', '').lower() in ('1', 'true', 'yes')
+
+# Logging, written from a background thread; records go to stderr and, when set, LOG_FILE
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'WARNING').upper()
+LOG_FILE = os.environ.get('LOG_FILE')
+
+# Bearer token Prometheus sends to scrape /metrics; unset disables the endpoint
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+# OpenID provider metadata and JWKS, cached on disk and refreshed before they expire
+OIDC_METADATA_URL = os.environ.get('OIDC_METADATA_URL', 'https://accounts.google.com/.well-known/openid-configuration')
+OIDC_CACHE_FILE = os.environ.get('OIDC_CACHE_FILE', os.path.join(os.path.dirname(__file__), 'oidc_cache.json'))
+OIDC_CACHE_TTL = int(os.environ.get('OIDC_CACHE_TTL', 6 * 3600))
+OIDC_REFRESH_MARGIN = int(os.environ.get('OIDC_REFRESH_MARGIN', 600))
+# Local {"metadata": ..., "jwks": ...} file used instead of the provider, for tests and offline runs
+OIDC_STUB_FILE = os.environ.get('OIDC_STUB_FILE')
+
+# Signed access tokens and the cache of verified ones
+ACCESS_TOKEN_TTL = int(os.environ.get('ACCESS_TOKEN_TTL', 3600))
+AUTH_CACHE_SIZE = int(os.environ.get('AUTH_CACHE_SIZE', 4096))
+
+# Report generation worker pool
+REPORT_WORKERS = int(os.environ.get('REPORT_WORKERS', 2))
+REPORT_QUEUE_DEPTH = int(os.environ.get('REPORT_QUEUE_DEPTH', 4))
+REPORT_RETRY_AFTER = int(os.environ.get('REPORT_RETRY_AFTER', 5))
+
+# Generated report artifacts, cached per user, period and data version
+REPORTS_DIR = os.environ.get('REPORTS_DIR', os.path.join(os.path.dirname(__file__), 'reports_cache'))
+# Seconds a report job's status is kept; a pending job whose worker died is retried after it
+REPORT_JOB_TTL = int(os.environ.get('REPORT_JOB_TTL', 3600))
+# Closed years moved out of the database by api.archive, one read-only Parquet dataset per year
+ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR', os.path.join(os.path.dirname(__file__), 'archive'))
+
+# Caching; set CACHE_SHARED_DIR so every worker on the host sees cache invalidations
+CACHE_SHARED_DIR = os.environ.get('CACHE_SHARED_DIR')
+EXPENSE_TYPE_CACHE_TTL = float(os.environ.get('EXPENSE_TYPE_CACHE_TTL', 300))
+
+# Bulk expense imports and batch edits
+BULK_MAX_ROWS = int(os.environ.get('BULK_MAX_ROWS', 100000))
+# Ids per batch update/delete, kept under SQLite's bound parameter limit
+BATCH_MAX_IDS = int(os.environ.get('BATCH_MAX_IDS', 5000))
+# Rows deleted per transaction by /delete-expenses
+DELETE_CHUNK_SIZE = int(os.environ.get('DELETE_CHUNK_SIZE', 1000))
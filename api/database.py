@@ -0,0 +1,82 @@
+"""
+Database connections, shared by the app, migrate.py and aerich (pyproject.toml points at
+app.TORTOISE_ORM).
+
+Pool sizes, the acquire timeout and the statement cache come from config unless the URL
+sets them. PostgreSQL URLs use api.pg_backend so the acquire timeout applies; for SQLite,
+which has a single connection, the timeout is how long a writer waits for the lock.
+When DATABASE_REPLICA_URL is set a second "replica" connection is configured, which
+api.replica routes read-only requests to.
+"""
+from typing import Dict, List, Optional
+
+from tortoise import connections
+from tortoise.backends.base.client import BaseDBAsyncClient
+from tortoise.backends.base.config_generator import expand_db_url
+from tortoise.utils import generate_schema_for_client
+
+from api.config import (
+    DATABASE_REPLICA_URL, DATABASE_URL, DB_ACQUIRE_TIMEOUT, DB_POOL_MAX, DB_POOL_MIN, DB_STATEMENT_CACHE_SIZE,
+)
+
+DEFAULT_DATABASE_URL = "sqlite://database.sqlite3"
+PRIMARY_CONNECTION = "default"
+REPLICA_CONNECTION = "replica"
+
+
+def connection_config(db_url: str, pool_min: int = DB_POOL_MIN, pool_max: int = DB_POOL_MAX,
+                      acquire_timeout: Optional[float] = DB_ACQUIRE_TIMEOUT,
+                      statement_cache_size: int = DB_STATEMENT_CACHE_SIZE) -> Dict:
+    """Expands db_url into a Tortoise connection config with the pool settings filled in."""
+    config = expand_db_url(db_url)
+    credentials = config["credentials"]
+    if config["engine"] == "tortoise.backends.asyncpg":
+        config["engine"] = "api.pg_backend"
+        credentials.setdefault("minsize", pool_min)
+        credentials.setdefault("maxsize", pool_max)
+        credentials.setdefault("statement_cache_size", statement_cache_size)
+        if acquire_timeout:
+            credentials.setdefault("acquire_timeout", acquire_timeout)
+    elif config["engine"] == "tortoise.backends.sqlite" and acquire_timeout:
+        # Passed to SQLite as PRAGMA busy_timeout, in milliseconds
+        credentials.setdefault("busy_timeout", int(acquire_timeout * 1000))
+    return config
+
+
+def tortoise_config(db_url: Optional[str] = DATABASE_URL, replica_url: Optional[str] = DATABASE_REPLICA_URL) -> Dict:
+    config = {
+        "connections": {PRIMARY_CONNECTION: connection_config(db_url or DEFAULT_DATABASE_URL)},
+        "apps": {
+            "models": {
+                "models": ["api.models"],
+                "default_connection": PRIMARY_CONNECTION,
+            },
+        },
+    }
+    if replica_url:
+        config["connections"][REPLICA_CONNECTION] = connection_config(replica_url)
+        config["routers"] = ["api.replica.ReplicaRouter"]
+    return config
+
+
+TORTOISE_ORM = tortoise_config()
+
+
+async def generate_schemas():
+    """Creates missing tables on the primary only; a replica gets them through replication."""
+    await generate_schema_for_client(connections.get(PRIMARY_CONNECTION), safe=True)
+
+
+def is_postgres(conn: BaseDBAsyncClient) -> bool:
+    return conn.capabilities.dialect == "postgres"
+
+
+async def table_columns(conn: BaseDBAsyncClient, table: str) -> List[str]:
+    """Column names of table, for the data migration scripts."""
+    if is_postgres(conn):
+        rows = await conn.execute_query_dict(
+            "SELECT column_name AS name FROM information_schema.columns WHERE table_name = $1", [table]
+        )
+    else:
+        rows = await conn.execute_query_dict(f'PRAGMA table_info("{table}")')
+    return [row["name"] for row in rows]
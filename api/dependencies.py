@@ -1,10 +1,101 @@
-from fastapi import Depends, HTTPException, Security
-import requests
+"""
+Authentication for the API.
 
-from api.main import AUTH_SERVICE_URL
+After the Google login /auth issues a compact HS256 token (a JWT) holding the user's
+profile and integer id, set as an HttpOnly cookie. get_current_user accepts it from that cookie or an
+Authorization: Bearer header and verifies it locally: no outbound calls and no I/O.
+Verified tokens are remembered in an LRU keyed by their signature, so a repeat request
+only splits the token and compares strings. Sessions from before the tokens still work.
 
-def get_current_user(token: str = Security(...)):
-    response = requests.get(f"{AUTH_SERVICE_URL}/me", headers={"Authorization": f"Bearer {token}"})
-    if response.status_code != 200:
-        raise HTTPException(status_code=401, detail="Invalid Token")
-    return response.json()
+/metrics takes a separate static bearer token, METRICS_TOKEN, so a scraper needs no user.
+"""
+import hmac
+import time
+from typing import Dict, Optional
+
+import jwt
+from fastapi import HTTPException, Request
+
+from api.cache import TTLCache
+from api.config import ACCESS_TOKEN_TTL, AUTH_CACHE_SIZE, METRICS_TOKEN, SECRET_KEY
+from api.users import user_id_for
+
+ACCESS_TOKEN_COOKIE = "access_token"
+JWT_ALGORITHM = "HS256"
+# Userinfo fields copied into the token; everything the endpoints and templates read
+USER_CLAIMS = ("id", "email", "name", "given_name", "family_name", "picture")
+
+
+def create_access_token(user_info: Dict, ttl: int = ACCESS_TOKEN_TTL, secret: Optional[str] = None) -> str:
+    """Signs the user's profile into a token that expires after ttl seconds."""
+    now = int(time.time())
+    payload = {claim: user_info[claim] for claim in USER_CLAIMS if user_info.get(claim) is not None}
+    payload.update({"sub": user_info["email"], "iat": now, "exp": now + ttl})
+    return jwt.encode(payload, secret or SECRET_KEY, algorithm=JWT_ALGORITHM)
+
+
+class TokenVerifier:
+    """
+    Verifies access tokens, caching the claims of valid ones by signature.
+    A cache hit still requires the rest of the token to match what was verified,
+    so a signature cannot be replayed onto a different payload.
+    """
+
+    def __init__(self, secret: str, maxsize: int = AUTH_CACHE_SIZE, ttl: float = ACCESS_TOKEN_TTL):
+        self.secret = secret
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def verify(self, token: str) -> Dict:
+        """Returns the token's claims. Raises jwt.InvalidTokenError if it is invalid or expired."""
+        signing_input, _, signature = token.rpartition(".")
+        cached = self.cache.get(signature)
+        if cached and cached[0] == signing_input and cached[1]["exp"] > time.time():
+            return cached[1]
+
+        claims = jwt.decode(token, self.secret, algorithms=[JWT_ALGORITHM], options={"require": ["exp", "sub"]})
+        self.cache.set(signature, (signing_input, claims))
+        return claims
+
+
+token_verifier = TokenVerifier(SECRET_KEY)
+
+
+def _bearer_token(request: Request) -> Optional[str]:
+    scheme, _, credentials = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() == "bearer" and credentials:
+        return credentials.strip()
+    return None
+
+
+def _request_token(request: Request) -> Optional[str]:
+    return _bearer_token(request) or request.cookies.get(ACCESS_TOKEN_COOKIE)
+
+
+async def get_current_user(request: Request) -> Dict:
+    token = _request_token(request)
+    if token:
+        try:
+            claims = token_verifier.verify(token)
+        except jwt.InvalidTokenError:
+            raise HTTPException(status_code=401, detail="Invalid or expired token")
+        user = {claim: claims[claim] for claim in USER_CLAIMS if claim in claims}
+    else:
+        user = request.session.get("user")
+        if not user:
+            raise HTTPException(status_code=401, detail="Not authenticated")
+
+    if "id" not in user and user.get("email"):
+        # Issued before users had ids; remembered in the session from now on
+        user = {**user, "id": await user_id_for(user["email"])}
+        if not token:
+            request.session["user"] = user
+    return user
+
+
+async def require_metrics_token(request: Request):
+    """Not found unless METRICS_TOKEN is configured; unauthorized unless the request bears it."""
+    if not METRICS_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    token = _bearer_token(request) or ""
+    if not hmac.compare_digest(token.encode(), METRICS_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Invalid metrics token", headers={"WWW-Authenticate": "Bearer"})
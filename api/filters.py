@@ -0,0 +1,47 @@
+from datetime import datetime, timezone
+from typing import Optional, Tuple
+
+from tortoise.expressions import Q
+
+# Periods datetime can represent, including the end of the last year
+MIN_YEAR = 1
+MAX_YEAR = 9998
+
+
+def period_bounds(year: int, month: Optional[int] = None) -> Tuple[datetime, datetime]:
+    """
+    Returns the half-open [start, end) datetime range for a year or a single month.
+    Raises ValueError for a year or month outside MIN_YEAR..MAX_YEAR and 1..12.
+    """
+    if not MIN_YEAR <= year <= MAX_YEAR or (month and not 1 <= month <= 12):
+        raise ValueError(f"Invalid period: year {year}, month {month}")
+    if month:
+        start = datetime(year, month, 1)
+        end = datetime(year + 1, 1, 1) if month == 12 else datetime(year, month + 1, 1)
+    else:
+        start = datetime(year, 1, 1)
+        end = datetime(year + 1, 1, 1)
+    return start, end
+
+
+def expense_period_filter(user_id: int, year: Optional[int] = None, month: Optional[int] = None) -> Q:
+    """
+    Builds the filter for a user's expenses in the given period.
+    Uses date__gte/date__lt so the (user_id, date) index can be used.
+    """
+    query_filter = Q(user_id=user_id)
+    if year:
+        start, end = period_bounds(year, month)
+        query_filter &= Q(date__gte=start) & Q(date__lt=end)
+    return query_filter
+
+
+def to_utc(value: datetime) -> datetime:
+    """
+    Converts a datetime to aware UTC, the form Tortoise stores new expense dates in
+    (naive values are taken as UTC). Writing every date in one form keeps date
+    comparisons such as keyset cursors exact on SQLite, where datetimes compare as text.
+    """
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
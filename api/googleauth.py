@@ -8,7 +8,9 @@ import os
 from fastapi import FastAPI, APIRouter, Depends, Request
 from fastapi.security import OAuth2AuthorizationCodeBearer
 from fastapi.openapi.docs import get_swagger_ui_html
-import jwt
+from api.config import OIDC_METADATA_URL
+from api.dependencies import create_access_token
+from api.oidc import provider_metadata
 from datetime import datetime, timedelta
 import random
 import string
@@ -34,7 +36,7 @@ google = oauth.register(
     name="google",
     client_id=GOOGLE_CLIENT_ID,
     client_secret=GOOGLE_CLIENT_SECRET,
-    server_metadata_url="https://accounts.google.com/.well-known/openid-configuration",
+    server_metadata_url=OIDC_METADATA_URL,
     client_kwargs={"scope": "openid email profile"},
 )
 
@@ -61,8 +63,10 @@ async def login(request: Request):
     state = generate_state()
     request.session["state"] = state
     redirect_uri = {API_BASE_URL} + "/api/auth/callback"
+    await provider_metadata.apply(oauth.google)
+    metadata = await oauth.google.load_server_metadata()
     google_auth_url = (
-        f"https://accounts.google.com/o/oauth2/auth?"
+        f"{metadata['authorization_endpoint']}?"
         f"response_type=code&client_id={GOOGLE_CLIENT_ID}&redirect_uri={redirect_uri}"
         f"&scope=openid%20email%20profile&state={state}"
     )
@@ -82,7 +86,8 @@ async def callback(request: Request):
     if not code:
         raise HTTPException(status_code=400, detail="Missing authorization code")
 
-    # Exchange the code for tokens
+    # Exchange the code for tokens, with the provider metadata from the shared cache
+    await provider_metadata.apply(oauth.google)
     token = await oauth.google.authorize_access_token(request)
     user_info = token.get("userinfo")  # Extract user info from the token
     if not user_info:
@@ -98,19 +103,9 @@ async def callback(request: Request):
 async def protected():
     return {"message": "You are authenticated and can access this endpoint!"}
 
-# Define your secret key and algorithm
-JWT_SECRET = os.getenv("SECRET_KEY", "db11adfd7f008dcd8347e47fff1734bd77a59c80a4ad8ff2")
-JWT_ALGORITHM = "HS256"
-
 def create_jwt(user_info: dict):
     """Create a JWT token for the authenticated user."""
-    payload = {
-        "sub": user_info["email"],  # Use the user's email as the subject
-        "name": user_info.get("name"),
-        "exp": datetime.utcnow() + timedelta(hours=1)
-    }
-    token = jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
-    return token
+    return create_access_token(user_info)
 
 @router.get("/test")
 async def test_route():
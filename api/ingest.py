@@ -0,0 +1,167 @@
+"""
+Bulk import of expenses from a JSON array or an uploaded CSV/XLSX file.
+
+Every row is validated on its own so all problems are reported with their row number,
+referenced expense types are checked with a single query, and the valid rows are
+written with bulk_create plus one rollup update per month and type, in one transaction.
+"""
+import asyncio
+import csv
+import io
+import zipfile
+from typing import Any, Dict, List, Sequence, Tuple
+
+from openpyxl import load_workbook
+from openpyxl.utils.exceptions import InvalidFileException
+from pydantic import ValidationError
+from starlette.datastructures import UploadFile
+from tortoise.transactions import in_transaction
+
+from api.database import PRIMARY_CONNECTION
+from api.filters import to_utc
+from api.models import BulkExpenseRow, DailyExpense, ExpenseType
+from api.money import to_paise
+from api.rollups import record_expenses
+
+INSERT_BATCH_SIZE = 1000
+
+
+class BulkImportError(ValueError):
+    """The uploaded file could not be read as a table of expenses."""
+
+
+def _column_name(header: Any) -> str:
+    return str(header).strip().lower().replace(" ", "_")
+
+
+def _is_blank(value: Any) -> bool:
+    return value is None or (isinstance(value, str) and not value.strip())
+
+
+def parse_csv(data: bytes) -> List[Dict]:
+    try:
+        reader = csv.DictReader(io.StringIO(data.decode("utf-8-sig")))
+        if not reader.fieldnames:
+            raise BulkImportError("The CSV file has no header row")
+        reader.fieldnames = [_column_name(name) for name in reader.fieldnames]
+        # Blank cells fall back to the field defaults
+        return [
+            {name: value for name, value in row.items() if name and not _is_blank(value)}
+            for row in reader
+        ]
+    except (UnicodeDecodeError, csv.Error) as e:
+        raise BulkImportError(f"Unreadable CSV file: {e}") from e
+
+
+def parse_xlsx(data: bytes) -> List[Dict]:
+    try:
+        workbook = load_workbook(io.BytesIO(data), read_only=True, data_only=True)
+    except (InvalidFileException, zipfile.BadZipFile, KeyError) as e:
+        raise BulkImportError(f"Unreadable XLSX file: {e}") from e
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if not header:
+            raise BulkImportError("The XLSX sheet has no header row")
+        names = [None if _is_blank(cell) else _column_name(cell) for cell in header]
+        return [
+            {name: value for name, value in zip(names, row) if name and not _is_blank(value)}
+            for row in rows
+            if not all(_is_blank(value) for value in row)
+        ]
+    finally:
+        workbook.close()
+
+
+async def read_upload(upload: UploadFile) -> List[Dict]:
+    """Parses an uploaded .csv or .xlsx file into one dict per data row, off the event loop."""
+    filename = (upload.filename or "").lower()
+    if filename.endswith(".csv"):
+        parser = parse_csv
+    elif filename.endswith(".xlsx"):
+        parser = parse_xlsx
+    else:
+        raise BulkImportError("Only .csv and .xlsx files can be imported")
+    return await asyncio.to_thread(parser, await upload.read())
+
+
+def _row_error(row_number: int, errors: List[Dict]) -> Dict:
+    return {"row": row_number, "errors": errors}
+
+
+def validate_rows(raw_rows: Sequence[Any]) -> Tuple[List[Tuple[int, BulkExpenseRow]], List[Dict]]:
+    """
+    Validates each row against BulkExpenseRow. Rows are numbered from 1 in input order
+    (the header of a file is not counted).
+    """
+    valid, errors = [], []
+    for row_number, raw_row in enumerate(raw_rows, start=1):
+        if not isinstance(raw_row, dict):
+            errors.append(_row_error(row_number, [{"field": None, "message": "Expected an object"}]))
+            continue
+        try:
+            valid.append((row_number, BulkExpenseRow.model_validate(raw_row)))
+        except ValidationError as e:
+            errors.append(_row_error(row_number, [
+                {"field": ".".join(str(part) for part in error["loc"]) or None, "message": error["msg"]}
+                for error in e.errors()
+            ]))
+    return valid, errors
+
+
+def apply_amount_rule(rows: Sequence[BulkExpenseRow]) -> List[Tuple[int, int]]:
+    """
+    Column-wise form of add_expense's rule: an amount left at 0 with a positive
+    unit price becomes quantity_purchased * unit_price.
+    Returns (unit_price, amount) per row, in paise. The bounds of BulkExpenseRow make
+    every validated row convertible, so this never fails on a row.
+    """
+    quantities = [row.quantity_purchased for row in rows]
+    unit_prices = [to_paise(row.unit_price) for row in rows]
+    amounts = [to_paise(row.amount) for row in rows]
+    return [
+        (unit_price, quantity * unit_price if unit_price > 0 and amount == 0 else amount)
+        for quantity, unit_price, amount in zip(quantities, unit_prices, amounts)
+    ]
+
+
+async def import_expenses(user_id: int, raw_rows: Sequence[Any], skip_invalid: bool = False) -> Dict:
+    """
+    Validates and inserts raw_rows for the user.
+    Unless skip_invalid is set, nothing is written when any row is invalid.
+    Returns the number of inserted rows and the per-row errors.
+    """
+    valid, errors = validate_rows(raw_rows)
+
+    type_ids = {row.expense_type_id for _, row in valid}
+    known_type_ids = set(await ExpenseType.filter(id__in=type_ids).values_list("id", flat=True)) if type_ids else set()
+    for row_number, row in valid:
+        if row.expense_type_id not in known_type_ids:
+            errors.append(_row_error(row_number, [
+                {"field": "expense_type_id", "message": f"Expense type {row.expense_type_id} not found"}
+            ]))
+    valid = [(row_number, row) for row_number, row in valid if row.expense_type_id in known_type_ids]
+    errors.sort(key=lambda error: error["row"])
+
+    if errors and not skip_invalid:
+        return {"inserted": 0, "errors": errors}
+
+    rows = [row for _, row in valid]
+    expenses = [
+        DailyExpense(
+            date=to_utc(row.date),
+            name=row.name,
+            quantity_purchased=row.quantity_purchased,
+            unit_price_paise=unit_price,
+            amount_paise=amount,
+            really_needed=row.really_needed,
+            expense_type_id=row.expense_type_id,
+            user_id=user_id,
+        )
+        for row, (unit_price, amount) in zip(rows, apply_amount_rule(rows))
+    ]
+    if expenses:
+        async with in_transaction(PRIMARY_CONNECTION) as conn:
+            await DailyExpense.bulk_create(expenses, batch_size=INSERT_BATCH_SIZE, using_db=conn)
+            await record_expenses(expenses, conn)
+    return {"inserted": len(expenses), "errors": errors}
@@ -1,17 +1,64 @@
+"""
+Non-blocking logging: records are put on a queue by the logging call and written to
+stderr (and LOG_FILE when set) by a QueueListener thread, so slow disks or pipes never
+stall the event loop.
+"""
+import atexit
 import logging
+import queue
+import sys
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
 
-# logging.basicConfig(
-#     filename="/home/daycare1/fastapi-react/api/errors.log",  # Set an absolute path
-#     level=logging.ERROR,
-#     format="%(asctime)s - %(levelname)s - %(message)s"
-# )
-
-logging.basicConfig(
-    filename="/home/daycare1/fastapi-react/api/errors.log", 
-    level=logging.ERROR, 
-    format="%(asctime)s - %(levelname)s - %(message)s"
-)
-logger = logging.getLogger(__name__)
-
-# Test: Write a log entry
-logger.error("Test error log entry")
+from api.config import LOG_FILE, LOG_LEVEL
+
+LOG_FORMAT = "%(asctime)s - %(levelname)s - %(name)s - %(message)s"
+
+_listener: Optional[QueueListener] = None
+
+
+class FastQueueHandler(QueueHandler):
+    """
+    QueueHandler for an in-process queue. The queue is thread-safe, so no handler lock
+    is taken per record. The record is not copied or formatted here either: the message
+    is merged in place, and the listener's handlers format it off the event loop.
+    """
+
+    def createLock(self):
+        self.lock = None
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Merged now, since the arguments may change once the call returns
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def configure_logging():
+    """Routes the root logger through the queue. Idempotent."""
+    global _listener
+    if _listener is not None:
+        return
+
+    formatter = logging.Formatter(LOG_FORMAT)
+    handlers = [logging.StreamHandler(sys.stderr)]
+    if LOG_FILE:
+        handlers.append(logging.FileHandler(LOG_FILE))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.addHandler(FastQueueHandler(log_queue))
+    root.setLevel(LOG_LEVEL)
+    _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Writes out the records still queued and stops the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,235 @@
+"""
+Request metrics, served in the Prometheus text format at /metrics.
+
+MetricsMiddleware records for every HTTP request, labelled by method and route template
+(so /dailyexpense/{id} is one series however many ids are requested):
+
+- http_requests_total, by status code, and http_requests_in_flight
+- http_request_duration_seconds, until the last byte of the response is sent
+- http_response_size_bytes, of the body, streamed or not
+- db_queries_per_request and db_query_duration_seconds, from api.querystats, so it must
+  run inside QueryBudgetMiddleware
+- serialization_duration_seconds, the time spent in api.serialization.dumps
+
+Metrics live in the process: with several workers each one serves its own at /metrics,
+and Prometheus sums them across the scraped targets. The endpoint is only served with
+METRICS_TOKEN configured, to requests bearing it.
+"""
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from api.querystats import current_stats
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+def _format_labels(names: Sequence[str], values: Sequence) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name, self.help, self.labels = name, help_text, tuple(labels)
+        self.values: Dict[Tuple, float] = {}
+
+    def inc(self, labels: Tuple = (), amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+                for key, value in sorted(self.values.items())]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, labels: Tuple = (), amount: float = 1):
+        self.inc(labels, -amount)
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name, self.help, self.labels = name, help_text, tuple(labels)
+        self.buckets = tuple(buckets)
+        # Per label values: observations per bucket (the last one above every bound), and their sum
+        self.series: Dict[Tuple, list] = {}
+
+    def observe(self, value: float, labels: Tuple = ()):
+        series = self.labelled(labels)
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def labelled(self, labels: Tuple) -> list:
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0]
+        return series
+
+    def samples(self) -> List[str]:
+        lines = []
+        for key, (counts, total) in sorted(self.series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                labels = _format_labels(self.labels + ("le",), key + (_format_value(bound),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+REQUESTS = Counter("http_requests_total", "HTTP requests handled.", ("method", "route", "status"))
+IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP requests being handled.")
+LATENCY = Histogram("http_request_duration_seconds", "Time to handle a request and send its response.",
+                    ("method", "route"))
+RESPONSE_SIZE = Histogram("http_response_size_bytes", "Size of response bodies.", ("method", "route"), SIZE_BUCKETS)
+QUERY_COUNT = Histogram("db_queries_per_request", "Database statements run per request.", ("method", "route"),
+                        QUERY_COUNT_BUCKETS)
+QUERY_TIME = Histogram("db_query_duration_seconds", "Time per request spent running database statements.",
+                       ("method", "route"))
+SERIALIZATION_TIME = Histogram("serialization_duration_seconds", "Time per request spent encoding JSON.",
+                               ("method", "route"))
+METRICS = (REQUESTS, IN_FLIGHT, LATENCY, RESPONSE_SIZE, QUERY_COUNT, QUERY_TIME, SERIALIZATION_TIME)
+IN_FLIGHT.values[()] = 0
+
+
+
+class RouteSeries:
+    """
+    A route's series of every per-request metric, looked up once per request and updated
+    inline: this runs on every request, where a method call per metric shows up.
+    """
+    __slots__ = ("labels", "latency", "size", "serialization", "query_count", "query_time")
+
+    def __init__(self, labels: Tuple):
+        self.labels = labels
+        self.latency = LATENCY.labelled(labels)
+        self.size = RESPONSE_SIZE.labelled(labels)
+        self.serialization = SERIALIZATION_TIME.labelled(labels)
+        self.query_count = QUERY_COUNT.labelled(labels)
+        self.query_time = QUERY_TIME.labelled(labels)
+
+    def observe(self, status: int, latency: float, size: int, serialization: float, stats):
+        requests = REQUESTS.values
+        key = self.labels + (status,)
+        requests[key] = requests.get(key, 0) + 1
+        series = self.latency
+        series[0][bisect_left(LATENCY_BUCKETS, latency)] += 1
+        series[1] += latency
+        series = self.size
+        series[0][bisect_left(SIZE_BUCKETS, size)] += 1
+        series[1] += size
+        series = self.serialization
+        series[0][bisect_left(LATENCY_BUCKETS, serialization)] += 1
+        series[1] += serialization
+        if stats is not None:
+            series = self.query_count
+            series[0][bisect_left(QUERY_COUNT_BUCKETS, stats.queries)] += 1
+            series[1] += stats.queries
+            series = self.query_time
+            series[0][bisect_left(LATENCY_BUCKETS, stats.query_time)] += 1
+            series[1] += stats.query_time
+
+
+# Keyed by their (method, route) labels
+_route_series: Dict[Tuple, RouteSeries] = {}
+
+
+def route_series(scope) -> RouteSeries:
+    route = scope.get("route")
+    labels = (scope["method"], route.path if route is not None else route_label(scope))
+    series = _route_series.get(labels)
+    if series is None:
+        series = _route_series[labels] = RouteSeries(labels)
+    return series
+
+
+def render_metrics() -> bytes:
+    lines = []
+    for metric in METRICS:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.samples())
+    return ("\n".join(lines) + "\n").encode()
+
+
+class RequestTimings:
+    __slots__ = ("serialization",)
+
+    def __init__(self):
+        self.serialization = 0.0
+
+
+_current_timings: ContextVar[Optional[RequestTimings]] = ContextVar("request_timings", default=None)
+
+
+def add_serialization_time(seconds: float):
+    timings = _current_timings.get()
+    if timings is not None:
+        timings.serialization += seconds
+
+
+def route_label(scope) -> str:
+    # Set by FastAPI once the request is routed; mounts (static files) only set an endpoint
+    route = scope.get("route")
+    if route is not None:
+        return route.path
+    if "endpoint" in scope:
+        return scope.get("root_path") or "/"
+    return "unmatched"
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        started = time.perf_counter()
+        timings = RequestTimings()
+        token = _current_timings.set(timings)
+        status, size = 500, 0
+
+        async def send_and_measure(message):
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        in_flight = IN_FLIGHT.values
+        in_flight[()] += 1
+        try:
+            await self.app(scope, receive, send_and_measure)
+        finally:
+            _current_timings.reset(token)
+            in_flight[()] -= 1
+            route_series(scope).observe(status, time.perf_counter() - started, size, timings.serialization,
+                                        current_stats())
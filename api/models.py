@@ -1,8 +1,31 @@
 from datetime import datetime
-from pydantic import BaseModel
+from typing import Annotated, List, Literal, Optional
+from pydantic import BaseModel, Field
 from tortoise.models import Model
 from tortoise import fields
 from tortoise.contrib.pydantic import pydantic_model_creator
+
+from api.filters import MAX_YEAR, MIN_YEAR
+from api.money import MAX_QUANTITY, MAX_RUPEES
+
+EXPENSE_NAME_LENGTH = 200
+
+# Request amounts in rupees: finite and never negative, so bad input is a 422
+Rupees = Annotated[float, Field(ge=0, le=MAX_RUPEES, allow_inf_nan=False)]
+Quantity = Annotated[int, Field(ge=0, le=MAX_QUANTITY)]
+# As long as DailyExpense.name allows
+ExpenseName = Annotated[str, Field(max_length=EXPENSE_NAME_LENGTH)]
+class User(Model):
+    """A Google account; expenses and rollups reference it by its integer id."""
+    id = fields.IntField(pk=True)
+    email = fields.CharField(max_length=255, unique=True)
+    name = fields.CharField(max_length=255, null=True)
+    picture = fields.CharField(max_length=500, null=True)
+    created_at = fields.DatetimeField(auto_now_add=True)
+
+    class Meta:
+        table = "users"
+
 class ExpenseType(Model):
     id = fields.IntField(pk=True)
     name = fields.CharField(max_length=100)
@@ -11,34 +34,99 @@ class ExpenseTypeUpdate(BaseModel):
     name: str
 class DailyExpenseCreate(BaseModel):
     date: datetime
-    name: str
-    quantity_purchased: int = 1
-    unit_price: float = 0.00
-    amount: float = 0.00
+    name: ExpenseName
+    quantity_purchased: Quantity = 1
+    unit_price: Rupees = 0.00
+    amount: Rupees = 0.00
     really_needed: bool = False
     expense_type_id: int 
-    user_email: str
 
 class DailyExpenseUpdate(BaseModel):
     date: datetime  
-    name: str
-    quantity_purchased: int = 1
-    unit_price: float = 0.00
-    amount: float = 0.00
+    name: ExpenseName
+    quantity_purchased: Quantity = 1
+    unit_price: Rupees = 0.00
+    amount: Rupees = 0.00
     really_needed: bool = False
     expense_type_id: int  # Expecting this in the payload
 
+class BulkExpenseRow(BaseModel):
+    date: datetime
+    name: ExpenseName
+    quantity_purchased: Quantity = 1
+    unit_price: Rupees = 0.00
+    amount: Rupees = 0.00
+    really_needed: bool = False
+    expense_type_id: int
+
+class ExpenseChanges(BaseModel):
+    date: Optional[datetime] = None
+    name: Optional[ExpenseName] = None
+    quantity_purchased: Optional[Quantity] = None
+    unit_price: Optional[Rupees] = None
+    amount: Optional[Rupees] = None
+    really_needed: Optional[bool] = None
+    expense_type_id: Optional[int] = None
+
+class ExpensePatch(ExpenseChanges):
+    id: int
+
+class BatchExpenseUpdate(BaseModel):
+    # Either the same changes for every id, or one patch per expense
+    ids: List[int] = []
+    changes: Optional[ExpenseChanges] = None
+    updates: List[ExpensePatch] = []
+
+class BatchExpenseDelete(BaseModel):
+    ids: List[int]
+
 class DailyExpense(Model):
     id = fields.IntField(pk=True)
     date = fields.DatetimeField(nullable=False)
-    name = fields.CharField(max_length=200, nullable=False)
+    name = fields.CharField(max_length=EXPENSE_NAME_LENGTH, nullable=False)
     quantity_purchased = fields.IntField(default = 1)
-    unit_price = fields.FloatField(max_digits=8, decimal_places=2, default=0.00)
-    amount = fields.FloatField(max_digits=8, decimal_places=2, default=0.00)
+    # In paise (see api.money); the API takes and returns rupees
+    unit_price_paise = fields.BigIntField(default = 0)
+    amount_paise = fields.BigIntField(default = 0)
     really_needed = fields.BooleanField(default = False)
     expense_type = fields.ForeignKeyField('models.ExpenseType', 
                                          related_name="typeof_expense")
-    user_email = fields.CharField(max_length=255)
+    user = fields.ForeignKeyField('models.User', related_name="expenses")
+
+    class Meta:
+        # Every per-user query filters on user_id and a date range
+        indexes = (("user_id", "date"),)
+
+class MonthlyExpenseRollup(Model):
+    """Per-user monthly totals of DailyExpense, maintained on every expense write."""
+    id = fields.IntField(pk=True)
+    user = fields.ForeignKeyField('models.User', related_name="monthly_rollups")
+    year = fields.IntField()
+    month = fields.IntField()
+    expense_type = fields.ForeignKeyField('models.ExpenseType',
+                                         related_name="monthly_rollups")
+    really_needed = fields.BooleanField(default = False)
+    total_paise = fields.BigIntField(default = 0)
+    expense_count = fields.IntField(default = 0)
+
+    class Meta:
+        unique_together = (("user_id", "year", "month", "expense_type_id", "really_needed"),)
+
+class ExpensePeriodVersion(Model):
+    """Write counter per user and month, bumped whenever that month's expenses change."""
+    id = fields.IntField(pk=True)
+    user = fields.ForeignKeyField('models.User', related_name="period_versions")
+    year = fields.IntField()
+    month = fields.IntField()
+    version = fields.IntField(default = 0)
+
+    class Meta:
+        unique_together = (("user_id", "year", "month"),)
+
+class ReportRequest(BaseModel):
+    year: int = Field(ge=MIN_YEAR, le=MAX_YEAR)
+    month: Optional[int] = Field(None, ge=1, le=12)
+    format: Literal["xlsx", "csv", "parquet", "arrow"] = "xlsx"
 
 class UserInfo(BaseModel):
     sub: str
@@ -53,15 +141,19 @@ expensetpye_pydantic_in = pydantic_model_creator(ExpenseType, name="ExpenseTypeI
 daily_expense_pydantic = pydantic_model_creator(
     DailyExpense, 
     name="DailyExpense",
-    include=("id", "date", "name", "quantity_purchased", "unit_price", "amount", "really_needed", "expense_type", "user_email")
+    include=("id", "date", "name", "quantity_purchased", "unit_price_paise", "amount_paise", "really_needed", "expense_type", "user_id")
 )
 
-# Input model for creation or update (exclude readonly fields)
-daily_expense_pydantic_in = pydantic_model_creator(
-    DailyExpense, 
-    name="DailyExpenseIn", 
-    exclude_readonly=True
-)
+# Input model for creation, in rupees like the other request models
+class daily_expense_pydantic_in(BaseModel):
+    date: datetime
+    name: ExpenseName
+    quantity_purchased: Quantity = 1
+    unit_price: Rupees = 0.00
+    amount: Rupees = 0.00
+    really_needed: bool = False
+    # Still sent by the UI; the owner always comes from the session
+    user_email: Optional[str] = None
 
 class DailyExpenseWithExpenseType(daily_expense_pydantic):
     expense_type: expensetpye_pydantic   
@@ -0,0 +1,52 @@
+"""
+Money is stored as integer paise, so sums in the database are exact and need no rounding.
+The API keeps speaking rupees: request bodies are converted with to_paise when they come
+in, and amounts go back out through to_rupees at the serialization boundary.
+"""
+from decimal import ROUND_HALF_UP, Decimal
+from typing import Dict, Union
+
+PAISE_PER_RUPEE = 100
+# Largest amount or unit price accepted, in rupees; with MAX_QUANTITY their product fits a bigint of paise
+MAX_RUPEES = 10 ** 10
+MAX_QUANTITY = 1_000_000
+
+# Rupee fields of the request models and the paise fields they are stored in
+MONEY_FIELDS = {"unit_price": "unit_price_paise", "amount": "amount_paise"}
+
+
+def to_paise(rupees: Union[int, float, str, Decimal]) -> int:
+    """
+    Converts rupees to paise, rounding half up. Floats are read by their shortest repr, so 19.99 is 1999.
+    Raises ValueError for NaN and infinities.
+    """
+    if not Decimal(str(rupees)).is_finite():
+        raise ValueError(f"Amount must be a finite number, not {rupees}")
+    return int((Decimal(str(rupees)) * PAISE_PER_RUPEE).to_integral_value(ROUND_HALF_UP))
+
+
+def to_rupees(paise: Union[int, Decimal]) -> float:
+    return int(paise) / PAISE_PER_RUPEE
+
+
+def paise_fields(data: Dict) -> Dict:
+    """Replaces the rupee fields present in data with their paise fields, in place."""
+    for field, paise_field in MONEY_FIELDS.items():
+        if field in data:
+            data[paise_field] = to_paise(data.pop(field))
+    return data
+
+
+def format_inr(paise: Union[int, Decimal]) -> str:
+    """
+    Formats an amount with Indian digit grouping: the last three digits, then groups of
+    two (lakh, crore), e.g. 1234567890 paise is "1,23,45,678.90".
+    """
+    sign = "-" if paise < 0 else ""
+    rupees, paise = divmod(abs(int(paise)), PAISE_PER_RUPEE)
+    digits = str(rupees)
+    head, groups = digits[:-3], [digits[-3:]]
+    while head:
+        groups.insert(0, head[-2:])
+        head = head[:-2]
+    return f"{sign}{','.join(groups)}.{paise:02d}"
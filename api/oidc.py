@@ -0,0 +1,166 @@
+"""
+Disk-backed cache of the identity provider's OpenID metadata and JWKS.
+
+Authlib fetches the discovery document (and later the JWKS) lazily, once per process,
+so every cold worker pays for it on its first /login or /auth. ProviderMetadata keeps
+both documents in a JSON file shared by the workers and surviving restarts, with an
+expiry taken from the provider's Cache-Control max-age, and refreshes them in the
+background before they expire. apply() hands them to an Authlib client so it never
+fetches them itself.
+
+For tests or offline runs set OIDC_STUB_FILE to a JSON file shaped like the cache
+({"metadata": {...}, "jwks": {...}}); it is used as is and never refreshed. Pointing
+OIDC_METADATA_URL at a fake IdP works too.
+"""
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+import httpx
+
+from api.config import (
+    OIDC_CACHE_FILE, OIDC_CACHE_TTL, OIDC_METADATA_URL, OIDC_REFRESH_MARGIN, OIDC_STUB_FILE,
+)
+
+logger = logging.getLogger(__name__)
+
+# Returns the parsed JSON document and its max-age in seconds, if the provider sent one
+Fetcher = Callable[[str], Awaitable[Tuple[Dict, Optional[int]]]]
+
+MAX_AGE_PATTERN = re.compile(r"max-age=(\d+)")
+RETRY_DELAY = 60
+
+
+async def fetch_json(url: str) -> Tuple[Dict, Optional[int]]:
+    async with httpx.AsyncClient(timeout=10) as client:
+        response = await client.get(url)
+        response.raise_for_status()
+    max_age = MAX_AGE_PATTERN.search(response.headers.get("cache-control", ""))
+    return response.json(), int(max_age.group(1)) if max_age else None
+
+
+class ProviderMetadata:
+    def __init__(self, metadata_url: str = OIDC_METADATA_URL, cache_file: str = OIDC_CACHE_FILE,
+                 ttl: int = OIDC_CACHE_TTL, refresh_margin: int = OIDC_REFRESH_MARGIN,
+                 stub_file: Optional[str] = OIDC_STUB_FILE, fetcher: Fetcher = fetch_json):
+        self.metadata_url = metadata_url
+        self.cache_file = Path(cache_file)
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+        self.stub_file = stub_file
+        self.fetcher = fetcher
+        self.document: Optional[Dict] = None
+        self._refresh_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def expires_at(self) -> float:
+        return self.document["expires_at"] if self.document else 0.0
+
+    def _read(self, path: Path) -> Optional[Dict]:
+        try:
+            document = json.loads(path.read_text())
+        except (OSError, ValueError):
+            return None
+        if not isinstance(document, dict) or "metadata" not in document or "jwks" not in document:
+            return None
+        return document
+
+    def _write(self, document: Dict):
+        self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+        # Atomic replace, since every worker may refresh the same file
+        with NamedTemporaryFile("w", dir=self.cache_file.parent, suffix=".tmp", delete=False) as tmp:
+            json.dump(document, tmp)
+        os.replace(tmp.name, self.cache_file)
+
+    async def refresh(self) -> Dict:
+        """Fetches both documents from the provider and stores them in memory and on disk."""
+        async with self._refresh_lock:
+            metadata, metadata_max_age = await self.fetcher(self.metadata_url)
+            jwks, jwks_max_age = await self.fetcher(metadata["jwks_uri"])
+            max_ages = [age for age in (metadata_max_age, jwks_max_age) if age is not None]
+            fetched_at = time.time()
+            self.document = {
+                "metadata": metadata,
+                "jwks": jwks,
+                "fetched_at": fetched_at,
+                "expires_at": fetched_at + min(max_ages + [self.ttl]),
+            }
+            await asyncio.to_thread(self._write, self.document)
+            return self.document
+
+    async def load(self, refresh: bool = True) -> Optional[Dict]:
+        """
+        Returns the documents, from memory, the stub, the disk cache or the provider
+        in that order, refreshing them if they have expired and refresh is set. A stale
+        copy is kept when the provider cannot be reached; None means nothing is available.
+        """
+        if self.document is None:
+            if self.stub_file:
+                self.document = await asyncio.to_thread(self._read, Path(self.stub_file))
+                if self.document is None:
+                    raise RuntimeError(f"Invalid OIDC stub file {self.stub_file}")
+                self.document["expires_at"] = float("inf")
+                return self.document
+            self.document = await asyncio.to_thread(self._read, self.cache_file)
+        if refresh and self.expires_at <= time.time():
+            try:
+                await self.refresh()
+            except (httpx.HTTPError, KeyError, ValueError) as e:
+                logger.warning("Could not refresh OpenID metadata from %s: %s", self.metadata_url, e)
+        return self.document
+
+    async def apply(self, client, refresh: bool = True) -> bool:
+        """
+        Gives the cached documents to an Authlib OAuth client, which then skips its own
+        lazy fetches. Returns False if none are available, leaving the client to fetch.
+        """
+        document = await self.load(refresh)
+        if not document:
+            return False
+        client.server_metadata.update(document["metadata"])
+        client.server_metadata["jwks"] = document["jwks"]
+        client.server_metadata["_loaded_at"] = document.get("fetched_at", time.time())
+        return True
+
+    async def _refresh_forever(self, client):
+        while True:
+            delay = self.expires_at - self.refresh_margin - time.time()
+            await asyncio.sleep(max(delay, 0))
+            # Another worker may already have refreshed the shared file
+            on_disk = await asyncio.to_thread(self._read, self.cache_file)
+            if on_disk and on_disk.get("expires_at", 0) - self.refresh_margin > time.time():
+                self.document = on_disk
+                await self.apply(client)
+                continue
+            try:
+                await self.refresh()
+                await self.apply(client)
+            except (httpx.HTTPError, KeyError, ValueError) as e:
+                logger.warning("Background refresh of OpenID metadata failed: %s", e)
+                await asyncio.sleep(RETRY_DELAY)
+
+    def start_background_refresh(self, client):
+        """Keeps the documents refreshed refresh_margin seconds before they expire."""
+        if self.stub_file or self._task:
+            return
+        self._task = asyncio.create_task(self._refresh_forever(client))
+
+    async def stop_background_refresh(self):
+        # Only the event loop that started the task can await it
+        if self._task and self._task.get_loop() is asyncio.get_running_loop():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+provider_metadata = ProviderMetadata()
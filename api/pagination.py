@@ -0,0 +1,106 @@
+import base64
+from datetime import datetime
+from typing import AsyncIterator, List, Optional, Tuple
+
+from tortoise.expressions import Q
+
+from api.filters import to_utc
+from api.models import DailyExpense
+from api.serialization import expense_rows
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+
+def encode_cursor(expense: dict) -> str:
+    date = expense["date"]
+    if isinstance(date, datetime):
+        date = date.isoformat()
+    raw = f"{date}|{expense['id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """
+    Returns the (date, id) position encoded in cursor.
+    Raises ValueError if the cursor is malformed.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        date, expense_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(date.replace("Z", "+00:00")), int(expense_id)
+    except (UnicodeDecodeError, ValueError) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def after_filter(cursor: str) -> Q:
+    """
+    Keyset condition for rows that sort after the cursor in (date, id) order.
+    """
+    date, expense_id = decode_cursor(cursor)
+    date = to_utc(date)
+    return Q(date__gt=date) | (Q(date=date) & Q(id__gt=expense_id))
+
+
+async def fetch_expense_page(query_filter: Q, limit: int, after: Optional[str] = None) -> Tuple[List[dict], Optional[str]]:
+    """
+    Returns up to limit expenses ordered by (date, id) and the cursor of the next page,
+    or None when this is the last page.
+    """
+    if after:
+        query_filter &= after_filter(after)
+
+    expenses = await expense_rows(
+        DailyExpense.filter(query_filter)
+        .order_by("date", "id")
+        .limit(limit + 1)
+    )
+
+    if len(expenses) <= limit:
+        return expenses, None
+    expenses = expenses[:limit]
+    return expenses, encode_cursor(expenses[-1])
+
+
+async def iter_expenses(query_filter: Q, batch_size: int = DEFAULT_PAGE_SIZE) -> AsyncIterator[dict]:
+    """
+    Yields expenses one at a time, fetching them in keyset batches so only
+    batch_size rows are held in memory regardless of the user's history.
+    """
+    cursor = None
+    while True:
+        expenses, cursor = await fetch_expense_page(query_filter, batch_size, cursor)
+        for expense in expenses:
+            yield expense
+        if cursor is None:
+            return
+
+
+async def iter_expense_batches(query_filter: Q, *fields: str, batch_size: int = 1000) -> AsyncIterator[List[dict]]:
+    """
+    Yields lists of plain .values() dicts of the given fields (plus id and date)
+    in (date, id) order, batch_size rows at a time, without building pydantic models.
+    """
+    fields = tuple(dict.fromkeys(("id", "date") + fields))
+    current_filter = query_filter
+    while True:
+        rows = await (
+            DailyExpense.filter(current_filter)
+            .order_by("date", "id")
+            .limit(batch_size)
+            .values(*fields)
+        )
+        if rows:
+            yield rows
+        if len(rows) < batch_size:
+            return
+        current_filter = query_filter & after_filter(encode_cursor(rows[-1]))
+
+
+async def iter_expense_rows(query_filter: Q, *fields: str, batch_size: int = 1000) -> AsyncIterator[dict]:
+    """
+    Like iter_expense_batches, one row at a time.
+    """
+    async for rows in iter_expense_batches(query_filter, *fields, batch_size=batch_size):
+        for row in rows:
+            yield row
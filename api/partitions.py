@@ -0,0 +1,217 @@
+"""
+Yearly range partitions of dailyexpense on PostgreSQL.
+
+The partitioned table keeps the name dailyexpense, so the ORM and raw SQL are unchanged,
+and the date__gte/date__lt bounds of expense_period_filter let the planner prune every
+query for a month or year to that year's partition. Each year is a partition named
+dailyexpense_y<year>; rows outside them land in dailyexpense_default until their year's
+partition is created, which moves them over. The app creates this and next year's
+partitions at startup, one worker at a time, so inserts never wait on DDL at a year
+boundary.
+
+A new database is partitioned at startup while its table is still empty. An existing
+one is converted offline, with the app stopped:
+
+    python -m api.partitions convert [--batch-size 50000]
+    python -m api.partitions status
+
+SQLite has no partitioning, and one Tortoise model maps to one table, so there the
+table stays whole: period queries are bounded by the (user_id, date) index, and closed
+years move out to per-year archive files (see api.archive).
+"""
+import argparse
+import asyncio
+import logging
+import sys
+from datetime import datetime, timezone
+from typing import Iterable, List
+
+from tortoise import Tortoise, connections
+from tortoise.backends.base.client import BaseDBAsyncClient
+from tortoise.transactions import in_transaction
+from tortoise.utils import generate_schema_for_client
+
+from api.database import PRIMARY_CONNECTION, TORTOISE_ORM, is_postgres
+from api.search import ensure_search_index
+
+logger = logging.getLogger(__name__)
+
+TABLE = "dailyexpense"
+DEFAULT_PARTITION = f"{TABLE}_default"
+DEFAULT_BATCH_SIZE = 50000
+# Name of the advisory lock that serialises the startup maintenance of the app's workers
+MAINTENANCE_LOCK = "api.partitions"
+
+
+def partition_name(year: int) -> str:
+    return f"{TABLE}_y{year}"
+
+
+def _bounds(year: int) -> str:
+    # Explicit UTC offsets, so the bounds do not depend on the session time zone
+    return f"FROM ('{year}-01-01 00:00:00+00') TO ('{year + 1}-01-01 00:00:00+00')"
+
+
+async def is_partitioned(conn: BaseDBAsyncClient, table: str = TABLE) -> bool:
+    rows = await conn.execute_query_dict(
+        "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+        "WHERE c.relname = $1 AND pg_table_is_visible(c.oid)",
+        [table],
+    )
+    return bool(rows)
+
+
+async def partition_years(conn: BaseDBAsyncClient) -> List[int]:
+    rows = await conn.execute_query_dict(
+        "SELECT c.relname AS name FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "JOIN pg_class p ON p.oid = i.inhparent WHERE p.relname = $1",
+        [TABLE],
+    )
+    prefix = partition_name(0)[:-1]
+    return sorted(int(row["name"][len(prefix):]) for row in rows if row["name"].startswith(prefix))
+
+
+async def ensure_partitions(conn: BaseDBAsyncClient, years: Iterable[int]):
+    """
+    Creates the missing partitions of years. Rows of those years already in the default
+    partition are moved into the new partition in the same transaction.
+    """
+    existing = set(await partition_years(conn))
+    for year in sorted(set(years) - existing):
+        name = partition_name(year)
+        start, end = datetime(year, 1, 1, tzinfo=timezone.utc), datetime(year + 1, 1, 1, tzinfo=timezone.utc)
+        async with in_transaction(PRIMARY_CONNECTION) as tx:
+            stray = await tx.execute_query_dict(
+                f'SELECT 1 FROM "{DEFAULT_PARTITION}" WHERE "date" >= $1 AND "date" < $2 LIMIT 1', [start, end]
+            )
+            if not stray:
+                await tx.execute_script(f'CREATE TABLE "{name}" PARTITION OF "{TABLE}" FOR VALUES {_bounds(year)}')
+                continue
+            # The default partition may not keep rows a new partition covers: move them first
+            await tx.execute_script(f'CREATE TABLE "{name}" (LIKE "{TABLE}" INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+            await tx.execute_query(
+                f'WITH moved AS (DELETE FROM "{DEFAULT_PARTITION}" WHERE "date" >= $1 AND "date" < $2 RETURNING *) '
+                f'INSERT INTO "{name}" SELECT * FROM moved',
+                [start, end],
+            )
+            await tx.execute_script(f'ALTER TABLE "{TABLE}" ATTACH PARTITION "{name}" FOR VALUES {_bounds(year)}')
+
+
+async def _data_years(conn: BaseDBAsyncClient, table: str) -> List[int]:
+    rows = await conn.execute_query_dict(
+        f'SELECT DISTINCT EXTRACT(YEAR FROM "date" AT TIME ZONE \'UTC\')::int AS year FROM "{table}"'
+    )
+    return [row["year"] for row in rows]
+
+
+def _upcoming_years() -> List[int]:
+    year = datetime.now(timezone.utc).year
+    return [year, year + 1]
+
+
+async def convert(conn: BaseDBAsyncClient, batch_size: int = DEFAULT_BATCH_SIZE) -> int:
+    """
+    Replaces a plain dailyexpense table with a partitioned one holding the same rows,
+    copied batch_size rows per transaction. Returns the number of rows copied.
+    """
+    staging = f"{TABLE}_partitioned"
+    await conn.execute_script(f'DROP TABLE IF EXISTS "{staging}"')
+    await conn.execute_script(
+        f'CREATE TABLE "{staging}" (LIKE "{TABLE}" INCLUDING DEFAULTS INCLUDING CONSTRAINTS) '
+        f'PARTITION BY RANGE ("date")'
+    )
+    # The primary key of a partitioned table must contain the partition key
+    await conn.execute_script(f'ALTER TABLE "{staging}" ADD PRIMARY KEY ("id", "date")')
+    await conn.execute_script(f'CREATE TABLE "{DEFAULT_PARTITION}" PARTITION OF "{staging}" DEFAULT')
+    for year in sorted(set(await _data_years(conn, TABLE)) | set(_upcoming_years())):
+        await conn.execute_script(
+            f'CREATE TABLE "{partition_name(year)}" PARTITION OF "{staging}" FOR VALUES {_bounds(year)}'
+        )
+
+    last_id, copied = 0, 0
+    while True:
+        async with in_transaction(PRIMARY_CONNECTION) as tx:
+            rows = await tx.execute_query_dict(
+                f'WITH batch AS (INSERT INTO "{staging}" SELECT * FROM "{TABLE}" WHERE "id" > $1 '
+                f'ORDER BY "id" LIMIT {int(batch_size)} RETURNING "id") '
+                f'SELECT COUNT(*) AS "count", MAX("id") AS "last_id" FROM batch',
+                [last_id],
+            )
+        if not rows[0]["count"]:
+            break
+        last_id = rows[0]["last_id"]
+        copied += rows[0]["count"]
+        print(f"  {TABLE}: {copied} rows")
+
+    async with in_transaction(PRIMARY_CONNECTION) as tx:
+        await tx.execute_script(f'ALTER TABLE "{TABLE}" RENAME TO "{TABLE}_unpartitioned"')
+        await tx.execute_script(f'ALTER TABLE "{staging}" RENAME TO "{TABLE}"')
+        # The id sequence belongs to the old table and would be dropped with it
+        await tx.execute_script(f'ALTER SEQUENCE "{TABLE}_id_seq" OWNED BY "{TABLE}"."id"')
+        await tx.execute_script(
+            f'ALTER TABLE "{TABLE}" ADD FOREIGN KEY ("expense_type_id") REFERENCES "expensetype" ("id") ON DELETE CASCADE'
+        )
+        await tx.execute_script(
+            f'ALTER TABLE "{TABLE}" ADD FOREIGN KEY ("user_id") REFERENCES "users" ("id") ON DELETE CASCADE'
+        )
+        await tx.execute_script(f'DROP TABLE "{TABLE}_unpartitioned"')
+    # Recreates the (user_id, date) and search indexes, now on every partition
+    await generate_schema_for_client(conn, safe=True)
+    await ensure_search_index()
+    return copied
+
+
+async def maintain_partitions():
+    """
+    Startup hook: partitions a new, empty dailyexpense and creates the partitions of this
+    and next year. A populated plain table is left to the convert command.
+
+    Runs as one transaction holding an advisory lock, so workers starting together take
+    turns and the later ones find the work done.
+    """
+    if not is_postgres(connections.get(PRIMARY_CONNECTION)):
+        return
+    async with in_transaction(PRIMARY_CONNECTION) as conn:
+        await conn.execute_query("SELECT pg_advisory_xact_lock(hashtext($1))", [MAINTENANCE_LOCK])
+        if not await is_partitioned(conn):
+            if await conn.execute_query_dict(f'SELECT 1 FROM "{TABLE}" LIMIT 1'):
+                logger.warning("%s is not partitioned; run python -m api.partitions convert", TABLE)
+                return
+            await convert(conn)
+        await ensure_partitions(conn, _upcoming_years())
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["convert", "status"])
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    await Tortoise.init(config=TORTOISE_ORM)
+    try:
+        conn = connections.get(PRIMARY_CONNECTION)
+        if not is_postgres(conn):
+            print("SQLite keeps dailyexpense as one table; use python -m api.archive to move out closed years")
+            return 0
+        if args.command == "convert":
+            if await is_partitioned(conn):
+                print(f"✅ {TABLE} is already partitioned")
+            else:
+                print(f"✅ {TABLE}: {await convert(conn, args.batch_size)} rows copied into yearly partitions")
+            await ensure_partitions(conn, _upcoming_years())
+            return 0
+        if not await is_partitioned(conn):
+            print(f"{TABLE} is not partitioned")
+            return 1
+        for year in await partition_years(conn):
+            count = await conn.execute_query_dict(f'SELECT COUNT(*) AS "count" FROM "{partition_name(year)}"')
+            print(f"{partition_name(year)}: {count[0]['count']} rows")
+        count = await conn.execute_query_dict(f'SELECT COUNT(*) AS "count" FROM "{DEFAULT_PARTITION}"')
+        print(f"{DEFAULT_PARTITION}: {count[0]['count']} rows")
+        return 0
+    finally:
+        await Tortoise.close_connections()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
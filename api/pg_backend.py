@@ -0,0 +1,26 @@
+"""
+Tortoise engine for PostgreSQL that bounds how long a request waits for a pooled connection.
+
+Tortoise acquires from the asyncpg pool without a timeout, so an exhausted pool queues
+requests indefinitely; with acquire_timeout they fail with asyncio.TimeoutError instead.
+"""
+import functools
+from typing import Optional
+
+from tortoise.backends.asyncpg import AsyncpgDBClient
+
+
+class AsyncpgPoolClient(AsyncpgDBClient):
+    def __init__(self, acquire_timeout: Optional[float] = None, **kwargs):
+        super().__init__(**kwargs)
+        self.acquire_timeout = acquire_timeout
+
+    async def create_pool(self, **kwargs):
+        pool = await super().create_pool(**kwargs)
+        if self.acquire_timeout:
+            # Covers both plain queries and transactions, which acquire from the pool directly
+            pool.acquire = functools.partial(pool.acquire, timeout=self.acquire_timeout)
+        return pool
+
+
+client_class = AsyncpgPoolClient
@@ -0,0 +1,145 @@
+"""
+Per-request query counting and budgets.
+
+install_query_timer() wraps the execute methods of the loaded Tortoise clients, so every
+statement, whichever backend or transaction it goes through, is counted into the current
+request's QueryStats (a contextvar, so concurrent requests never mix) along with the time it
+takes, including the wait for a connection. The SQLite and asyncpg clients never call one
+another's execute methods, so each statement is counted once.
+
+QueryBudgetMiddleware reports the count in an X-Query-Count header and logs requests that
+ran more than QUERY_BUDGET queries or took longer than REQUEST_TIME_BUDGET seconds. With
+QUERY_BUDGET_ENFORCE the statement that goes over budget raises QueryBudgetExceeded instead
+of running, which turns N+1 regressions into failures in development and CI. Endpoints that
+legitimately need more can raise their own budget with Depends(query_budget(n)).
+"""
+import functools
+import logging
+import math
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+from tortoise.backends.base.client import BaseDBAsyncClient
+
+from api.config import QUERY_BUDGET, QUERY_BUDGET_ENFORCE, REQUEST_TIME_BUDGET
+
+logger = logging.getLogger(__name__)
+
+QUERY_COUNT_HEADER = b"x-query-count"
+QUERY_METHODS = ("execute_query", "execute_query_dict", "execute_insert", "execute_many", "execute_script")
+
+
+class QueryBudgetExceeded(RuntimeError):
+    pass
+
+
+class QueryStats:
+    __slots__ = ("queries", "query_time", "started", "query_budget", "time_budget", "enforce")
+
+    def __init__(self, query_budget: int = QUERY_BUDGET, time_budget: float = REQUEST_TIME_BUDGET,
+                 enforce: bool = QUERY_BUDGET_ENFORCE):
+        self.queries = 0
+        self.query_time = 0.0
+        self.started = time.perf_counter()
+        self.query_budget = query_budget
+        self.time_budget = time_budget
+        self.enforce = enforce
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    @property
+    def over_budget(self) -> bool:
+        return self.queries > self.query_budget or self.elapsed > self.time_budget
+
+    def describe(self) -> str:
+        return (f"{self.queries} queries in {self.elapsed * 1000:.1f} ms "
+                f"(budget {self.query_budget} queries, {self.time_budget * 1000:.0f} ms)")
+
+
+_current_stats: ContextVar[Optional[QueryStats]] = ContextVar("query_stats", default=None)
+
+
+def current_stats() -> Optional[QueryStats]:
+    return _current_stats.get()
+
+
+def _timed(method):
+    @functools.wraps(method)
+    async def timed(self, *args, **kwargs):
+        stats = _current_stats.get()
+        if stats is None:
+            return await method(self, *args, **kwargs)
+        stats.queries += 1
+        if stats.enforce and stats.over_budget:
+            raise QueryBudgetExceeded(f"Query budget exceeded: {stats.describe()}")
+        started = time.perf_counter()
+        try:
+            return await method(self, *args, **kwargs)
+        finally:
+            stats.query_time += time.perf_counter() - started
+    timed.query_timer = True
+    return timed
+
+
+def _client_classes(cls=BaseDBAsyncClient):
+    for subclass in cls.__subclasses__():
+        yield subclass
+        yield from _client_classes(subclass)
+
+
+def install_query_timer():
+    """
+    Starts counting and timing queries. Call it once Tortoise is initialised, when the
+    backends in use are imported; idempotent. Connections and transactions of every backend are covered.
+    """
+    for cls in _client_classes():
+        for name in QUERY_METHODS:
+            method = vars(cls).get(name)
+            if method is not None and not getattr(method, "query_timer", False):
+                setattr(cls, name, _timed(method))
+
+
+def query_budget(max_queries: int, max_seconds: Optional[float] = None):
+    """Dependency raising the current request's budget, for endpoints that page through data."""
+    async def set_budget():
+        stats = _current_stats.get()
+        if stats is not None:
+            stats.query_budget = max_queries
+            if max_seconds is not None:
+                stats.time_budget = max_seconds
+    return set_budget
+
+
+# For exports, imports and chunked deletes, whose query count grows with the data by design
+unbounded_budget = query_budget(math.inf, math.inf)
+
+
+class QueryBudgetMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        stats = QueryStats()
+        token = _current_stats.set(stats)
+
+        async def send_with_count(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((QUERY_COUNT_HEADER, str(stats.queries).encode()))
+                message["headers"] = headers
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_count)
+        finally:
+            _current_stats.reset(token)
+            # Tasks spawned by the request keep the stats in their context; stop failing them
+            stats.enforce = False
+            if stats.over_budget:
+                logger.warning("%s %s ran %s", scope["method"], scope["path"], stats.describe())
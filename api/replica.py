@@ -0,0 +1,130 @@
+"""
+Routing of read-only requests to the read replica, with read-your-writes.
+
+Read-only endpoints declare Depends(use_replica). Within them ReplicaRouter sends ORM reads
+to the "replica" connection and read_connection() returns it for raw SQL; writes and
+SELECT ... FOR UPDATE always go to the primary, as does everything outside those endpoints.
+Endpoints that write declare Depends(records_writes): for READ_YOUR_WRITES_WINDOW seconds
+after a user's write, that user's reads stay on the primary, so replication lag never hides
+their own changes. With CACHE_SHARED_DIR set the window is shared by every worker on the host.
+
+Without DATABASE_REPLICA_URL all of this is a no-op. To try it locally, point
+DATABASE_REPLICA_URL at a second SQLite file (a copy of the primary, which then never
+catches up) or at a second PostgreSQL instance.
+"""
+import os
+import time
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Dict, Optional
+
+from fastapi import Depends
+from tortoise import connections
+from tortoise.backends.base.client import BaseDBAsyncClient
+
+from api.cache import TTLCache
+from api.config import CACHE_SHARED_DIR, READ_YOUR_WRITES_WINDOW
+from api.database import PRIMARY_CONNECTION, REPLICA_CONNECTION
+from api.dependencies import get_current_user
+
+# Users whose recent writes this process remembers
+RECENT_WRITERS = 10000
+
+
+class RequestRouting:
+    __slots__ = ("replica",)
+
+    def __init__(self):
+        self.replica = False
+
+
+_routing: ContextVar[Optional[RequestRouting]] = ContextVar("request_routing", default=None)
+
+
+def reads_from_replica() -> bool:
+    routing = _routing.get()
+    return routing is not None and routing.replica
+
+
+class ReplicaRouter:
+    """Tortoise router, registered by api.database when a replica is configured."""
+
+    def db_for_read(self, model) -> Optional[str]:
+        return REPLICA_CONNECTION if reads_from_replica() else None
+
+    def db_for_write(self, model) -> Optional[str]:
+        return PRIMARY_CONNECTION
+
+
+def replica_configured() -> bool:
+    return REPLICA_CONNECTION in connections.db_config
+
+
+def read_connection() -> BaseDBAsyncClient:
+    """Connection for raw read-only SQL: the replica inside routed requests, else the primary."""
+    return connections.get(REPLICA_CONNECTION if reads_from_replica() else PRIMARY_CONNECTION)
+
+
+class ReadYourWrites:
+    """
+    Remembers when each user last wrote. Kept in memory, and as the modification time of
+    a marker file per user when a shared directory is given.
+    """
+
+    def __init__(self, window: float = READ_YOUR_WRITES_WINDOW, directory: Optional[str] = CACHE_SHARED_DIR):
+        self.window = window
+        self.directory = Path(directory, "recent_writes") if directory else None
+        self.recent = TTLCache(maxsize=RECENT_WRITERS, ttl=window)
+
+    def _marker(self, user_id: int) -> Path:
+        return self.directory / str(user_id)
+
+    def record_write(self, user_id: int):
+        self.recent.set(user_id, True)
+        if self.directory:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self._marker(user_id).touch()
+
+    def pinned(self, user_id: int) -> bool:
+        """Whether the user wrote within the window, so their reads must see the primary."""
+        if self.recent.get(user_id):
+            return True
+        if not self.directory:
+            return False
+        try:
+            return time.time() - os.stat(self._marker(user_id)).st_mtime < self.window
+        except FileNotFoundError:
+            return False
+
+
+read_your_writes = ReadYourWrites()
+
+
+async def use_replica(user: Dict = Depends(get_current_user)):
+    """Dependency of read-only endpoints: read from the replica unless the user just wrote."""
+    routing = _routing.get()
+    if routing is not None and replica_configured():
+        routing.replica = not read_your_writes.pinned(user.get("id"))
+
+
+async def records_writes(user: Dict = Depends(get_current_user)):
+    """Dependency of endpoints that write: pins the user's reads to the primary afterwards."""
+    yield
+    if user.get("id"):
+        read_your_writes.record_write(user["id"])
+
+
+class ReplicaRoutingMiddleware:
+    """Gives each request its own routing state, which streamed responses keep until they finish."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        token = _routing.set(RequestRouting())
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _routing.reset(token)
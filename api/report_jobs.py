@@ -0,0 +1,206 @@
+"""
+Report jobs backed by content-addressed artifacts on local disk.
+
+A report's id is derived from (user, period, period data version), so an unchanged
+period always maps to the same artifact and repeat downloads are served from disk.
+Expense writes bump the version of the months they touch (see api.rollups), which
+gives affected periods a new id while every other cached report stays valid.
+
+Jobs that have not produced an artifact yet are tracked by a <report id>.job marker file
+next to it holding their status (pending, running or failed), so every worker sees the
+jobs of the others. A finished job removes its marker; markers older than REPORT_JOB_TTL
+are treated as gone and deleted.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+from typing import Dict, Optional, Set, Tuple
+
+from fastapi.responses import FileResponse, Response
+from starlette.requests import Request
+
+from api.conditional import cache_headers, not_modified
+from api.config import REPORT_JOB_TTL, REPORTS_DIR
+from api.reports import REPORT_MEDIA_TYPES, report_filename, report_pool, write_report
+from api.rollups import period_version
+
+logger = logging.getLogger(__name__)
+
+# Artifacts are immutable: a changed period gets a new report id
+ARTIFACT_CACHE_CONTROL = "private, max-age=31536000, immutable"
+
+# Running jobs of this process; the event loop only keeps weak references to tasks
+_tasks: Set[asyncio.Task] = set()
+
+def _user_dir(user_id: int) -> Path:
+    return Path(REPORTS_DIR) / str(user_id)
+
+
+def _period_prefix(year: int, month: Optional[int]) -> str:
+    return f"{year}_{month if month else 'full_year'}"
+
+
+def _artifact_path(user_id: int, year: int, month: Optional[int], report_format: str, report_id: str) -> Path:
+    return _user_dir(user_id) / f"{_period_prefix(year, month)}_{report_id}.{report_format}"
+
+
+def _marker_path(user_id: int, report_id: str) -> Path:
+    return _user_dir(user_id) / f"{report_id}.job"
+
+
+def _read_marker(path: Path) -> Optional[str]:
+    try:
+        age = time.time() - path.stat().st_mtime
+        status = path.read_text().strip()
+    except OSError:
+        return None
+    if age > REPORT_JOB_TTL:
+        path.unlink(missing_ok=True)
+        return None
+    return status or "pending"
+
+
+def _write_marker(path: Path, status: str):
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp.write_text(status)
+    os.replace(tmp, path)
+
+
+def _claim_marker(path: Path) -> bool:
+    """Creates a pending marker unless one exists, atomically across workers."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return False
+    with os.fdopen(fd, "w") as f:
+        f.write("pending")
+    return True
+
+
+def _expire_markers(user_id: int):
+    for path in _user_dir(user_id).glob("*.job"):
+        _read_marker(path)
+
+
+def find_artifact(user_id: int, report_id: str) -> Optional[Path]:
+    """Returns the user's finished artifact for report_id, if there is one."""
+    if not report_id.isalnum():
+        return None
+    return next(_user_dir(user_id).glob(f"*_{report_id}.*"), None)
+
+
+async def cached_report(user_id: int, year: int, month: Optional[int],
+                        report_format: str = "xlsx") -> Tuple[str, Optional[Path]]:
+    """
+    Returns the report id for the period's current data and its artifact path,
+    or None as the path when the artifact has not been built yet.
+    """
+    version = await period_version(user_id, year, month)
+    key = f"{user_id}|{year}|{month or 0}|{report_format}|{version}"
+    report_id = hashlib.sha256(key.encode()).hexdigest()[:32]
+    path = _artifact_path(user_id, year, month, report_format, report_id)
+    return report_id, path if path.exists() else None
+
+
+async def build_artifact(user_id: int, year: int, month: Optional[int], report_format: str,
+                         report_id: str, totals: dict) -> Path:
+    """
+    Writes the report to its artifact path and removes older artifacts of the same period and format.
+    Must run inside a report_pool job.
+    """
+    path = _artifact_path(user_id, year, month, report_format, report_id)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    # Write next to the final path and rename, so readers never see a partial file
+    tmp = NamedTemporaryFile(dir=path.parent, suffix=".tmp", delete=False)
+    try:
+        with tmp:
+            await write_report(report_format, user_id, year, month, totals, output=tmp)
+        os.replace(tmp.name, path)
+    except BaseException:
+        Path(tmp.name).unlink(missing_ok=True)
+        raise
+
+    for stale in path.parent.glob(f"{_period_prefix(year, month)}_*.{report_format}"):
+        if stale != path:
+            stale.unlink(missing_ok=True)
+    return path
+
+
+def _job_status(report_id: str, status: str) -> Dict:
+    content = {"id": report_id, "status": status}
+    if status == "done":
+        content["download_url"] = f"/reports/{report_id}/download"
+    return content
+
+
+async def submit_report(user_id: int, year: int, month: Optional[int], report_format: str, totals: dict) -> Dict:
+    """
+    Starts building the period's report in the background unless it is cached or already
+    running in any worker. Raises PoolBusyError when the report pool cannot take another job.
+    """
+    report_id, path = await cached_report(user_id, year, month, report_format)
+    if path:
+        return _job_status(report_id, "done")
+
+    _expire_markers(user_id)
+    marker = _marker_path(user_id, report_id)
+    status = _read_marker(marker)
+    if status == "failed":
+        marker.unlink(missing_ok=True)
+    elif status:
+        return _job_status(report_id, status)
+    if not _claim_marker(marker):
+        # Another worker claimed it in the meantime
+        return _job_status(report_id, _read_marker(marker) or "pending")
+
+    async def run():
+        _write_marker(marker, "running")
+        try:
+            await build_artifact(user_id, year, month, report_format, report_id, totals)
+        except Exception:
+            logger.exception("Report %s failed", report_id)
+            _write_marker(marker, "failed")
+        else:
+            marker.unlink(missing_ok=True)
+
+    try:
+        task = report_pool.submit(run)
+    except Exception:
+        marker.unlink(missing_ok=True)
+        raise
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return _job_status(report_id, "pending")
+
+
+def report_status(user_id: int, report_id: str) -> Optional[Dict]:
+    """Returns the status of one of the user's reports, or None if it is unknown."""
+    if find_artifact(user_id, report_id):
+        return _job_status(report_id, "done")
+    if not report_id.isalnum():
+        return None
+    status = _read_marker(_marker_path(user_id, report_id))
+    return _job_status(report_id, status) if status else None
+
+
+def report_file_response(request: Request, report_id: str, path: Path) -> Response:
+    """
+    Serves an artifact with an ETag of its id; artifacts never change, so a matching
+    If-None-Match gets an empty 304.
+    """
+    etag = f'"{report_id}"'
+    cached = not_modified(request, etag, ARTIFACT_CACHE_CONTROL)
+    if cached:
+        return cached
+    headers = cache_headers(etag, ARTIFACT_CACHE_CONTROL)
+
+    year, month = path.name.split("_")[:2]
+    report_format = path.suffix.lstrip(".")
+    filename = report_filename(int(year), None if month == "full" else int(month), report_format)
+    return FileResponse(path, media_type=REPORT_MEDIA_TYPES[report_format], filename=filename, headers=headers)
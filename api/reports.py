@@ -0,0 +1,197 @@
+import csv
+import io
+from tempfile import SpooledTemporaryFile
+from typing import AsyncIterator, BinaryIO, List, Optional
+
+import openpyxl
+
+try:
+    import pyarrow
+    import pyarrow.compute
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:  # Parquet/Arrow exports are optional
+    pyarrow = None
+
+from api.archive import is_archived, with_archived_rows
+from api.filters import expense_period_filter
+from api.money import PAISE_PER_RUPEE, to_rupees
+from api.config import REPORT_QUEUE_DEPTH, REPORT_WORKERS
+from api.pagination import iter_expense_batches
+from api.workers import WorkerPool
+
+XLSX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+REPORT_MEDIA_TYPES = {
+    "xlsx": XLSX_MEDIA_TYPE,
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+    "arrow": "application/vnd.apache.arrow.file",
+}
+ARROW_FORMATS = ("parquet", "arrow")
+
+# Reports up to this size stay in memory, larger ones spill to a temp file
+SPOOL_MAX_SIZE = 8 * 1024 * 1024
+
+# Report building is CPU-bound, so it runs on a bounded pool instead of the event loop
+report_pool = WorkerPool("report", REPORT_WORKERS, REPORT_QUEUE_DEPTH)
+
+HEADERS = ["Date", "Category", "Amount"]
+TOTAL_LABELS = [
+    ("actual_total_expenditure", "Actual Total Expenditure"),
+    ("non_essential_expenditure", "Non-Essential Expenditure"),
+    ("essential_expenditure", "Desired Essential Expenditure"),
+]
+
+
+class ReportFormatUnavailable(Exception):
+    """Raised when a report format needs an optional dependency that is not installed."""
+
+
+def report_filename(year: int, month: Optional[int], extension: str) -> str:
+    return f"expenses_{year}_{month if month else 'full_year'}.{extension}"
+
+
+def check_report_format(report_format: str, year: Optional[int] = None):
+    if report_format in ARROW_FORMATS and pyarrow is None:
+        raise ReportFormatUnavailable(f"{report_format} reports require pyarrow to be installed")
+    if pyarrow is None and is_archived(year):
+        raise ReportFormatUnavailable(f"Reports of {year}, which is archived, require pyarrow to be installed")
+
+
+def _report_batches(user_id: int, year: int, month: Optional[int]) -> AsyncIterator[List[dict]]:
+    # The one query every report format is built from, plus the archive for closed years
+    batches = iter_expense_batches(expense_period_filter(user_id, year, month), "expense_type__name", "amount_paise")
+    if is_archived(year):
+        return with_archived_rows(batches, user_id, year, month)
+    return batches
+
+
+def _report_row(expense: dict) -> list:
+    return [expense["date"].strftime("%Y-%m-%d"), expense["expense_type__name"], expense["amount_paise"] / PAISE_PER_RUPEE]
+
+
+def _totals_rows(totals: dict) -> List[list]:
+    # An empty row, then the totals under the Category/Amount columns
+    return [[]] + [["", label, to_rupees(totals[key])] for key, label in TOTAL_LABELS]
+
+
+def _append_rows(ws, expenses):
+    for expense in expenses:
+        ws.append(_report_row(expense))
+
+
+def _finish_workbook(wb, ws, totals: dict, output: BinaryIO) -> BinaryIO:
+    for row in _totals_rows(totals):
+        ws.append(row)
+    wb.save(output)
+    return output
+
+
+async def _write_xlsx(user_id: int, year: int, month: Optional[int], totals: dict,
+                      output: BinaryIO, pool: WorkerPool):
+    # A write-only workbook streams rows to disk instead of keeping the sheet in memory
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet(title=f"Expenses_{year}_{month if month else 'FullYear'}")
+    ws.append(HEADERS)
+
+    async for expenses in _report_batches(user_id, year, month):
+        await pool.run(_append_rows, ws, expenses)
+
+    await pool.run(_finish_workbook, wb, ws, totals, output)
+
+
+def _arrow_schema(totals: dict):
+    # Totals travel as schema metadata, the columnar counterpart of the XLSX totals rows
+    return pyarrow.schema(
+        [("date", pyarrow.date32()), ("category", pyarrow.string()), ("amount", pyarrow.float64())],
+        metadata={key: str(to_rupees(totals[key])) for key, _ in TOTAL_LABELS},
+    )
+
+
+def _arrow_batch(schema, expenses):
+    return pyarrow.record_batch(
+        [
+            [expense["date"].date() for expense in expenses],
+            [expense["expense_type__name"] for expense in expenses],
+            # Converted for the whole column at once
+            pyarrow.compute.divide(
+                pyarrow.array([expense["amount_paise"] for expense in expenses], pyarrow.float64()),
+                float(PAISE_PER_RUPEE),
+            ),
+        ],
+        schema=schema,
+    )
+
+
+def _write_arrow_batch(writer, schema, expenses):
+    writer.write_batch(_arrow_batch(schema, expenses))
+
+
+async def _write_arrow(report_format: str, user_id: int, year: int, month: Optional[int], totals: dict,
+                       output: BinaryIO, pool: WorkerPool):
+    schema = _arrow_schema(totals)
+    if report_format == "parquet":
+        writer = pyarrow.parquet.ParquetWriter(output, schema)
+    else:
+        writer = pyarrow.ipc.new_file(output, schema)
+
+    try:
+        # One record batch (parquet row group) per database batch
+        async for expenses in _report_batches(user_id, year, month):
+            await pool.run(_write_arrow_batch, writer, schema, expenses)
+    finally:
+        await pool.run(writer.close)
+
+
+async def write_report(report_format: str, user_id: int, year: int, month: Optional[int], totals: dict,
+                       output: Optional[BinaryIO] = None, pool: WorkerPool = report_pool) -> BinaryIO:
+    """
+    Writes the report for the period in any of REPORT_MEDIA_TYPES' formats into output
+    (a new spooled temp file by default) and returns it rewound for reading.
+    Rows are fetched in keyset batches and written batch by batch, so the full row
+    list is never held in memory. The encoding runs on the pool's threads; call this inside pool.job().
+    """
+    check_report_format(report_format, year)
+    if output is None:
+        output = SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+
+    if report_format == "xlsx":
+        await _write_xlsx(user_id, year, month, totals, output, pool)
+    elif report_format in ARROW_FORMATS:
+        await _write_arrow(report_format, user_id, year, month, totals, output, pool)
+    elif report_format == "csv":
+        async for chunk in iter_csv_report(user_id, year, month, totals):
+            output.write(chunk.encode())
+    else:
+        raise ValueError(f"Unsupported report format: {report_format}")
+
+    output.seek(0)
+    return output
+
+
+async def write_xlsx_report(user_id: int, year: int, month: Optional[int], totals: dict,
+                            output: Optional[BinaryIO] = None, pool: WorkerPool = report_pool) -> BinaryIO:
+    return await write_report("xlsx", user_id, year, month, totals, output, pool)
+
+
+async def iter_csv_report(user_id: int, year: int, month: Optional[int], totals: dict) -> AsyncIterator[str]:
+    """
+    Streams the CSV report one database batch at a time, with the totals as a trailing section.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def flush() -> str:
+        text = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return text
+
+    writer.writerow(HEADERS)
+    async for expenses in _report_batches(user_id, year, month):
+        writer.writerows(_report_row(expense) for expense in expenses)
+        yield flush()
+
+    writer.writerows(_totals_rows(totals))
+    yield flush()
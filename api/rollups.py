@@ -0,0 +1,252 @@
+"""
+Maintenance of MonthlyExpenseRollup, the per-user monthly totals of DailyExpense,
+and of ExpensePeriodVersion, the per-user monthly write counters.
+
+Every expense write applies its delta through record_expense/unrecord_expense (or their
+plural forms for batches) inside the same transaction as the write, which also bumps
+the month's version. The command line rebuilds or checks the table against raw rows:
+
+    python -m api.rollups rebuild [--user EMAIL]
+    python -m api.rollups check [--user EMAIL]
+"""
+import argparse
+import asyncio
+import sys
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from tortoise import Tortoise
+from tortoise.backends.base.client import BaseDBAsyncClient
+from tortoise.expressions import F, Q
+from tortoise.functions import Count, Sum
+from tortoise.transactions import in_transaction
+
+from api.aggregations import MonthBucket
+from api.archive import archived_rollups
+from api.database import PRIMARY_CONNECTION, TORTOISE_ORM, generate_schemas, is_postgres
+from api.models import DailyExpense, ExpensePeriodVersion, MonthlyExpenseRollup, User
+
+RollupKey = Tuple[int, int, int, int, bool]
+ROLLUP_KEY_FIELDS = ("user_id", "year", "month", "expense_type_id", "really_needed")
+
+
+def _rollup_key(expense: DailyExpense) -> dict:
+    return {
+        "user_id": expense.user_id,
+        "year": expense.date.year,
+        "month": expense.date.month,
+        "expense_type_id": expense.expense_type_id,
+        "really_needed": bool(expense.really_needed),
+    }
+
+
+def _quoted(columns: Iterable[str]) -> str:
+    return ", ".join(f'"{column}"' for column in columns)
+
+
+def _upsert_sql(conn: BaseDBAsyncClient, table: str, key_columns: Tuple[str, ...],
+                counter_columns: Tuple[str, ...]) -> str:
+    # One atomic statement, so two first writes to a period cannot both try to insert
+    columns = key_columns + counter_columns
+    if is_postgres(conn):
+        placeholders = ", ".join(f"${i}" for i in range(1, len(columns) + 1))
+    else:
+        placeholders = ", ".join("?" for _ in columns)
+    increments = ", ".join(f'"{column}" = "{table}"."{column}" + excluded."{column}"' for column in counter_columns)
+    return (
+        f'INSERT INTO "{table}" ({_quoted(columns)}) VALUES ({placeholders}) '
+        f'ON CONFLICT ({_quoted(key_columns)}) DO UPDATE SET {increments}'
+    )
+
+
+async def _bump_version(user_id: int, year: int, month: int, using_db: BaseDBAsyncClient):
+    await using_db.execute_query(
+        _upsert_sql(using_db, ExpensePeriodVersion._meta.db_table, ("user_id", "year", "month"), ("version",)),
+        [user_id, year, month, 1],
+    )
+
+
+async def period_version(user_id: int, year: int, month: Optional[int] = None) -> str:
+    """
+    Returns a token that changes whenever any expense of the user's month (or year) is written.
+    """
+    query = ExpensePeriodVersion.filter(user_id=user_id, year=year)
+    if month:
+        query = query.filter(month=month)
+    versions = await query.order_by("month").values_list("month", "version")
+    return ",".join(f"{period_month}:{version}" for period_month, version in versions)
+
+
+async def user_data_version(user_id: int, year: Optional[int] = None, month: Optional[int] = None) -> str:
+    """
+    Like period_version, or for the user's whole history when year is None.
+    Every write adds one to some month's counter, so their sum identifies the history's state.
+    """
+    if year:
+        return await period_version(user_id, year, month)
+    totals = await (
+        ExpensePeriodVersion.filter(user_id=user_id)
+        .annotate(total=Sum("version"))
+        .values_list("total", flat=True)
+    )
+    return f"*:{totals[0] or 0}"
+
+
+async def _apply_delta(key: dict, amount: int, count: int, using_db: BaseDBAsyncClient):
+    await using_db.execute_query(
+        _upsert_sql(using_db, MonthlyExpenseRollup._meta.db_table, ROLLUP_KEY_FIELDS, ("total_paise", "expense_count")),
+        [*(key[field] for field in ROLLUP_KEY_FIELDS), amount, count],
+    )
+    if count < 0:
+        await MonthlyExpenseRollup.filter(**key, expense_count__lte=0).using_db(using_db).delete()
+
+
+async def _apply(expense: DailyExpense, sign: int, using_db: BaseDBAsyncClient):
+    key = _rollup_key(expense)
+    await _bump_version(key["user_id"], key["year"], key["month"], using_db)
+    await _apply_delta(key, sign * (expense.amount_paise or 0), sign, using_db)
+
+
+async def _apply_many(expenses: Iterable[DailyExpense], sign: int, using_db: BaseDBAsyncClient):
+    deltas: Dict[RollupKey, List] = {}
+    for expense in expenses:
+        key = tuple(_rollup_key(expense).values())
+        delta = deltas.setdefault(key, [0, 0])
+        delta[0] += sign * (expense.amount_paise or 0)
+        delta[1] += sign
+    for user_id, year, month in sorted({key[:3] for key in deltas}):
+        await _bump_version(user_id, year, month, using_db)
+    for key, (amount, count) in deltas.items():
+        await _apply_delta(dict(zip(ROLLUP_KEY_FIELDS, key)), amount, count, using_db)
+
+
+async def record_expense(expense: DailyExpense, using_db: BaseDBAsyncClient):
+    """Adds a newly written expense to its monthly rollup."""
+    await _apply(expense, 1, using_db)
+
+
+async def unrecord_expense(expense: DailyExpense, using_db: BaseDBAsyncClient):
+    """Removes an expense's previous values from its monthly rollup."""
+    await _apply(expense, -1, using_db)
+
+
+async def record_expenses(expenses: Iterable[DailyExpense], using_db: BaseDBAsyncClient):
+    """Adds many new expenses with one rollup update per (month, type, essential) group."""
+    await _apply_many(expenses, 1, using_db)
+
+
+async def unrecord_expenses(expenses: Iterable[DailyExpense], using_db: BaseDBAsyncClient):
+    """Removes many expenses' previous values with one rollup update per group."""
+    await _apply_many(expenses, -1, using_db)
+
+
+async def _raw_rollups(user_id: Optional[int] = None) -> Dict[RollupKey, Tuple[int, int]]:
+    query = DailyExpense.all()
+    if user_id:
+        query = query.filter(user_id=user_id)
+    rows = await (
+        query.annotate(month=MonthBucket("date"), total=Sum("amount_paise"), count=Count("id"))
+        .group_by("user_id", "month", "expense_type_id", "really_needed")
+        .values("user_id", "month", "expense_type_id", "really_needed", "total", "count")
+    )
+    rollups = {}
+    for row in rows:
+        year, month = (int(part) for part in row["month"].split("-"))
+        key = (row["user_id"], year, month, row["expense_type_id"], bool(row["really_needed"]))
+        rollups[key] = (int(row["total"] or 0), row["count"])
+    # Archived years left the table but still count in the rollups
+    for key, (total, count) in (await asyncio.to_thread(archived_rollups, user_id)).items():
+        raw_total, raw_count = rollups.get(key, (0, 0))
+        rollups[key] = (raw_total + total, raw_count + count)
+    return rollups
+
+
+async def _stored_rollups(user_id: Optional[int] = None) -> Dict[RollupKey, Tuple[int, int]]:
+    query = MonthlyExpenseRollup.all()
+    if user_id:
+        query = query.filter(user_id=user_id)
+    rows = await query.values(
+        "user_id", "year", "month", "expense_type_id", "really_needed", "total_paise", "expense_count"
+    )
+    return {
+        (row["user_id"], row["year"], row["month"], row["expense_type_id"], bool(row["really_needed"])):
+            (row["total_paise"], row["expense_count"])
+        for row in rows
+    }
+
+
+async def rebuild(user_id: Optional[int] = None) -> int:
+    """
+    Recomputes rollups from raw DailyExpense rows, for one user or everyone.
+    Returns the number of rollup rows written.
+    """
+    raw = await _raw_rollups(user_id)
+    async with in_transaction(PRIMARY_CONNECTION) as conn:
+        query = MonthlyExpenseRollup.all().using_db(conn)
+        if user_id:
+            query = query.filter(user_id=user_id)
+        await query.delete()
+        await MonthlyExpenseRollup.bulk_create(
+            [
+                MonthlyExpenseRollup(
+                    user_id=key[0], year=key[1], month=key[2], expense_type_id=key[3],
+                    really_needed=key[4], total_paise=total, expense_count=count,
+                )
+                for key, (total, count) in raw.items()
+            ],
+            batch_size=1000,
+            using_db=conn,
+        )
+    return len(raw)
+
+
+async def check(user_id: Optional[int] = None) -> List[str]:
+    """
+    Compares rollups with raw DailyExpense rows and describes every mismatch.
+    An empty list means the rollups are consistent.
+    """
+    raw = await _raw_rollups(user_id)
+    stored = await _stored_rollups(user_id)
+    stored = {key: value for key, value in stored.items() if value[1] != 0}
+
+    problems = []
+    for key in sorted(set(raw) | set(stored), key=str):
+        raw_total, raw_count = raw.get(key, (0, 0))
+        stored_total, stored_count = stored.get(key, (0, 0))
+        if raw_count != stored_count or raw_total != stored_total:
+            problems.append(
+                f"{key}: raw total={raw_total} count={raw_count}, "
+                f"rollup total={stored_total} count={stored_count}"
+            )
+    return problems
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["rebuild", "check"])
+    parser.add_argument("--user", help="Only process this user's email")
+    args = parser.parse_args()
+
+    await Tortoise.init(config=TORTOISE_ORM)
+    await generate_schemas()
+    try:
+        user_id = None
+        if args.user:
+            user_id = await User.filter(email=args.user).first().values_list("id", flat=True)
+            if user_id is None:
+                print(f"❌ Unknown user {args.user}")
+                return 1
+        if args.command == "rebuild":
+            count = await rebuild(user_id)
+            print(f"✅ Rebuilt {count} rollup rows")
+            return 0
+        problems = await check(user_id)
+        for problem in problems:
+            print(problem)
+        print(f"{'❌' if problems else '✅'} {len(problems)} inconsistent rollup rows")
+        return 1 if problems else 0
+    finally:
+        await Tortoise.close_connections()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,116 @@
+"""
+Indexed, ranked search over DailyExpense.name.
+
+- SQLite: an FTS5 table with the trigram tokenizer, kept in sync by triggers.
+- Postgres: a pg_trgm GIN index, ranked by similarity().
+- Anything else falls back to an unranked name__icontains scan.
+"""
+import logging
+from typing import List
+
+from tortoise import connections
+from tortoise.exceptions import OperationalError
+
+from api.database import PRIMARY_CONNECTION
+from api.models import DailyExpense
+from api.replica import read_connection
+from api.serialization import expense_rows
+
+logger = logging.getLogger(__name__)
+
+SQLITE_SEARCH_SCHEMA = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS "dailyexpense_fts" USING fts5(
+        name, content='dailyexpense', content_rowid='id', tokenize='trigram'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS "dailyexpense_fts_insert" AFTER INSERT ON "dailyexpense" BEGIN
+        INSERT INTO "dailyexpense_fts"(rowid, name) VALUES (new.id, new.name);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS "dailyexpense_fts_delete" AFTER DELETE ON "dailyexpense" BEGIN
+        INSERT INTO "dailyexpense_fts"("dailyexpense_fts", rowid, name) VALUES ('delete', old.id, old.name);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS "dailyexpense_fts_update" AFTER UPDATE OF name ON "dailyexpense" BEGIN
+        INSERT INTO "dailyexpense_fts"("dailyexpense_fts", rowid, name) VALUES ('delete', old.id, old.name);
+        INSERT INTO "dailyexpense_fts"(rowid, name) VALUES (new.id, new.name);
+    END""",
+]
+
+POSTGRES_SEARCH_SCHEMA = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    'CREATE INDEX IF NOT EXISTS "idx_dailyexpense_name_trgm" ON "dailyexpense" USING gin ("name" gin_trgm_ops)',
+]
+
+# Set by ensure_search_index once the dialect's index exists
+_search_index_ready = False
+
+
+def _dialect() -> str:
+    return connections.get(PRIMARY_CONNECTION).capabilities.dialect
+
+
+async def ensure_search_index():
+    """
+    Creates the search index for the current database if it is missing.
+    """
+    global _search_index_ready
+    # DDL goes to the primary; a replica gets the index through replication
+    conn = connections.get(PRIMARY_CONNECTION)
+    dialect = _dialect()
+    try:
+        if dialect == "sqlite":
+            exists = await conn.execute_query_dict(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'dailyexpense_fts'"
+            )
+            for statement in SQLITE_SEARCH_SCHEMA:
+                await conn.execute_script(statement)
+            if not exists:
+                # Index rows written before the FTS table existed
+                await conn.execute_script("""INSERT INTO "dailyexpense_fts"("dailyexpense_fts") VALUES ('rebuild')""")
+        elif dialect == "postgres":
+            for statement in POSTGRES_SEARCH_SCHEMA:
+                await conn.execute_script(statement)
+        else:
+            return
+    except OperationalError as e:
+        logger.error("Search index unavailable, falling back to unindexed search: %s", e)
+        return
+    _search_index_ready = True
+
+
+async def _ranked_ids(user_id: int, term: str, limit: int) -> List[int]:
+    conn = read_connection()
+    if _dialect() == "sqlite":
+        phrase = '"' + term.replace('"', '""') + '"'
+        rows = await conn.execute_query_dict(
+            'SELECT d."id" FROM "dailyexpense_fts" f JOIN "dailyexpense" d ON d."id" = f.rowid '
+            'WHERE "dailyexpense_fts" MATCH ? AND d."user_id" = ? '
+            'ORDER BY bm25("dailyexpense_fts"), d."date" DESC LIMIT ?',
+            [phrase, user_id, limit],
+        )
+    else:
+        pattern = "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        rows = await conn.execute_query_dict(
+            'SELECT "id" FROM "dailyexpense" WHERE "user_id" = $1 AND "name" ILIKE $2 '
+            'ORDER BY similarity("name", $3) DESC, "date" DESC LIMIT $4',
+            [user_id, pattern, term, limit],
+        )
+    return [row["id"] for row in rows]
+
+
+async def search_expenses(user_id: int, term: str, limit: int) -> List[dict]:
+    """
+    Returns up to limit of the user's expenses whose name contains term, best matches first.
+    Matches are fetched with a single expense query joined to their expense type.
+    """
+    if not _search_index_ready:
+        return await expense_rows(
+            DailyExpense.filter(user_id=user_id, name__icontains=term)
+            .order_by("-date")
+            .limit(limit)
+        )
+
+    ids = await _ranked_ids(user_id, term, limit)
+    if not ids:
+        return []
+    expenses = await expense_rows(DailyExpense.filter(id__in=ids))
+    rank = {expense_id: position for position, expense_id in enumerate(ids)}
+    return sorted(expenses, key=lambda expense: rank[expense["id"]])
@@ -0,0 +1,38 @@
+"""
+Users, identified by email at login and by their integer id everywhere else.
+
+/auth calls upsert_user once per login and puts the id in the session and the access
+token, so requests carry it and never look it up. Sessions and tokens issued before
+users had ids are resolved once per process through a small cache.
+"""
+from typing import Dict
+
+from tortoise import connections
+
+from api.cache import TTLCache
+from api.database import PRIMARY_CONNECTION
+from api.models import User
+
+_user_ids = TTLCache(maxsize=4096, ttl=3600)
+
+
+async def upsert_user(userinfo: Dict) -> int:
+    """Creates or refreshes the user from an OpenID userinfo. Returns the user's id."""
+    profile = {"name": userinfo.get("name"), "picture": userinfo.get("picture")}
+    user, created = await User.get_or_create(
+        email=userinfo["email"], defaults=profile, using_db=connections.get(PRIMARY_CONNECTION),
+    )
+    if not created and any(getattr(user, field) != value for field, value in profile.items()):
+        await User.filter(id=user.id).update(**profile)
+    _user_ids.set(user.email, user.id)
+    return user.id
+
+
+async def user_id_for(email: str) -> int:
+    """The id of the user with this email, created if needed; for sessions without one."""
+    user_id = _user_ids.get(email)
+    if user_id is None:
+        user, _ = await User.get_or_create(email=email, using_db=connections.get(PRIMARY_CONNECTION))
+        user_id = user.id
+        _user_ids.set(email, user_id)
+    return user_id
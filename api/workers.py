@@ -0,0 +1,94 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+
+class PoolBusyError(Exception):
+    """Raised when a job is submitted while every worker and queue slot is taken."""
+
+
+class WorkerPool:
+    """
+    Bounded thread pool for CPU-bound work called from async handlers.
+
+    At most `workers` jobs run at once and at most `queue_depth` more wait for a slot;
+    anything beyond that is rejected with PoolBusyError so callers can apply back-pressure.
+    """
+
+    def __init__(self, name: str, workers: int, queue_depth: int):
+        self.name = name
+        self.capacity = workers + queue_depth
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        self._slots = asyncio.Semaphore(workers)
+        self._admitted = 0
+        self.metrics: Dict[str, float] = {
+            "jobs": 0,
+            "rejected": 0,
+            "queue_wait_seconds_total": 0.0,
+            "queue_wait_seconds_max": 0.0,
+            "build_seconds_total": 0.0,
+            "build_seconds_max": 0.0,
+        }
+
+    @property
+    def in_flight(self) -> int:
+        return self._admitted
+
+    def _observe(self, metric: str, seconds: float):
+        self.metrics[f"{metric}_seconds_total"] += seconds
+        self.metrics[f"{metric}_seconds_max"] = max(self.metrics[f"{metric}_seconds_max"], seconds)
+
+    def _admit(self):
+        if self._admitted >= self.capacity:
+            self.metrics["rejected"] += 1
+            raise PoolBusyError(f"{self.name} pool is full")
+        self._admitted += 1
+
+    @asynccontextmanager
+    async def _admitted_job(self):
+        queued_at = time.perf_counter()
+        try:
+            async with self._slots:
+                started_at = time.perf_counter()
+                self._observe("queue_wait", started_at - queued_at)
+                try:
+                    yield self
+                finally:
+                    build = time.perf_counter() - started_at
+                    self._observe("build", build)
+                    self.metrics["jobs"] += 1
+                    logger.info("%s job took %.3fs after %.3fs in queue", self.name, build, started_at - queued_at)
+        finally:
+            self._admitted -= 1
+
+    @asynccontextmanager
+    async def job(self):
+        """
+        Reserves a worker slot for the duration of the block, waiting in the queue if needed.
+        Raises PoolBusyError if the queue is full.
+        """
+        self._admit()
+        async with self._admitted_job():
+            yield self
+
+    def submit(self, job_factory: Callable[[], Awaitable[Any]]) -> "asyncio.Task":
+        """
+        Admits a background job right away (raising PoolBusyError if the queue is full)
+        and runs job_factory() as a task once a worker slot frees up.
+        """
+        self._admit()
+
+        async def run_job():
+            async with self._admitted_job():
+                return await job_factory()
+
+        return asyncio.create_task(run_job())
+
+    async def run(self, func: Callable[..., Any], *args: Any) -> Any:
+        """Runs func(*args) on a pool thread without blocking the event loop."""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
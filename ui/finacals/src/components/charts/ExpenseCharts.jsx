@@ -76,8 +76,7 @@ const ExpenseCharts = () => {
     })
       .then((response) => response.json())
       .then(data => {
-        const expenseData = data.data;  // Extract the data field from the API response
-        const categories = Object.keys(expenseData);
+        const expenseData = data.data;  // Columnar labels/amounts/counts from the API
 
         // Initialize chart datasets
         const barData = {
@@ -112,36 +111,28 @@ const ExpenseCharts = () => {
           }],
         };
 
-        // Process each category to populate chart data
-        categories.forEach(category => {
-          const categoryData = expenseData[category];
+        // Each label already carries the per-month, per-type sum computed by the API
+        expenseData.labels.forEach((label, index) => {
+          const sumAmount = expenseData.amounts[index];
 
-          Object.keys(categoryData).forEach(expenseType => {
-            const expenseItems = categoryData[expenseType];
-            let totalAmount = 0;
+          // Assign random colors for each expense type
+          const randomColor = generateRandomColor();
 
-            // Sum the amounts for each expense type
-            const sumAmount = expenseItems.reduce((sum, expense) => sum + expense.amount, 0);
+          // Update the bar chart data
+          barData.labels.push(label);
+          barData.datasets[0].data.push(sumAmount);
+          barData.datasets[0].backgroundColor.push(randomColor);
+          barData.datasets[0].borderColor.push(randomColor);
 
-            // Assign random colors for each expense type
-            const randomColor = generateRandomColor();
+          // Update the pie chart data
+          pieData.labels.push(label);
+          pieData.datasets[0].data.push(sumAmount);
+          pieData.datasets[0].backgroundColor.push(randomColor);
 
-            // Update the bar chart data
-            barData.labels.push(`${expenseType} - ${category}`);
-            barData.datasets[0].data.push(sumAmount);
-            barData.datasets[0].backgroundColor.push(randomColor);
-            barData.datasets[0].borderColor.push(randomColor);
-
-            // Update the pie chart data
-            pieData.labels.push(`${expenseType} - ${category}`);
-            pieData.datasets[0].data.push(sumAmount);
-            pieData.datasets[0].backgroundColor.push(randomColor);
-
-            // Update the line chart data
-            lineData.labels.push(`${expenseType} - ${category}`);
-            lineData.datasets[0].data.push(sumAmount);
-            lineData.datasets[0].borderColor.push(randomColor);
-          });
+          // Update the line chart data
+          lineData.labels.push(label);
+          lineData.datasets[0].data.push(sumAmount);
+          lineData.datasets[0].borderColor.push(randomColor);
         });
 
         // Ensure the datasets and labels are set correctly, prevent undefined